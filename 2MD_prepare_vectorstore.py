@@ -1,13 +1,25 @@
 import os
 import re
+import json
+import time
 import shutil
+import hashlib
+import argparse
+
+import numpy as np
 
 # นำเข้าไลบรารีที่จำเป็นจาก LangChain
 from langchain_community.document_loaders import TextLoader
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.text_splitter import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from embedding_backend import EMBEDDING_MODEL, EMBEDDING_BACKEND, OnnxEmbeddings, get_device, model_tag
+from crop_lookup import compile_crop_table, save_crop_table
+from sparse_index import BM25Index
+from faq_index import build_faq_index
+from chunk_store import chunk_store_exists, load_vectorstore_for_update, save_vectorstore
 
 # --- การตั้งค่าหลัก ---
 # ใช้ไฟล์ Markdown เป็นแหล่งข้อมูลหลัก
@@ -15,8 +27,16 @@ KB_MARKDOWN_PATH = "data/knowledge_base.md"
 QNA_MARKDOWN_PATH = "data/Q&A.md" # เพิ่มไฟล์ Q&A.md
 # ตั้งชื่อ Vector Store ให้สื่อถึงวิธีการสร้าง
 VECTORSTORE_PATH = "vectorstore_smart_chunking_v2" 
-# Embedding Model ที่ดีที่สุดสำหรับภาษาไทย
-EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
+# Embedding Model ที่ดีที่สุดสำหรับภาษาไทย (intfloat/multilingual-e5-large กำหนดไว้ใน embedding_backend.py)
+# [เพิ่ม] เลือก backend ได้ผ่านตัวแปร EMBEDDING_BACKEND=torch|onnx (ต้องใช้ backend เดียวกับ app.py)
+# [เพิ่ม] Cache ของ embedding (key = hash ของเนื้อหา chunk) และไฟล์บันทึกรูปแบบการสร้าง index เก็บไว้ข้างๆ index
+EMBEDDING_CACHE_FILE = "embedding_cache.npz"
+BUILD_MANIFEST_FILE = "build_manifest.json"
+ID_SCHEME = "content-hash-v1"
+# [เพิ่ม] ค่าตั้งต้นของขั้นตอน embed ตอนสร้าง index
+EMBED_BATCH_SIZE = 32
+EMBED_WORKERS = 1
+EMBED_TORCH_THREADS = None
 
 # --- ฟังก์ชันสำหรับกลยุทธ์การตัดแบ่ง (Chunking Strategies) ---
 
@@ -156,7 +176,8 @@ def parse_qna_markdown(text: str) -> list[Document]:
 
     return qna_docs
 
-def main():
+def main(full_rebuild: bool = False, batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS,
+         torch_threads: int | None = EMBED_TORCH_THREADS):
     """ฟังก์ชันหลักในการสร้าง Vector Store"""
     print("🚀 เริ่มต้นสร้าง Vector Store แบบ Smart Chunking...")
     
@@ -237,22 +258,241 @@ def main():
         return
 
     # --- 3. สร้าง Vector Store ---
+    build_vectorstore(all_documents, full_rebuild=full_rebuild, batch_size=batch_size, workers=workers, torch_threads=torch_threads)
+
+    # --- 4. [เพิ่ม] คอมไพล์ตารางเกณฑ์พืช (PLANTING_DENSITY + MINIMUM_AREA) สำหรับค้นหาแบบตรงตัว ---
+    # บันทึกหลังสร้าง index เพราะโหมด Full จะลบโฟลเดอร์ Vector Store ทิ้งก่อน
+    crop_table = compile_crop_table(full_text_kb)
+    if save_crop_table(crop_table, VECTORSTORE_PATH):
+        print(f"✅ บันทึกตารางเกณฑ์พืช {len(crop_table['rows'])} รายการ")
+    else:
+        print(f"✅ ตารางเกณฑ์พืชไม่มีการเปลี่ยนแปลง ({len(crop_table['rows'])} รายการ)")
+
+    # --- 5. [เพิ่ม] สร้าง Sparse Index (BM25) จาก chunk ชุดเดียวกัน (id ตรงกับ docstore ของ FAISS) สำหรับ Hybrid Retrieval ---
+    sparse_index = BM25Index.build(assign_chunk_ids(all_documents), [doc.page_content for doc in all_documents])
+    if sparse_index.save(VECTORSTORE_PATH):
+        print(f"✅ บันทึก BM25 index ({len(sparse_index.postings)} คำ, tokenizer: {sparse_index.tokenizer})")
+    else:
+        print("✅ BM25 index ไม่มีการเปลี่ยนแปลง")
+
+    # --- 6. [เพิ่ม] สร้าง FAQ index (embed เฉพาะข้อความคำถามของ Q&A แยกจาก Vector Store หลัก) สำหรับ FAQ fast path ---
+    faq_embeddings = BatchedEmbeddings(batch_size=batch_size, workers=1, torch_threads=torch_threads)
+    n_questions, n_embedded = build_faq_index(qna_documents, faq_embeddings, VECTORSTORE_PATH)
+    print(f"✅ บันทึก FAQ index {n_questions} คำถาม (embed ใหม่ {n_embedded} ข้อ)")
+
+# --- [เพิ่ม] Embedding Cache และการสร้าง Vector Store แบบ Incremental ---
+
+def content_hash(text: str) -> str:
+    """hash ของเนื้อหาที่ถูก embed (ใช้เป็น key ของ embedding cache)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def assign_chunk_ids(documents: list[Document]) -> list[str]:
+    """
+    สร้าง id ของแต่ละ chunk จาก hash ของเนื้อหา + metadata
+    chunk ที่ไม่เปลี่ยนจะได้ id เดิมทุกครั้ง (chunk ที่ซ้ำกันจะต่อท้ายด้วยลำดับ)
+    """
+    ids, seen = [], {}
+    for doc in documents:
+        key = content_hash(doc.page_content + json.dumps(doc.metadata, sort_keys=True, ensure_ascii=False))[:32]
+        seen[key] = seen.get(key, 0) + 1
+        ids.append(key if seen[key] == 1 else f"{key}-{seen[key]}")
+    return ids
+
+def load_embedding_cache(path: str) -> dict[str, np.ndarray]:
+    """โหลด embedding cache (เฉพาะที่สร้างด้วย EMBEDDING_MODEL เดียวกัน)"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        data = np.load(path, allow_pickle=False)
+        if str(data["model"]) != model_tag():
+            print("⚠️ Embedding cache สร้างจากโมเดลอื่น จะไม่นำมาใช้")
+            return {}
+        return dict(zip(data["hashes"].tolist(), data["vectors"]))
+    except (OSError, KeyError, ValueError) as e:
+        print(f"⚠️ อ่าน embedding cache ไม่ได้ ({e}) จะสร้างใหม่ทั้งหมด")
+        return {}
+
+def save_embedding_cache(path: str, cache: dict[str, np.ndarray]):
+    hashes = list(cache.keys())
+    vectors = np.vstack([cache[h] for h in hashes]).astype(np.float32) if hashes else np.zeros((0, 0), dtype=np.float32)
+    np.savez(path, hashes=np.array(hashes), vectors=vectors, model=np.array(model_tag()))
+
+class BatchedEmbeddings(Embeddings):
+    """
+    [แก้ไข] Embedding สำหรับขั้นตอนสร้าง index (แทน HuggingFaceEmbeddings ค่าเริ่มต้น)
+    - โหลดโมเดลเมื่อจำเป็นต้อง embed จริงเท่านั้น (ถ้าทุก chunk อยู่ใน cache จะไม่ต้องโหลดโมเดลเลย)
+    - เรียงข้อความตามความยาวแล้วแบ่งเป็น batch เพื่อลด padding ที่สูญเปล่า
+    - กำหนดจำนวน thread ของ torch ได้ และเลือกใช้หลาย process กระจายไปหลาย CPU core ได้
+    ผลลัพธ์ตรงกับ HuggingFaceEmbeddings ที่ app.py ใช้ (แทนที่ขึ้นบรรทัดใหม่ด้วยช่องว่าง และไม่ normalize)
+    """
+
+    def __init__(self, batch_size: int = EMBED_BATCH_SIZE, workers: int = EMBED_WORKERS, torch_threads: int | None = EMBED_TORCH_THREADS):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            if EMBEDDING_BACKEND == "onnx":
+                print(f"กำลังโหลด Embedding Model (ONNX int8): {EMBEDDING_MODEL}")
+                self._model = OnnxEmbeddings(batch_size=self.batch_size, num_threads=self.torch_threads)
+                return self._model
+
+            import torch
+            from sentence_transformers import SentenceTransformer
+
+            if self.torch_threads:
+                torch.set_num_threads(self.torch_threads)
+            print(f"กำลังโหลด Embedding Model: {EMBEDDING_MODEL}")
+            self._model = SentenceTransformer(EMBEDDING_MODEL, device=get_device())
+        return self._model
+
+    def _encode_sorted(self, model, texts: list[str]) -> np.ndarray:
+        if isinstance(model, OnnxEmbeddings):
+            # ONNX Runtime ใช้หลาย thread ภายใน session อยู่แล้ว จึงไม่ใช้ process pool
+            return model.encode(texts)
+        if self.workers > 1:
+            # แบ่ง thread ของ CPU ให้แต่ละ process เท่าๆ กัน เพื่อไม่ให้แย่ง core กันเอง
+            os.environ.setdefault("OMP_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // self.workers)))
+            pool = model.start_multi_process_pool(target_devices=["cpu"] * self.workers)
+            try:
+                return model.encode_multi_process(texts, pool, batch_size=self.batch_size)
+            finally:
+                model.stop_multi_process_pool(pool)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        encoded = []
+        for n, batch in enumerate(batches, start=1):
+            encoded.append(model.encode(batch, batch_size=len(batch), show_progress_bar=False))
+            print(f"    batch {n}/{len(batches)} ({len(batch)} chunks)", end="\r")
+        print()
+        return np.vstack(encoded)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        model = self._get_model()
+        clean_texts = [text.replace("\n", " ") for text in texts]
+        # เรียงจากยาวไปสั้น เพื่อให้ข้อความในแต่ละ batch มีความยาวใกล้กัน (padding น้อย)
+        order = sorted(range(len(clean_texts)), key=lambda i: len(clean_texts[i]), reverse=True)
+        started = time.perf_counter()
+        vectors = self._encode_sorted(model, [clean_texts[i] for i in order])
+        elapsed = time.perf_counter() - started
+        print(f"    -> embed {len(texts)} chunks ใน {elapsed:.1f} วินาที ({len(texts) / max(elapsed, 1e-9):.1f} chunks/s, "
+              f"batch={self.batch_size}, workers={self.workers})")
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        return result.tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+def embed_with_cache(texts: list[str], embeddings: Embeddings, cache: dict[str, np.ndarray]) -> tuple[list[np.ndarray], int]:
+    """คืน embedding ของทุกข้อความ โดย embed เฉพาะข้อความที่ยังไม่มีใน cache (คืนจำนวนที่ต้อง embed ใหม่ด้วย)"""
+    hashes = [content_hash(text) for text in texts]
+    missing = {}
+    for h, text in zip(hashes, texts):
+        if h not in cache:
+            missing.setdefault(h, text)
+    if missing:
+        print(f"กำลัง embed chunk ใหม่ {len(missing)} ชิ้น...")
+        vectors = embeddings.embed_documents(list(missing.values()))
+        for h, vector in zip(missing.keys(), vectors):
+            cache[h] = np.asarray(vector, dtype=np.float32)
+    return [cache[h] for h in hashes], len(missing)
+
+def read_manifest() -> dict:
+    path = os.path.join(VECTORSTORE_PATH, BUILD_MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_manifest():
+    with open(os.path.join(VECTORSTORE_PATH, BUILD_MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({"embedding_model": model_tag(), "id_scheme": ID_SCHEME}, f, ensure_ascii=False, indent=2)
+
+def build_vectorstore(all_documents: list[Document], full_rebuild: bool = False, batch_size: int = EMBED_BATCH_SIZE,
+                      workers: int = EMBED_WORKERS, torch_threads: int | None = EMBED_TORCH_THREADS):
+    """
+    สร้างหรืออัปเดต Vector Store
+    - โหมด incremental (ค่าเริ่มต้น): embed เฉพาะ chunk ที่เพิ่ม/แก้ไข ลบ chunk ที่หายไป แล้วอัปเดต FAISS index เดิม
+    - โหมด full: สร้าง index ใหม่ทั้งหมด (แต่ยังใช้ embedding cache เพื่อไม่ต้อง embed chunk ที่ไม่เปลี่ยน)
+    """
     print(f"\nกำลังสร้าง Vector Store จากเอกสารทั้งหมด {len(all_documents)} ชิ้น...")
-    
-    print(f"กำลังโหลด Embedding Model: {EMBEDDING_MODEL}")
-    # ใช้ GPU ถ้ามี, ถ้าไม่มีจะใช้ CPU อัตโนมัติ
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL, 
-        model_kwargs={'device': 'cuda' if 'CUDA_VISIBLE_DEVICES' in os.environ else 'cpu'}
+    cache_path = os.path.join(VECTORSTORE_PATH, EMBEDDING_CACHE_FILE)
+    cache = load_embedding_cache(cache_path)
+    embeddings = BatchedEmbeddings(batch_size=batch_size, workers=workers, torch_threads=torch_threads)
+    ids = assign_chunk_ids(all_documents)
+    docs_by_id = dict(zip(ids, all_documents))
+
+    manifest = read_manifest()
+    can_update = (
+        not full_rebuild
+        and manifest.get("embedding_model") == model_tag()
+        and manifest.get("id_scheme") == ID_SCHEME
+        and os.path.exists(os.path.join(VECTORSTORE_PATH, "index.faiss"))
+        and chunk_store_exists(VECTORSTORE_PATH)  # index เก่าที่ยังใช้ index.pkl จะถูกสร้างใหม่ (embedding ยังดึงจาก cache)
     )
-    
-    if os.path.exists(VECTORSTORE_PATH):
-        print(f"กำลังลบ Vector Store เก่าที่ '{VECTORSTORE_PATH}'...")
-        shutil.rmtree(VECTORSTORE_PATH)
 
-    db = FAISS.from_documents(all_documents, embeddings)
-    db.save_local(VECTORSTORE_PATH)
+    if can_update:
+        print("โหมด Incremental: อัปเดตเฉพาะ chunk ที่เปลี่ยนแปลง")
+        db = load_vectorstore_for_update(VECTORSTORE_PATH, embeddings)
+        existing_ids = set(db.index_to_docstore_id.values())
+        removed_ids = [doc_id for doc_id in existing_ids if doc_id not in docs_by_id]
+        added_ids = [doc_id for doc_id in ids if doc_id not in existing_ids]
+        reused = len(ids) - len(added_ids)
+
+        if not removed_ids and not added_ids:
+            print(f"✅ ไม่มีการเปลี่ยนแปลง (ใช้ซ้ำ {reused} chunks) ไม่ต้องบันทึก Vector Store ใหม่")
+            return
+
+        if removed_ids:
+            db.delete(removed_ids)
+        newly_embedded = 0
+        if added_ids:
+            added_docs = [docs_by_id[doc_id] for doc_id in added_ids]
+            texts = [doc.page_content for doc in added_docs]
+            vectors, newly_embedded = embed_with_cache(texts, embeddings, cache)
+            db.add_embeddings(
+                list(zip(texts, [v.tolist() for v in vectors])),
+                metadatas=[doc.metadata for doc in added_docs],
+                ids=added_ids,
+            )
+    else:
+        print("โหมด Full: สร้าง index ใหม่ทั้งหมด")
+        reused, added_ids = 0, ids
+        removed_ids = []
+        texts = [doc.page_content for doc in all_documents]
+        vectors, newly_embedded = embed_with_cache(texts, embeddings, cache)
+
+        if os.path.exists(VECTORSTORE_PATH):
+            print(f"กำลังลบ Vector Store เก่าที่ '{VECTORSTORE_PATH}'...")
+            shutil.rmtree(VECTORSTORE_PATH)
+
+        db = FAISS.from_embeddings(
+            list(zip(texts, [v.tolist() for v in vectors])),
+            embeddings,
+            metadatas=[doc.metadata for doc in all_documents],
+            ids=ids,
+        )
+
+    # [แก้ไข] บันทึกเนื้อหา chunk ลง chunks.db (SQLite) แทน index.pkl เพื่อให้ตอนให้บริการอ่านเฉพาะ chunk ที่ค้นเจอ
+    save_vectorstore(db, VECTORSTORE_PATH)
+    # เก็บเฉพาะ embedding ของ chunk ปัจจุบัน เพื่อไม่ให้ cache โตไม่สิ้นสุด
+    current_hashes = {content_hash(doc.page_content) for doc in all_documents}
+    save_embedding_cache(cache_path, {h: v for h, v in cache.items() if h in current_hashes})
+    write_manifest()
+
     print(f"✅ สร้าง Vector Store (Smart Chunking v2) เสร็จสิ้น! บันทึกไว้ที่: {VECTORSTORE_PATH}")
+    print(f"   สรุป: ใช้ซ้ำ {reused} chunks, เพิ่ม {len(added_ids)} chunks, ลบ {len(removed_ids)} chunks "
+          f"(embed ใหม่จริง {newly_embedded} ชิ้น, ที่เหลือดึงจาก cache)")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="สร้าง Vector Store แบบ Smart Chunking")
+    parser.add_argument("--full", action="store_true", help="สร้าง index ใหม่ทั้งหมดแทนการอัปเดตแบบ incremental")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="จำนวน chunk ต่อ batch ตอน embed")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS, help="จำนวน process ที่ใช้ embed พร้อมกัน (1 = process เดียว)")
+    parser.add_argument("--threads", type=int, default=EMBED_TORCH_THREADS, help="จำนวน thread ของ torch (ค่าเริ่มต้น = ตามที่ torch กำหนด)")
+    args = parser.parse_args()
+    main(full_rebuild=args.full, batch_size=args.batch_size, workers=args.workers, torch_threads=args.threads)
\ No newline at end of file
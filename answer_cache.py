@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Semantic Answer Cache ---
+# เก็บคำตอบของคำถามที่ถูกถามบ่อย โดยใช้ embedding ของ "คำถามที่ถูกแปลงแล้ว" (standalone question) เป็น key
+# ถ้าคำถามใหม่มีความคล้าย (cosine similarity) เกินค่าที่กำหนด จะคืนคำตอบเดิมทันทีโดยไม่ต้องเรียก LLM
+# ไฟล์เป็น JSON Lines: บรรทัดแรกเป็น header (version, fingerprint) ตามด้วย entry ละบรรทัด
+# put() ต่อท้ายไฟล์ทีละ entry ใน thread เบื้องหลัง (lookup/put ไม่แตะดิสก์) และเขียนใหม่ทั้งไฟล์เมื่อมี entry ที่ถูกตัดทิ้งสะสมมาก
+
+CACHE_FORMAT_VERSION = 2
+
+
+def vectorstore_fingerprint(vectorstore_path: str) -> str:
+    """
+    สร้างลายนิ้วมือของ Vector Store จากขนาดและเวลาแก้ไขของไฟล์ทั้งหมดในโฟลเดอร์
+    ถ้ามีการสร้าง Vector Store ใหม่ ค่านี้จะเปลี่ยน และ cache ทั้งหมดจะถูกล้าง
+    """
+    if not os.path.isdir(vectorstore_path):
+        return ""
+    parts = []
+    for name in sorted(os.listdir(vectorstore_path)):
+        path = os.path.join(vectorstore_path, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            parts.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(parts)
+
+
+def _normalize(vector) -> np.ndarray:
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+
+class SemanticAnswerCache:
+    """
+    Cache คำตอบแบบ semantic ที่มี TTL และ LRU eviction และบันทึกลงไฟล์ JSON Lines
+    - lookup(vector): คืน entry (dict ที่มี answer, context, question) ถ้าพบคำถามที่คล้ายพอ
+    - put(vector, question, answer, context): เพิ่มคำตอบใหม่ลง cache
+    ตรวจ fingerprint ของ Vector Store อย่างมากทุก fingerprint_check_seconds (ไม่ใช่ทุกคำถาม)
+    """
+
+    def __init__(self, cache_path: str, vectorstore_path: str, threshold: float = 0.95,
+                 ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 500, fingerprint_check_seconds: float = 30.0):
+        self.cache_path = cache_path
+        self.vectorstore_path = vectorstore_path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._matrix = None  # เมทริกซ์ embedding ที่ normalize แล้ว (สร้างใหม่เมื่อ entries เปลี่ยน)
+        self._matrix_keys: list[str] = []
+        self._next_id = 0
+        self.fingerprint_check_seconds = fingerprint_check_seconds
+        self._fingerprint = vectorstore_fingerprint(vectorstore_path)
+        self._fingerprint_checked_at = time.monotonic()
+        self._logged_entries = 0  # จำนวน entry ในไฟล์ (รวมที่ถูกตัดทิ้งไปแล้ว) ใช้ตัดสินใจว่าควรเขียนใหม่ทั้งไฟล์
+        self._load()
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._run_writer, name="answer-cache-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # --- การจัดการไฟล์ ---
+
+    def _load(self):
+        if not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                if header.get("version") != CACHE_FORMAT_VERSION or header.get("fingerprint") != self._fingerprint:
+                    print("♻️ Vector Store ถูกสร้างใหม่ (หรือไฟล์ cache เป็นรูปแบบเก่า) ล้าง answer cache เดิมทิ้ง")
+                    return
+                lines = f.readlines()
+        except (OSError, ValueError) as e:
+            print(f"⚠️ อ่านไฟล์ answer cache ไม่ได้ ({e}) จะเริ่มต้น cache ใหม่")
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # บรรทัดสุดท้ายที่เขียนไม่ครบ (process ถูกปิดกลางคัน)
+            entry["vector"] = _normalize(entry["vector"])
+            self._entries[entry["id"]] = entry
+            self._next_id = max(self._next_id, int(entry["id"]) + 1)
+        self._logged_entries = len(lines)
+        self._expire(time.time())
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._matrix = None
+
+    @staticmethod
+    def _entry_line(entry: dict) -> str:
+        data = {**entry, "vector": [round(float(v), 6) for v in entry["vector"]]}
+        return json.dumps(data, ensure_ascii=False) + "\n"
+
+    def _header_line(self) -> str:
+        return json.dumps({"version": CACHE_FORMAT_VERSION, "fingerprint": self._fingerprint}) + "\n"
+
+    def _append(self, entry: dict):
+        new_file = not os.path.exists(self.cache_path)
+        if new_file:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        with open(self.cache_path, "a", encoding="utf-8") as f:
+            if new_file:
+                f.write(self._header_line())
+            f.write(self._entry_line(entry))
+
+    def _rewrite(self):
+        """เขียนไฟล์ใหม่เฉพาะ entry ที่ยังอยู่ใน cache (snapshot ใต้ lock, แปลงเป็น JSON นอก lock)"""
+        with self._lock:
+            header = self._header_line()
+            entries = list(self._entries.values())
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(header)
+            f.writelines(self._entry_line(entry) for entry in entries)
+        os.replace(tmp_path, self.cache_path)
+        with self._lock:
+            self._logged_entries = len(entries)
+
+    def _run_writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            op, entry = item
+            try:
+                if op == "append":
+                    self._append(entry)
+                else:
+                    self._rewrite()
+            except OSError as e:
+                print(f"⚠️ บันทึก answer cache ไม่สำเร็จ: {e}")
+
+    def close(self, timeout: float = 10.0):
+        """เขียนสิ่งที่ค้างอยู่ให้หมดแล้วหยุด thread เบื้องหลัง (เรียกซ้ำได้)"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
+
+    # --- ตรรกะภายใน (ต้องถือ lock ก่อนเรียก) ---
+
+    def _check_fingerprint(self):
+        now = time.monotonic()
+        if now - self._fingerprint_checked_at < self.fingerprint_check_seconds:
+            return
+        self._fingerprint_checked_at = now
+        fingerprint = vectorstore_fingerprint(self.vectorstore_path)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            self._entries.clear()
+            self._matrix = None
+            self._queue.put(("rewrite", None))
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _ensure_matrix(self):
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            if self._matrix_keys:
+                self._matrix = np.vstack([self._entries[key]["vector"] for key in self._matrix_keys])
+            else:
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    # --- API หลัก ---
+
+    def lookup(self, vector) -> dict | None:
+        """ค้นหาคำตอบที่ cache ไว้ซึ่งคำถามคล้ายกับ vector ที่ให้มา (คืน None ถ้าไม่พบ)"""
+        query = _normalize(vector)
+        with self._lock:
+            self._check_fingerprint()
+            self._expire(time.time())
+            self._ensure_matrix()
+            if not self._matrix_keys:
+                self.misses += 1
+                return None
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            key = self._matrix_keys[best]
+            self._entries.move_to_end(key)  # LRU: ย้ายไปท้ายสุด (ใช้ล่าสุด)
+            entry = self._entries[key]
+            entry["hit_count"] = entry.get("hit_count", 0) + 1
+            self.hits += 1
+            return {
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "context": entry["context"],
+                "similarity": float(scores[best]),
+            }
+
+    def put(self, vector, question: str, answer: str, context: str):
+        """เพิ่มคำตอบลง cache และตัด entry ที่เก่าที่สุดทิ้งถ้าเกินจำนวนที่กำหนด"""
+        with self._lock:
+            self._check_fingerprint()
+            key = str(self._next_id)
+            self._next_id += 1
+            entry = {
+                "id": key,
+                "question": question,
+                "answer": answer,
+                "context": context,
+                "vector": _normalize(vector),
+                "created_at": time.time(),
+                "hit_count": 0,
+            }
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+            self._logged_entries += 1
+            # ไฟล์มี entry ที่ถูกตัดทิ้งแล้วมากกว่าที่ยังใช้อยู่ จึงเขียนใหม่ทั้งไฟล์ (ไม่อย่างนั้นต่อท้ายบรรทัดเดียว)
+            compact = self._logged_entries > 2 * max(len(self._entries), self.max_entries // 2)
+        self._queue.put(("rewrite", None) if compact else ("append", entry))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+        self._queue.put(("rewrite", None))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
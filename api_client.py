@@ -0,0 +1,39 @@
+import json
+
+import requests
+
+# --- Client สำหรับเรียก Headless API (api_server.py) ---
+# ใช้โดย app.py เมื่อตั้งค่า RAG_API_URL เพื่อให้ Streamlit เป็นเพียง client ตัวหนึ่งของ API
+
+
+def chat(base_url: str, question: str, session_id: str, timeout: float = 120) -> dict:
+    """เรียก POST /chat แล้วคืน dict ที่มี answer และ context"""
+    response = requests.post(
+        f"{base_url.rstrip('/')}/chat",
+        json={"question": question, "session_id": session_id},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def stream_chat(base_url: str, question: str, session_id: str, timeout: float = 120):
+    """
+    เรียก POST /chat/stream แล้วคืน generator ของ (event, data)
+    event เป็นหนึ่งใน context / token / done / error
+    """
+    with requests.post(
+        f"{base_url.rstrip('/')}/chat/stream",
+        json={"question": question, "session_id": session_id},
+        stream=True,
+        timeout=timeout,
+    ) as response:
+        response.raise_for_status()
+        response.encoding = "utf-8"  # ป้องกัน requests เดา encoding ผิดเป็น ISO-8859-1 (ภาษาไทยจะเพี้ยน)
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event:
+                yield event, json.loads(line[len("data:"):].strip())
+                event = None
@@ -0,0 +1,300 @@
+import os
+import sys
+import json
+import uuid
+import hmac
+import signal
+import socket
+import argparse
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+import rag_pipeline
+from rag_pipeline import (
+    VECTORSTORE_PATH, KEY_RPM_LIMIT, KEY_TPM_LIMIT, ANSWER_CACHE_ENABLED, ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES, METRICS_DB_PATH,
+)
+from answer_cache import SemanticAnswerCache
+from query_routing import PathCounter
+from key_pool import ApiKeyPool, PooledChatModel
+from metrics_store import MetricsStore
+from memory_report import process_memory
+from warmup import StartupWarmup
+
+# --- Headless HTTP API สำหรับ RAG Chain (สำหรับ LINE/Facebook bot, ตู้ kiosk และ Streamlit) ---
+# โหลด FAISS และ e5 model ครั้งเดียวตอนเริ่ม server แล้วให้บริการทั้งแบบ JSON และ SSE streaming
+# รัน: python api_server.py --port 8000   (หรือ uvicorn api_server:app)
+# หลาย worker: python api_server.py --workers 4   (โหลดโมเดลครั้งเดียวใน parent แล้ว fork ให้ทุก worker แชร์หน่วยความจำ)
+# /stats, /metrics, /memory ต้องส่ง header "Authorization: Bearer <RAG_ADMIN_TOKEN>" (ถ้าไม่ได้ตั้ง token เรียกได้จาก localhost เท่านั้น)
+
+RAG_ADMIN_TOKEN = os.getenv("RAG_ADMIN_TOKEN", "")
+LOCAL_HOSTS = {"127.0.0.1", "::1", "localhost"}
+
+load_dotenv()
+
+resources = {}
+preloaded = {}  # ทรัพยากรที่โหลดใน parent ก่อน fork (worker ใช้ร่วมกันแบบ copy-on-write)
+
+
+def preload_shared_resources():
+    """
+    โหลด Vector Store (index.faiss แบบ mmap) และ Embedding Model ใน parent ก่อน fork
+    ห้าม encode ใน parent ก่อน fork: thread pool ของ OpenMP ที่สร้างแล้วจะทำให้ worker ค้างได้
+    """
+    print(f"กำลังโหลด Vector Store และ Embedding Model ใน parent จาก '{VECTORSTORE_PATH}' (แชร์ให้ทุก worker)...")
+    preloaded["db"] = rag_pipeline.load_vector_store(VECTORSTORE_PATH)
+
+
+def load_resources(startup: StartupWarmup, api_keys: list[str]):
+    """โหลดทรัพยากรทั้งหมดใน background thread (server รับ /health ได้ระหว่างนี้ และตอบ 503 ให้ /chat จนกว่าจะพร้อม)"""
+    with startup.phase("load_vector_store"):
+        db = preloaded.get("db")
+        if db is None:
+            print(f"กำลังโหลด Vector Store จาก '{VECTORSTORE_PATH}'...")
+            db = rag_pipeline.load_vector_store(VECTORSTORE_PATH)
+    with startup.phase("build_chain"):
+        _build_resources(db, api_keys)
+    print("✅ API server พร้อมให้บริการ")
+
+
+def _build_resources(db, api_keys: list[str]):
+    history_store = rag_pipeline.make_history_store()  # สร้างหลัง fork (thread เขียน history ของแต่ละ worker)
+    key_pool = ApiKeyPool(api_keys, rpm_limit=KEY_RPM_LIMIT, tpm_limit=KEY_TPM_LIMIT)
+    answer_cache = SemanticAnswerCache(
+        ANSWER_CACHE_PATH,
+        VECTORSTORE_PATH,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ) if ANSWER_CACHE_ENABLED else None
+    rewriter_path_stats = PathCounter()
+    speculation_stats = PathCounter()
+    metrics_store = MetricsStore(METRICS_DB_PATH)
+    context_packer = rag_pipeline.make_context_packer(db)
+    reranker = rag_pipeline.make_reranker()
+    faq_index = rag_pipeline.load_faq_index(VECTORSTORE_PATH)
+    llm = PooledChatModel(key_pool, rag_pipeline.make_gemini_llm)
+    history_compactor = rag_pipeline.make_history_compactor(llm)
+
+    resources.update(
+        db=db,
+        history_store=history_store,
+        key_pool=key_pool,
+        answer_cache=answer_cache,
+        rewriter_path_stats=rewriter_path_stats,
+        speculation_stats=speculation_stats,
+        metrics_store=metrics_store,
+        context_packer=context_packer,
+        reranker=reranker,
+        faq_index=faq_index,
+        history_compactor=history_compactor,
+        chain=rag_pipeline.build_rag_chain(
+            rag_pipeline.make_retriever(db),
+            llm,
+            history_store.get,
+            answer_cache=answer_cache,
+            rewriter_path_stats=rewriter_path_stats,
+            crop_table=rag_pipeline.load_crop_table(VECTORSTORE_PATH),
+            sparse_index=rag_pipeline.load_sparse_index(VECTORSTORE_PATH),
+            context_packer=context_packer,
+            reranker=reranker,
+            faq_index=faq_index,
+            history_compactor=history_compactor,
+            speculation_stats=speculation_stats,
+        ),
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """เริ่มโหลดทรัพยากรเบื้องหลังแล้วเปิดรับ request ทันที (ดูความคืบหน้าได้ที่ /health)"""
+    api_keys = rag_pipeline.load_api_keys()
+    if not api_keys:
+        raise RuntimeError("ไม่พบ Google API Key ใดๆ ในไฟล์ .env! กรุณาตรวจสอบ")
+    resources["startup"] = StartupWarmup(lambda startup: load_resources(startup, api_keys), name="api-startup").start()
+    yield
+    history_store = resources.get("history_store")
+    if hasattr(history_store, "close"):
+        history_store.close()  # เขียน history ที่ค้างอยู่ให้หมดก่อนปิด
+    resources.clear()
+
+
+app = FastAPI(title="Farmer Registration Chatbot API", lifespan=lifespan)
+
+
+class ChatRequest(BaseModel):
+    question: str
+    session_id: str | None = None  # ถ้าไม่ส่งมา server จะสร้างให้ และผู้เรียกควรส่งค่าเดิมกลับมาในคำถามถัดไป
+
+
+def _require_ready():
+    startup = resources["startup"]
+    if not startup.done or startup.error is not None:
+        status = startup.stats()
+        raise HTTPException(status_code=503, detail={"status": status["status"], "phase": status["current_phase"],
+                                                     "error": status["error"]})
+
+
+def require_admin(request: Request):
+    """endpoint สำหรับผู้ดูแล: ต้องมี Bearer token ที่ตรงกับ RAG_ADMIN_TOKEN (ถ้าไม่ได้ตั้ง อนุญาตเฉพาะ localhost)"""
+    if RAG_ADMIN_TOKEN:
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(token, RAG_ADMIN_TOKEN):
+            return
+        raise HTTPException(status_code=401, detail="ต้องใช้ admin token")
+    if request.client is None or request.client.host not in LOCAL_HOSTS:
+        raise HTTPException(status_code=403, detail="ตั้งค่า RAG_ADMIN_TOKEN เพื่อเรียกจากเครื่องอื่น")
+
+
+def _prepare(request: ChatRequest) -> tuple[str, dict, dict]:
+    _require_ready()
+    question = request.question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="question ต้องไม่เป็นค่าว่าง")
+    session_id = request.session_id or uuid.uuid4().hex
+    config, _ = rag_pipeline.make_turn_config(session_id, resources["metrics_store"])
+    return session_id, {"question": question}, config
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.get("/health")
+async def health():
+    """สถานะการโหลด: loading (พร้อม phase ที่กำลังทำ), ready หรือ failed (HTTP 503 ถ้ายังไม่พร้อม)"""
+    startup = resources["startup"].stats()
+    body = {"status": "ok" if startup["status"] == "ready" else startup["status"], "startup": startup}
+    if startup["status"] != "ready":
+        raise HTTPException(status_code=503, detail=body)
+    return body
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest):
+    """ตอบคำถามแบบรอคำตอบเต็ม แล้วคืนเป็น JSON"""
+    session_id, chain_input, config = _prepare(request)
+    response = await resources["chain"].ainvoke(chain_input, config=config)
+    return {
+        "session_id": session_id,
+        "answer": response.get("answer", ""),
+        "context": response.get("context", ""),
+    }
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    ตอบคำถามแบบ Server-Sent Events:
+    event: context (ข้อมูลอ้างอิง) -> event: token (ทยอยส่งคำตอบ) -> event: done (คำตอบเต็ม) หรือ event: error
+    """
+    session_id, chain_input, config = _prepare(request)
+
+    async def event_stream():
+        answer_parts = []
+        try:
+            async for chunk in resources["chain"].astream(chain_input, config=config):
+                if "context" in chunk:
+                    yield _sse("context", {"context": chunk["context"]})
+                if "answer" in chunk:
+                    answer_parts.append(chunk["answer"])
+                    yield _sse("token", {"text": chunk["answer"]})
+            yield _sse("done", {"session_id": session_id, "answer": "".join(answer_parts)})
+        except Exception as e:
+            yield _sse("error", {"session_id": session_id, "error": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/stats", dependencies=[Depends(require_admin)])
+async def stats():
+    _require_ready()
+    answer_cache = resources.get("answer_cache")
+    return {
+        "rewriter_paths": resources["rewriter_path_stats"].snapshot(),
+        "speculative_retrieval": resources["speculation_stats"].snapshot(),
+        "sessions": resources["history_store"].stats(),
+        "api_keys": resources["key_pool"].stats(),
+        "query_embedding_cache": resources["db"].embeddings.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "context_packer": resources["context_packer"].stats() if resources["context_packer"] else None,
+        "reranker": resources["reranker"].stats() if resources["reranker"] else None,
+        "faq_fast_path": resources["faq_index"].stats() if resources["faq_index"] else None,
+        "history_compaction": resources["history_compactor"].stats() if resources["history_compactor"] else None,
+    }
+
+
+@app.get("/metrics", dependencies=[Depends(require_admin)])
+async def metrics(window_hours: float = 24):
+    """สรุป p50/p95/p99 ของเวลาแต่ละขั้นตอน, token และขนาด context ในช่วงเวลาล่าสุด"""
+    _require_ready()
+    return resources["metrics_store"].summary(window_seconds=window_hours * 3600)
+
+
+@app.get("/memory", dependencies=[Depends(require_admin)])
+async def memory():
+    """หน่วยความจำของ worker ที่ตอบ request นี้ (RSS/PSS/ส่วนที่แชร์ กับ process อื่น, MB)"""
+    return process_memory()
+
+
+def serve_preforked(host: str, port: int, workers: int):
+    """
+    เปิด socket ครั้งเดียวใน parent แล้ว fork เป็น worker หลายตัวที่รับ connection จาก socket เดียวกัน
+    history ใช้ร่วมกันทุก worker ผ่านฐานข้อมูล (HISTORY_BACKEND=sql) ถ้าตั้งเป็น memory แต่ละ worker จะเห็นเฉพาะ history ของตัวเอง
+    """
+    import uvicorn
+
+    if not hasattr(os, "fork"):
+        raise SystemExit("--workers มากกว่า 1 ใช้ได้เฉพาะระบบที่รองรับ fork (Linux/macOS)")
+    sock = socket.create_server((host, port), reuse_port=False)
+    sock.set_inheritable(True)
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            if "torch" in sys.modules:
+                # แบ่ง CPU core ให้แต่ละ worker เท่าๆ กัน เพื่อไม่ให้ encode แย่ง core กันเอง
+                sys.modules["torch"].set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+            uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
+            os._exit(0)
+        children.append(pid)
+    print(f"✅ เริ่ม {workers} workers (pid: {', '.join(map(str, children))}) ที่ http://{host}:{port}")
+
+    def stop_children(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_children)
+    signal.signal(signal.SIGINT, stop_children)
+    for child in children:
+        os.waitpid(child, 0)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="รัน Headless HTTP API ของแชตบอท")
+    parser.add_argument("--host", default=os.getenv("RAG_API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RAG_API_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("RAG_API_WORKERS", "1")))
+    parser.add_argument("--preload", action=argparse.BooleanOptionalAction, default=None,
+                        help="โหลดโมเดลใน parent ก่อน fork (ค่าเริ่มต้น: เปิดเมื่อ --workers มากกว่า 1)")
+    args = parser.parse_args()
+
+    if args.preload if args.preload is not None else args.workers > 1:
+        preload_shared_resources()
+    if args.workers > 1:
+        serve_preforked(args.host, args.port, args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
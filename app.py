@@ -1,188 +1,268 @@
 import streamlit as st
 import os
-import random
+import itertools
+import uuid
 from dotenv import load_dotenv
 
-# --- ส่วนที่ต้องใช้จาก LangChain และ Google ---
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
+# --- ส่วนที่ต้องใช้จาก LangChain ---
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.chat_history import InMemoryChatMessageHistory
-from langchain_core.runnables import RunnablePassthrough, RunnableParallel
-from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import StrOutputParser
-from langchain.schema import Document
+from langchain_core.chat_history import BaseChatMessageHistory
+
+# [แก้ไข] ย้ายการประกอบ Chain ไปไว้ที่ rag_pipeline.py เพื่อให้ใช้ร่วมกับสคริปต์อื่นได้ (ไม่ขึ้นกับ Streamlit)
+import rag_pipeline
+from rag_pipeline import (
+    VECTORSTORE_PATH, KEY_RPM_LIMIT, KEY_TPM_LIMIT, ANSWER_CACHE_ENABLED, ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES, METRICS_DB_PATH,
+)
+from answer_cache import SemanticAnswerCache
+from query_routing import PathCounter
+from key_pool import ApiKeyPool, PooledChatModel
+from async_runtime import BackgroundEventLoop
+from metrics_store import MetricsStore
+from warmup import StartupWarmup
+import api_client
 
 # --- โหลดค่าตั้งค่าและโมเดล ---
 load_dotenv()
-api_keys = [key for key in os.environ.keys() if key.startswith("GOOGLE_API_KEY")]
-api_key_pool = [os.getenv(key) for key in api_keys if os.getenv(key)]
 
-if not api_key_pool:
+# [เพิ่ม] ถ้าตั้งค่า RAG_API_URL ไว้ Streamlit จะเป็นเพียง client ที่เรียก api_server.py (ไม่โหลดโมเดลเอง)
+RAG_API_URL = os.getenv("RAG_API_URL", "")
+
+api_key_pool = rag_pipeline.load_api_keys()
+
+if not api_key_pool and not RAG_API_URL:
     st.error("ไม่พบ Google API Key ใดๆ ในไฟล์ .env! กรุณาตรวจสอบ")
     st.stop()
 
-VECTORSTORE_PATH = "vectorstore_smart_chunking_v2" 
-EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
-LLM_MODEL = "gemini-2.5-flash" 
+# [เพิ่ม] โหมด Streaming: ทยอยแสดงคำตอบทันทีที่ Gemini สร้าง token ออกมา (ลดเวลารอ token แรก)
+STREAMING_MODE = True
+
+# [เพิ่ม] แสดงเวลาของแต่ละขั้นตอนใน Expander ข้อมูลอ้างอิง (สำหรับผู้ดูแลระบบ ตั้งค่า SHOW_STAGE_TIMINGS=1 ใน .env)
+SHOW_STAGE_TIMINGS = os.getenv("SHOW_STAGE_TIMINGS", "0") == "1"
 
-# [เพิ่ม] กำหนดค่าคงที่สำหรับขนาดของ history เพื่อให้ง่ายต่อการปรับแก้..
-MAX_HISTORY_MESSAGES = 6
+# [เพิ่ม] แสดงสถิติระบบและเวลาเริ่มระบบใน sidebar (มีสถานะ API key และ metrics ภายใน จึงเปิดเฉพาะผู้ดูแลระบบ: SHOW_ADMIN_STATS=1)
+SHOW_ADMIN_STATS = os.getenv("SHOW_ADMIN_STATS", "0") == "1"
+
+# [เพิ่ม] เริ่มระบบแบบเร็ว: แสดงหน้าเว็บทันที แล้วโหลด Vector Store + Embedding Model ใน background thread
+# (ปิดด้วย FAST_STARTUP=0 เพื่อโหลดทุกอย่างให้เสร็จก่อนแสดงหน้าเว็บแบบเดิม)
+FAST_STARTUP = os.getenv("FAST_STARTUP", "1") == "1"
 
 # --- ฟังก์ชันหลัก (Cached) ---
 
 @st.cache_resource
 def load_vector_store():
     """โหลด Vector Store ที่สร้างไว้แล้ว"""
-    if not os.path.exists(VECTORSTORE_PATH):
-        st.error(f"ไม่พบฐานข้อมูล Vector Store ที่ '{VECTORSTORE_PATH}'! กรุณารันไฟล์ prepare_vectorstore.py ก่อน")
-        return None
     try:
-        embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs={'device': 'cuda' if 'CUDA_VISIBLE_DEVICES' in os.environ else 'cpu'})
-        db = FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
-        return db
+        return rag_pipeline.load_vector_store(VECTORSTORE_PATH)
+    except FileNotFoundError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"เกิดข้อผิดพลาดในการโหลด Vector Store: {e}")
         return None
 
-store = {}
+def load_in_background(startup: StartupWarmup):
+    """[เพิ่ม] ขั้นตอนที่ช้าที่สุดตอนเริ่มระบบ (รันใน background thread จึงห้ามเรียกคำสั่ง st.* ในนี้)"""
+    with startup.phase("imports"):
+        rag_pipeline.import_heavy_modules()
+    with startup.phase("load_embeddings"):
+        embeddings = rag_pipeline.load_query_embeddings()
+    with startup.phase("load_vector_store"):
+        db = rag_pipeline.load_vector_store(VECTORSTORE_PATH, embeddings)
+    with startup.phase("warm_encoder"):
+        query_vector = rag_pipeline.warm_up_encoder(embeddings)
+    with startup.phase("warm_index"):
+        rag_pipeline.warm_up_vector_store(db, query_vector)
+    return db
+
+@st.cache_resource(show_spinner=False)
+def get_startup():
+    """[เพิ่ม] เริ่มโหลดทรัพยากรใน background ครั้งเดียวต่อ process (ทุก session รอผลจากตัวเดียวกัน)"""
+    return StartupWarmup(load_in_background).start()
+
+@st.cache_resource
+def get_event_loop():
+    """[เพิ่ม] Event loop กลางสำหรับรัน chain แบบ async (ใช้ร่วมกันทุก session)"""
+    return BackgroundEventLoop()
+
+@st.cache_resource
+def load_answer_cache():
+    """[เพิ่ม] โหลด Semantic Answer Cache (ใช้ร่วมกันทุก session)"""
+    return SemanticAnswerCache(
+        ANSWER_CACHE_PATH,
+        VECTORSTORE_PATH,
+        threshold=ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    )
+
+@st.cache_resource
+def load_crop_table():
+    """[เพิ่ม] โหลดตารางเกณฑ์พืช (จำนวนต้นต่อไร่/พื้นที่ขั้นต่ำ) สำหรับค้นหาแบบตรงตัว (None ถ้ายังไม่ได้สร้าง)"""
+    return rag_pipeline.load_crop_table(VECTORSTORE_PATH)
+
+@st.cache_resource
+def load_sparse_index():
+    """[เพิ่ม] โหลด BM25 index สำหรับ Hybrid Retrieval (None ถ้ายังไม่ได้สร้าง จะค้นด้วย FAISS อย่างเดียว)"""
+    return rag_pipeline.load_sparse_index(VECTORSTORE_PATH)
+
+@st.cache_resource
+def get_context_packer(_db):
+    """[เพิ่ม] ตัวจัดเอกสารอ้างอิงให้อยู่ในงบ token (ใช้ร่วมกันทุก session เพื่อสะสมสถิติ token ที่ประหยัดได้)"""
+    return rag_pipeline.make_context_packer(_db)
+
+@st.cache_resource
+def get_reranker():
+    """[เพิ่ม] Cross-encoder reranker (เปิดด้วย RERANK_ENABLED=1; cache คะแนนใช้ร่วมกันทุก session)"""
+    return rag_pipeline.make_reranker()
+
+@st.cache_resource
+def load_faq_index():
+    """[เพิ่ม] โหลด FAQ index (คำถามจาก Q&A.md) สำหรับตอบคำถามที่พบบ่อยโดยไม่ต้องเรียก LLM"""
+    return rag_pipeline.load_faq_index(VECTORSTORE_PATH)
+
+@st.cache_resource
+def get_metrics_store():
+    """[เพิ่ม] ที่เก็บเวลาของแต่ละขั้นตอนต่อรอบคำถาม (SQLite ใช้ร่วมกันทุก session)"""
+    return MetricsStore(METRICS_DB_PATH)
+
+@st.cache_resource
+def get_rewriter_path_stats():
+    """[เพิ่ม] ตัวนับว่าแต่ละคำถามใช้เส้นทางไหน (no_history / self_contained / rewriter)"""
+    return PathCounter()
+
+@st.cache_resource
+def get_speculation_stats():
+    """[เพิ่ม] ตัวนับผลของ speculative retrieval (reused = ใช้ผลที่ค้นล่วงหน้าได้เลย / merged / unused)"""
+    return PathCounter()
+
+@st.cache_resource
+def get_history_store():
+    """
+    [เพิ่ม] ที่เก็บ history ของทุก session (จำกัดจำนวน session, เวลา idle และขนาดหน่วยความจำ)
+    [แก้ไข] ค่าเริ่มต้นเก็บลงฐานข้อมูล (HISTORY_BACKEND=sql) บทสนทนาจึงไม่หายเมื่อ restart และใช้ร่วมกันได้หลาย replica
+    """
+    return rag_pipeline.make_history_store()
+
 # [แก้ไข] ปรับปรุงฟังก์ชันนี้เพื่อจำกัดขนาดของ history (Sliding Window)
-def get_session_history(session_id: str) -> InMemoryChatMessageHistory:
+def get_session_history(session_id: str) -> BaseChatMessageHistory:
     """
     ดึงประวัติการแชตสำหรับ session ปัจจุบัน และจัดการขนาดของ history
-    เพื่อให้ไม่เกินจำนวนที่กำหนด
+    เพื่อให้ไม่เกินจำนวนที่กำหนด (ตัดให้เหลือ MAX_HISTORY_MESSAGES ข้อความล่าสุดภายใน store)
     """
-    if session_id not in store:
-        store[session_id] = InMemoryChatMessageHistory()
-    
-    # ดึง history object ทั้งหมดออกมาจาก store
-    session_history = store[session_id]
-    
-    # ตรวจสอบขนาดของ history และตัดให้เหลือแค่ k ข้อความล่าสุด
-    # การทำแบบนี้จะแก้ไขที่ตัว object ใน store โดยตรง ทำให้ history ไม่สะสมยาวเกินไป
-    if len(session_history.messages) > MAX_HISTORY_MESSAGES:
-        session_history.messages = session_history.messages[-MAX_HISTORY_MESSAGES:]
-        
-    return session_history
-
-def format_docs(docs: list[Document]) -> str:
-    """จัดรูปแบบเอกสารที่ค้นเจอให้เป็นข้อความเดียวเพื่อง่ายต่อการอ่านของ LLM"""
-    formatted_docs = []
-    for i, doc in enumerate(docs):
-        source = doc.metadata.get("source", "ไม่ระบุ")
-        content = doc.page_content
-        formatted_docs.append(f"เอกสารอ้างอิงชิ้นที่ {i+1} (ที่มา: {source}):\n{content}")
-    return "\n\n---\n\n".join(formatted_docs)
+    return get_history_store().get(session_id)
+
+@st.cache_resource
+def get_key_pool():
+    """[เพิ่ม] ตัวจัดสรร API key กลาง (ใช้ร่วมกันทุก session เพื่อให้นับโควต้าของแต่ละ key ได้ถูกต้อง)"""
+    return ApiKeyPool(api_key_pool, rpm_limit=KEY_RPM_LIMIT, tpm_limit=KEY_TPM_LIMIT)
+
+@st.cache_resource
+def get_history_compactor():
+    """[เพิ่ม] ตัวย่อ history ตามงบ token (สรุปข้อความเก่าเบื้องหลังและ cache ต่อ session ใช้ร่วมกันทุก session)"""
+    return rag_pipeline.make_history_compactor(PooledChatModel(get_key_pool(), rag_pipeline.make_gemini_llm))
 
 @st.cache_resource
 def get_chains(_retriever):
     """สร้าง Chains ทั้งหมด (Rewriter + RAG)"""
-    st.write("กำลังเตรียมผู้ช่วย AI...")
-    
-    selected_key = random.choice(api_key_pool)
-    llm = ChatGoogleGenerativeAI(
-        model=LLM_MODEL,
-        temperature=0.7, # ลด Temp ลงเพื่อความแม่นยำ
-        google_api_key=selected_key,
-    )
+    print("กำลังเตรียมผู้ช่วย AI...")
 
-    # --- Chain 1: สำหรับแปลงคำถาม (Rewriter) ---
-    rewriter_prompt = ChatPromptTemplate.from_messages([
-        ("system", """คุณคือผู้ช่วย AI ที่เชี่ยวชาญในการแปลงคำถามของผู้ใช้ให้เป็นคำค้นหา ที่มีประสิทธิภาพสำหรับ Vector Database
-ภารกิจของคุณคือการอ่านบทสนทนาล่าสุดและคำถามติดตามผล แล้วสร้างคำค้นหาที่เป็นประโยคสมบูรณ์ ที่เหมาะสำหรับการค้นหาข้อมูลในคู่มือการขึ้นทะเบียนเกษตรกร
-- แปลงภาษาพูดให้เป็นภาษาที่เป็นทางการมากขึ้น (เช่น "ทำสวน" -> "การเพาะปลูกพืช", "ต้องใช้อะไรบ้าง" -> "เอกสารและคุณสมบัติที่จำเป็น")
-- ให้ตีความด้วย ชนิดพืชที่ผู้ถามกล่าวถึง มันหมายความว่าไง เข้าเกณธ์พืชประเภอไหน และต้องไปค้นหาหลักเกณฑ์อะไรบ้าง 
-- รวมบริบทที่สำคัญจากบทสนทนาก่อนหน้าเข้ามาในคำค้นหาใหม่"""),
-        
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{question}"),
-    ])
-    rewriter_chain = rewriter_prompt | llm | StrOutputParser()
-
-    # --- Chain 2: สำหรับสร้างคำตอบ (RAG) ---
-    answer_prompt = ChatPromptTemplate.from_messages([
-        ("system", """คุณคือ "ผู้เชี่ยวชาญในการขึ้นทะเบียน กรมส่งเสริมการเกษตร" ที่เป็นมิตร แม่นยำและรอบคอบและชัดเจน ที่สำคัญคือต้องกระชับ
-
-**กฎเหล็กสูงสุด:**
-1.  **ยึดข้อมูลอ้างอิงเท่านั้น:** ตอบคำถามโดยใช้ข้อมูลจาก "ข้อมูลอ้างอิง" (context) ที่ให้มา **เท่านั้น** และให้ตอบกระชับ ฟังธงไปเลย แต่ถ้าไม่มีในcontext จริงๆ ให้คุณใช้องค์ความรู้ของคุณประกอบ และให้แนะนำให้ผู้ใช้ติดต่อเจ้าหน้าที่ที่เกี่ยวข้อง
-2.  **การให้แนะนำเรื่องข้อยกเว้นเรื่องรายได้ สำคัญมาก ซึ่งเกณฑ์นี้ใหญ่สุด ทะลุข้อจำกัดทุกอย่าง ทั้งเรื่องพื้นที่ไม่ถึงเกณฑ์ ทั้งเรื่องจำนวนต้นไม่ถึงเกณฑ์ อันนี้สำคัญมากๆ ห้ามลืมแนะนำเด็ดขาด**
-3.  **ทุกครั้ง ถ้ามีการถามว่าปลูกสิ่งต่าง ๆ แล้วขึ้นทะเบียนได้ไหม ให้แนะนำเรื่องพื้นที่ปลูกขั้นต่อของพืชนั้นๆ และถ้ามีจำนวนต้นขั้นต่ำ/พื้นที่ ก็ให้แนะนำด้วย แต่ถ้าคุณพิจารณาคำถามแล้ว พื้นที่อาจจะไม่ถึงพื้นที่ขั้นต่ำ ให้แนะนำเรื่องข้อยกเว้นเรื่องรายได้ 
-4.  **จัดลำดับความสำคัญ:** หากข้อมูลอ้างอิงมีเนื้อหาที่ดูขัดแย้งกัน ให้เชื่อถือข้อมูลจาก Chunk ที่มีเนื้อหา **ตรงกับคำถามของผู้ใช้มากที่สุดก่อนเสมอ** (เช่น หากถามถึง "ถั่วงอก" ให้เชื่อข้อมูลเกี่ยวกับ "การทำผักงอก" มากกว่าข้อมูล "พืชไร่" ทั่วไป)
-5.  **ให้คำแนะนำแบบองค์รวม (Holistic Advice Rule):** หากคำถามของผู้ใช้มีกิจกรรมหลายอย่างปนกัน (ทั้งในและนอกขอบเขต) **ห้ามปฏิเสธแล้วจบ** แต่ให้ทำตามขั้นตอนต่อไปนี้:
-    *   **แยกแยะ:** บอกผู้ใช้ว่ากิจกรรมไหน "ขึ้นทะเบียนได้" (กับกรมส่งเสริมการเกษตร) และกิจกรรมไหน "ขึ้นทะเบียนไม่ได้" (เพราะอยู่นอกขอบเขต)
-    *   **ให้ข้อมูลส่วนที่ทำได้:** ให้ข้อมูลและคำแนะนำอย่างละเอียดสำหรับกิจกรรมที่ "ขึ้นทะเบียนได้" (เช่น สวนเงาะ)
-    *   **แนะนำส่วนที่ทำไม่ได้:** แนะนำให้ผู้ใช้ไปติดต่อหน่วยงานที่ถูกต้องสำหรับกิจกรรมที่ "ขึ้นทะเบียนไม่ได้" (เช่น การเลี้ยงเป็ด ให้ติดต่อกรมปศุสัตว์)
-    *   **ตัวอย่างคำตอบที่คาดหวัง:** "สำหรับการขึ้นทะเบียนเกษตรกรกับกรมส่งเสริมการเกษตรนั้น ผมขออนุญาตแยกเป็น 2 ส่วนนะครับ:
-        1.  **ในส่วนของ "สวนเงาะ":** คุณสามารถนำมาขึ้นทะเบียนได้ครับ โดยจะต้องเข้าเกณฑ์... (ให้ข้อมูลของเงาะต่อไป)
-        2.  **ในส่วนของ "การเลี้ยงเป็ด":** กิจกรรมนี้จัดเป็นปศุสัตว์ ซึ่งจะอยู่นอกขอบเขตของกรมส่งเสริมการเกษตรครับ แนะนำให้ลองติดต่อสอบถามที่สำนักงานปศุสัตว์อำเภอโดยตรงเพื่อขึ้นทะเบียนในส่วนนี้ครับ"
-6.  **จัดรูปแบบคำตอบด้วย Bullet points หรือย่อหน้าสั้นๆ ตอบกระชับ เพื่อให้อ่านง่าย
-7.  **ถ้าถามอะไรที่ไม่เกี่ยวข้องกับการขึ้นทะเบียนเกษตรกร:** เช่น "ร้านขายยางรถยนต์" หรือ "หวยจะออกอะไร" ให้วิเคราะห์ว่า "คำถามนี้ไม่เกี่ยวข้องกับการขึ้นทะเบียนเกษตรกร" และแนะนำให้สอบถามเรื่องอื่นที่เกี่ยวข้องกับการขึ้นทะเบียนเกษตร
-8.  **ให้คุณวิเคราะห์ด้วยว่า ถ้าเป็นคำถามซับซ้อน ให้แนะนำตอนท้ายว่า ควรปรึกษากับเจ้าหน้าที่ที่เกี่ยวข้องโดยตรง เพื่อความถูกต้องและแม่นยำที่สุด 
-
-
----
-
-**ภารกิจและขั้นตอนการทำงานของคุณ (เมื่อพบข้อมูลใน context):**
-**ขั้นตอนที่ 1: วิเคราะห์และทำความเข้าใจ**
-- อ่าน "คำถามของผู้ใช้" และ "ประวัติการสนทนา" เพื่อทำความเข้าใจเจตนาที่แท้จริง
-
-**ขั้นตอนที่ 2: สังเคราะห์คำตอบจากข้อมูลอ้างอิง**
-- สร้างคำตอบที่ กระชับ ชัดเจน และถูกต้อง 100% ตามข้อมูลที่พบ แต่ให้ครอบคลุมทุกประเด็นที่เกี่ยวข้องกัน
-**ขั้นตอนที่ 3: สร้างคำตอบตามผลการวิเคราะห์ ให้ตอบตามข้อมูลที่พบใน Context หากข้อมูลไม่ครบถ้วน ค่อยแนะนำให้สอบถามเจ้าหน้าที่เพิ่มเติม
-**ขั้นตอนที่ 4: สร้างแนวทางคำถามต่อไป**
-- **หลังจาก** ตอบคำถามหลักเสร็จสิ้นแล้ว ให้เว้นบรรทัด 2 บรรทัด
-- เริ่มต้นด้วยข้อความว่า "**💡 ลองถามต่อได้เลย:**"
-- ตามด้วยรายการคำถามแนะนำ 2 ข้อ ที่สั้น กระชับ เน้นไปที่ การขึ้นทะเบียนเกษตรกร เช่น เอกสารที่ต้องใช้, ขั้นตอนการขึ้นทะเบียน, คุณสมบัติที่จำเป็น
-
-----
-**ข้อมูลอ้างอิง:**
-{context}
-----
-"""),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "{question}")
-    ])
-
-    # --- ประกอบร่าง RAG Chain ---
-    rag_chain_with_source = RunnableParallel(
-        standalone_question=rewriter_chain,
-        original_input=RunnablePassthrough()
-    ) | RunnableParallel(
-        context=lambda x: format_docs(_retriever.invoke(x["standalone_question"])),
-        question=lambda x: x["original_input"]["question"],
-        chat_history=lambda x: x["original_input"]["chat_history"]
-    )
-    
-    rag_chain_with_dict_output = rag_chain_with_source | RunnablePassthrough.assign(
-        answer=answer_prompt | llm | StrOutputParser()
-    )
-    conversational_rag_chain = RunnableWithMessageHistory(
-        rag_chain_with_dict_output,
+    # [แก้ไข] ใช้ทุก key ผ่าน key pool แทนการสุ่มเลือก key เดียวตลอดอายุของ process
+    llm = PooledChatModel(get_key_pool(), rag_pipeline.make_gemini_llm)
+    return rag_pipeline.build_rag_chain(
+        _retriever,
+        llm,
         get_session_history,
-        input_messages_key="question",
-        history_messages_key="chat_history",
-        output_messages_key="answer"
+        answer_cache=load_answer_cache() if ANSWER_CACHE_ENABLED else None,
+        rewriter_path_stats=get_rewriter_path_stats(),
+        crop_table=load_crop_table(),
+        sparse_index=load_sparse_index(),
+        context_packer=get_context_packer(_retriever.vectorstore),
+        reranker=get_reranker(),
+        faq_index=load_faq_index(),
+        history_compactor=get_history_compactor(),
+        speculation_stats=get_speculation_stats(),
     )
-    
-    return conversational_rag_chain
+
+def stream_answer(chain, question: str, session_id: str, captured: dict):
+    """
+    [เพิ่ม] เรียก Chain แบบ stream และคืนค่าเป็น generator ของ token คำตอบ (สำหรับ st.write_stream)
+    ส่วน context ที่ค้นเจอจะถูกเก็บไว้ใน captured["context"] เพื่อนำไปแสดงใน Expander
+    [แก้ไข] ใช้ astream บน event loop กลาง เพื่อให้หลาย session รอ Gemini พร้อมกันได้
+    [เพิ่ม] เวลาของแต่ละขั้นตอนจะถูกเก็บไว้ใน captured["tracer"]
+    """
+    config, captured["tracer"] = rag_pipeline.make_turn_config(session_id, get_metrics_store())
+    async_chunks = chain.astream({"question": question}, config=config)
+    for chunk in get_event_loop().iterate(async_chunks):
+        if "context" in chunk:
+            captured["context"] = chunk["context"]
+        if "answer" in chunk:
+            yield chunk["answer"]
+
+def stream_answer_from_api(question: str, session_id: str, captured: dict):
+    """[เพิ่ม] เหมือน stream_answer แต่รับคำตอบจาก Headless API ผ่าน Server-Sent Events"""
+    for event, data in api_client.stream_chat(RAG_API_URL, question, session_id):
+        if event == "context":
+            captured["context"] = data["context"]
+        elif event == "token":
+            yield data["text"]
+        elif event == "error":
+            raise RuntimeError(data["error"])
 
 # --- UI และ Logic หลัก ---
 st.set_page_config(page_title="เกษตรกรแชตบอท", page_icon="👩‍🌾", layout="wide")
 st.title("👩‍🌾 แชตบอทถาม-ตอบเรื่องการขึ้นทะเบียนเกษตรกร")
 st.write("ขับเคลื่อนโดย Google Gemini และคู่มือทะเบียนเกษตรกรปี 2568 ผลิตโดย เกษตรตำบล_คนใช้แรงงาน")
 
-db = load_vector_store()
+# [แก้ไข] โหมด FAST_STARTUP ไม่รอ Vector Store ที่นี่ ถ้ายังโหลดไม่เสร็จจะรอตอนผู้ใช้ส่งคำถามแรกแทน
+startup = get_startup() if FAST_STARTUP and not RAG_API_URL else None
+if RAG_API_URL:
+    db = None
+elif startup is not None:
+    db = startup.result if startup.done else None
+    if startup.error:
+        st.error(f"เกิดข้อผิดพลาดในการโหลด Vector Store: {startup.error}")
+else:
+    db = load_vector_store()
+starting_up = startup is not None and not startup.done
 
-if db:
-    # สร้าง Retriever ที่ใช้ MMR เพื่อผลการค้นหาที่ดีขึ้น
-    retriever = db.as_retriever(
-        search_type="mmr",
-        search_kwargs={'k': 8, 'fetch_k': 25} # [ปรับคืนค่าเดิม]
-    )
+if db or RAG_API_URL or starting_up:
+    rag_chain_with_history = None
+    if db is not None:
+        # สร้าง Retriever ที่ใช้ MMR เพื่อผลการค้นหาที่ดีขึ้น (ค่าตั้งต้นอยู่ใน rag_pipeline.RETRIEVER_SEARCH_KWARGS)
+        retriever = rag_pipeline.make_retriever(db)
+        rag_chain_with_history = get_chains(retriever)
+    elif starting_up:
+        st.info("⏳ กำลังเตรียมระบบอยู่เบื้องหลัง พิมพ์คำถามได้เลย ระบบจะเริ่มตอบทันทีที่พร้อม")
+
+    # [เพิ่ม] สถิติการทำงานของระบบ (เฉพาะตอนรัน chain ใน process นี้ ถ้าใช้ API ให้ดูที่ /stats)
+    if SHOW_ADMIN_STATS and rag_chain_with_history is not None:
+        with st.sidebar.expander("📊 สถิติระบบ"):
+            st.write("เส้นทางการแปลงคำถาม:", get_rewriter_path_stats().snapshot())
+            if rag_pipeline.SPECULATIVE_RETRIEVAL_ENABLED:
+                st.write("Speculative retrieval:", get_speculation_stats().snapshot())
+            st.write("Session history:", get_history_store().stats())
+            st.write("API keys:", get_key_pool().stats())
+            st.write("Query embedding cache:", db.embeddings.stats())
+            if ANSWER_CACHE_ENABLED:
+                st.write("Answer cache:", load_answer_cache().stats())
+            if get_context_packer(db) is not None:
+                st.write("Context packer:", get_context_packer(db).stats())
+            if load_faq_index() is not None:
+                st.write("FAQ fast path:", load_faq_index().stats())
+            if get_reranker() is not None:
+                st.write("Reranker:", get_reranker().stats())
+            if get_history_compactor() is not None:
+                st.write("History compaction:", get_history_compactor().stats())
+            if rag_pipeline.TRACING_ENABLED:
+                st.write("เวลาแต่ละขั้นตอน (24 ชม.ล่าสุด):", get_metrics_store().summary())
+    if SHOW_ADMIN_STATS and startup is not None:
+        with st.sidebar.expander("🚀 เวลาเริ่มระบบ"):
+            st.write(startup.stats())
 
-    rag_chain_with_history = get_chains(retriever)
+    # [เพิ่ม] สร้าง session id แยกสำหรับแต่ละ browser เพื่อไม่ให้บทสนทนาของผู้ใช้ปนกัน
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
 
     if "messages" not in st.session_state:
         st.session_state["messages"] = [AIMessage(content="สวัสดีครับ มีเรื่องการขึ้นทะเบียนเกษตรกรอะไรให้ผมช่วยเหลือไหมครับ?")]
@@ -194,24 +274,61 @@ if db:
         st.session_state.messages.append(HumanMessage(content=user_input))
         st.chat_message("human").write(user_input)
 
+        # [เพิ่ม] คำถามแรกหลังเริ่ม server: รอให้ background thread โหลดเสร็จก่อน แล้วจึงสร้าง chain
+        if rag_chain_with_history is None and not RAG_API_URL:
+            try:
+                with st.spinner("กำลังเตรียมระบบ (ครั้งแรกหลังเริ่มระบบอาจใช้เวลาสักครู่)..."):
+                    db = startup.wait()
+            except RuntimeError as e:
+                st.error(f"เกิดข้อผิดพลาดในการโหลด Vector Store: {e}")
+                st.stop()
+            rag_chain_with_history = get_chains(rag_pipeline.make_retriever(db))
+
         with st.chat_message("ai"):
-            with st.spinner("กำลังประมวลผล..."):
+            if STREAMING_MODE:
+                # [เพิ่ม] Streaming: spinner จะแสดงจนกว่า token แรกมาถึง จากนั้นทยอยเขียนคำตอบลงหน้าจอ
+                # history จะถูกบันทึกโดย RunnableWithMessageHistory หลังจาก stream จบครบแล้วเท่านั้น
+                captured = {}
                 try:
-                    # เรียกใช้ RAG Chain ที่มีระบบจัดการ history ในตัว
-                    response_dict = rag_chain_with_history.invoke(
-                        {"question": user_input},
-                        config={"configurable": {"session_id": "main_session"}}
-                    )
-                    # ดึงค่าจาก key 'answer' และ 'context' ที่ได้จาก Chain
-                    final_answer = response_dict.get("answer", "ขออภัยครับ เกิดข้อผิดพลาดในการดึงคำตอบ")
-                    retrieved_context = response_dict.get("context", "ไม่พบข้อมูลอ้างอิง")
-
+                    with st.spinner("กำลังประมวลผล..."):
+                        if RAG_API_URL:
+                            token_stream = stream_answer_from_api(user_input, st.session_state.session_id, captured)
+                        else:
+                            token_stream = stream_answer(rag_chain_with_history, user_input, st.session_state.session_id, captured)
+                        first_token = next(token_stream, "")
+                    final_answer = st.write_stream(itertools.chain([first_token], token_stream))
+                    if not final_answer:
+                        final_answer = "ขออภัยครับ เกิดข้อผิดพลาดในการดึงคำตอบ"
+                        st.write(final_answer)
+                    retrieved_context = captured.get("context", "ไม่พบข้อมูลอ้างอิง")
                 except Exception as e:
                     final_answer = f"ขออภัยครับ เกิดข้อผิดพลาด: {e}"
                     retrieved_context = f"เกิดข้อผิดพลาดระหว่างการดึงข้อมูล: {e}"
                     st.error(final_answer)
+            else:
+                captured = {}
+                with st.spinner("กำลังประมวลผล..."):
+                    try:
+                        # เรียกใช้ RAG Chain ที่มีระบบจัดการ history ในตัว
+                        if RAG_API_URL:
+                            response_dict = api_client.chat(RAG_API_URL, user_input, st.session_state.session_id)
+                        else:
+                            config, captured["tracer"] = rag_pipeline.make_turn_config(
+                                st.session_state.session_id, get_metrics_store()
+                            )
+                            response_dict = get_event_loop().run(rag_chain_with_history.ainvoke(
+                                {"question": user_input}, config=config
+                            ))
+                        # ดึงค่าจาก key 'answer' และ 'context' ที่ได้จาก Chain
+                        final_answer = response_dict.get("answer", "ขออภัยครับ เกิดข้อผิดพลาดในการดึงคำตอบ")
+                        retrieved_context = response_dict.get("context", "ไม่พบข้อมูลอ้างอิง")
+
+                    except Exception as e:
+                        final_answer = f"ขออภัยครับ เกิดข้อผิดพลาด: {e}"
+                        retrieved_context = f"เกิดข้อผิดพลาดระหว่างการดึงข้อมูล: {e}"
+                        st.error(final_answer)
 
-            st.write(final_answer)
+                st.write(final_answer)
             
             # [เพิ่ม] แสดง Expander พร้อมข้อมูลอ้างอิงที่ใช้
             with st.expander("ดูข้อมูลอ้างอิงที่ AI ใช้ในการตอบคำถามนี้"):
@@ -219,6 +336,11 @@ if db:
                     st.info(retrieved_context)
                 else:
                     st.json(retrieved_context) # Fallback to json if not a string
+                # [เพิ่ม] เวลาของแต่ละขั้นตอนในรอบนี้ (เฉพาะผู้ดูแลระบบ)
+                tracer = captured.get("tracer")
+                if SHOW_STAGE_TIMINGS and tracer is not None:
+                    st.caption("⏱️ เวลาแต่ละขั้นตอน (ms)")
+                    st.json(tracer.as_record())
 
         st.session_state.messages.append(AIMessage(content=final_answer))
 
@@ -0,0 +1,38 @@
+import asyncio
+import threading
+
+# --- Event loop กลางที่รันอยู่ใน background thread ---
+# Streamlit รันสคริปต์แบบ sync ในแต่ละ session จึงส่งงาน async (ainvoke/astream) มารันใน loop เดียวกันนี้
+# ทำให้ทุก session รอ network ของ Gemini ซ้อนกันได้ และ client แบบ async ที่ผูกกับ loop ถูกใช้ซ้ำได้ตลอด
+
+
+class BackgroundEventLoop:
+    """Event loop ที่รันตลอดอายุของ process ใน daemon thread"""
+
+    def __init__(self, name: str = "rag-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coro, timeout: float | None = None):
+        """รัน coroutine บน loop กลาง แล้วรอผลลัพธ์แบบ sync"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def iterate(self, async_iterable):
+        """แปลง async iterator (เช่น chain.astream) ให้เป็น generator แบบ sync สำหรับ st.write_stream"""
+        iterator = async_iterable.__aiter__()
+        while True:
+            try:
+                yield self.run(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+            except GeneratorExit:
+                # ผู้ใช้ปิดหน้าเว็บระหว่าง stream: ปิด async generator บน loop ด้วย
+                aclose = getattr(iterator, "aclose", None)
+                if aclose is not None:
+                    self.run(aclose())
+                raise
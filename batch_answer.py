@@ -0,0 +1,300 @@
+import os
+import csv
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+
+import rag_pipeline
+from rag_pipeline import (
+    VECTORSTORE_PATH, KEY_RPM_LIMIT, KEY_TPM_LIMIT, ANSWER_CACHE_PATH, ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_MAX_ENTRIES,
+)
+from answer_cache import SemanticAnswerCache
+from crop_lookup import format_rows
+from embedding_backend import normalize_query
+from key_pool import ApiKeyPool, PooledChatModel
+
+# --- ตอบคำถามจำนวนมากแบบ offline (เช่น คำถามจากการประชุมระดับอำเภอที่รวบรวมเป็น spreadsheet) ---
+# 1) embed คำถามทั้งหมดเป็น batch เดียว  2) ค้น FAISS ครั้งเดียวด้วย matrix ของทุกคำถาม
+# 3) จัด context แบบเดียวกับ chain ของหน้าเว็บ (MMR, BM25, ตารางพืช, rerank, context packer)
+# 4) เรียก Gemini พร้อมกันไม่เกิน --concurrency คำถาม กระจายไปทุก key ผ่าน key pool
+# ทุกคำตอบถูกบันทึกลง checkpoint (JSONL) ทันที ถ้างานหยุดกลางทาง รันคำสั่งเดิมซ้ำจะทำต่อจากคำถามที่ยังไม่เสร็จ
+# ตัวอย่าง: python batch_answer.py questions.csv --output answers.csv --concurrency 8
+
+DEFAULT_CONCURRENCY = 4
+KEY_WAIT_SECONDS = 300  # งาน batch รอ key ว่างได้นานกว่าหน้าเว็บ (หน้าเว็บรอ 30 วินาที)
+OUTPUT_FIELDS = ["id", "question", "answer", "source", "error", "elapsed_ms", "context"]
+
+
+# --- อ่าน/เขียนไฟล์ ---
+
+def read_questions(path: str, question_column: str = "question") -> list[dict]:
+    """อ่านคำถามจาก CSV หรือ JSONL คืน [{"id", "question"}] (ใช้คอลัมน์ id ถ้ามี มิฉะนั้นใช้เลขแถว)"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        # utf-8-sig: ไฟล์ CSV ที่บันทึกจาก Excel มักมี BOM นำหน้า
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            if question_column not in (reader.fieldnames or []):
+                raise ValueError(f"ไม่พบคอลัมน์ '{question_column}' ใน {path} (มี: {reader.fieldnames})")
+            records = list(reader)
+    questions = []
+    for row_number, record in enumerate(records, start=1):
+        question = str(record.get(question_column) or "").strip()
+        if question:
+            questions.append({"id": str(record.get("id") or row_number), "question": question})
+    return questions
+
+
+def load_checkpoint(path: str) -> dict[str, dict]:
+    """อ่านผลที่บันทึกไว้แล้ว (บรรทัดสุดท้ายอาจเขียนไม่ครบถ้างานถูกหยุดกลางคัน จึงข้ามบรรทัดที่อ่านไม่ได้)"""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[record["id"]] = record
+    return results
+
+
+def write_output(path: str, questions: list[dict], results: dict[str, dict]):
+    """เขียนผลตามลำดับของไฟล์คำถาม (.csv หรือ .jsonl ตามนามสกุลของ path)"""
+    records = [results[item["id"]] for item in questions if item["id"] in results]
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    if path.endswith(".jsonl"):
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    else:
+        with open(path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=OUTPUT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(records)
+
+
+# --- ค้นหาและตอบ ---
+
+class BatchAnswerer:
+    """ค้นเอกสารของหลายคำถามพร้อมกัน แล้วเรียก LLM แบบจำกัดจำนวนพร้อมกัน (ใช้ทรัพยากรชุดเดียวกับ chain หลัก)"""
+
+    def __init__(self, db, llm, sparse_index=None, crop_table=None, reranker=None, context_packer=None,
+                 faq_index=None, answer_cache=None):
+        self.db = db
+        self.sparse_index = sparse_index
+        self.crop_table = crop_table
+        self.reranker = reranker
+        self.context_packer = context_packer
+        self.faq_index = faq_index
+        self.answer_cache = answer_cache
+        self.answer_chain = rag_pipeline.ANSWER_PROMPT | llm | StrOutputParser()
+
+    def embed(self, questions: list[str]) -> np.ndarray:
+        """embed ทุกคำถามเป็น batch (e5 ใช้การ encode แบบเดียวกันทั้งคำถามและเอกสาร จึงได้เวกเตอร์เท่ากับ embed_query)"""
+        vectors = self.db.embeddings.embed_documents([normalize_query(q) for q in questions])
+        return np.asarray(vectors, dtype=np.float32)
+
+    def shortcut(self, vector: np.ndarray) -> dict | None:
+        """คำตอบจาก FAQ fast path หรือ answer cache (ถ้ามี) โดยไม่ต้องค้นเอกสารหรือเรียก LLM"""
+        if self.faq_index is not None:
+            match = self.faq_index.match(vector.tolist())
+            if match is not None:
+                index, _ = match
+                return {"answer": self.faq_index.format_answer(index), "context": self.faq_index.context(index),
+                        "source": "faq"}
+        if self.answer_cache is not None:
+            cached = self.answer_cache.lookup(vector)
+            if cached is not None:
+                return {"answer": cached["answer"], "context": cached["context"], "source": "cache"}
+        return None
+
+    def _documents(self, positions: list[int]) -> list[Document]:
+        ids = [self.db.index_to_docstore_id[position] for position in positions]
+        if hasattr(self.db.docstore, "search_many"):  # chunk store อ่านทุก chunk ในคำสั่งเดียว
+            found = self.db.docstore.search_many(ids)
+            return [found[doc_id] for doc_id in ids if doc_id in found]
+        docs = [self.db.docstore.search(doc_id) for doc_id in ids]
+        return [doc for doc in docs if isinstance(doc, Document)]
+
+    def _dense_docs(self, vector: np.ndarray, positions: list[int], k: int) -> list[Document]:
+        """เลือกเอกสารจาก candidate ที่ค้นไว้แล้ว (MMR เหมือน retriever ของหน้าเว็บ)"""
+        if rag_pipeline.RETRIEVER_SEARCH_TYPE != "mmr":
+            return self._documents(positions[:k])
+        from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+        candidates = [self.db.index.reconstruct(position) for position in positions]
+        lambda_mult = rag_pipeline.RETRIEVER_SEARCH_KWARGS.get("lambda_mult", 0.5)
+        selected = maximal_marginal_relevance(vector, candidates, lambda_mult=lambda_mult, k=k)
+        return self._documents([positions[i] for i in selected])
+
+    def retrieve(self, questions: list[str], vectors: np.ndarray) -> list[list[Document]]:
+        """ค้น FAISS ครั้งเดียวสำหรับทุกคำถาม แล้วจัดเอกสารของแต่ละคำถามตามขั้นตอนเดียวกับ build_rag_chain"""
+        if not questions:
+            return []
+        search_kwargs = rag_pipeline.RETRIEVER_SEARCH_KWARGS
+        if self.reranker is not None:
+            candidates_k = final_k = rag_pipeline.RERANK_CANDIDATES_K
+        else:
+            candidates_k, final_k = rag_pipeline.HYBRID_CANDIDATES_K, rag_pipeline.HYBRID_FINAL_K
+        dense_k = candidates_k if self.sparse_index is not None else search_kwargs["k"]
+        fetch_k = max(search_kwargs.get("fetch_k", dense_k), dense_k)
+
+        _, all_positions = self.db.index.search(vectors, fetch_k)
+        results = []
+        for question, vector, row in zip(questions, vectors, all_positions):
+            positions = [int(position) for position in row if position != -1]
+            docs = self._dense_docs(vector, positions, dense_k)
+            if self.sparse_index is not None:
+                docs = rag_pipeline.fuse_with_sparse(self.db, self.sparse_index, question, docs, candidates_k, final_k)
+            if self.reranker is not None:
+                docs = self.reranker.rerank(question, docs)
+            rows = self.crop_table.match(question) if self.crop_table is not None else []
+            if rows:
+                docs = [Document(page_content=format_rows(rows), metadata={"source": "crop_table"})] + docs
+            if self.context_packer is not None:
+                docs = self.context_packer.pack(docs, vector.tolist())
+            results.append(docs)
+        return results
+
+    async def answer(self, item: dict, context: str, semaphore: asyncio.Semaphore) -> dict:
+        started = time.perf_counter()
+        record = {**item, "answer": "", "source": "llm", "error": None, "context": context}
+        try:
+            async with semaphore:
+                record["answer"] = await self.answer_chain.ainvoke(
+                    {"context": context, "question": item["question"], "chat_history": []}
+                )
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return record
+
+
+async def run_batch(answerer: BatchAnswerer, questions: list[dict], checkpoint_path: str, concurrency: int):
+    """ตอบทุกคำถามใน questions และต่อท้ายผลลง checkpoint ทันทีที่แต่ละคำถามเสร็จ"""
+    started = time.perf_counter()
+    vectors = answerer.embed([item["question"] for item in questions])
+    print(f"🔢 embed {len(questions)} คำถามเสร็จใน {time.perf_counter() - started:.1f} วินาที")
+
+    shortcuts = [answerer.shortcut(vector) for vector in vectors]
+    pending = [i for i, shortcut in enumerate(shortcuts) if shortcut is None]
+    search_started = time.perf_counter()
+    docs = answerer.retrieve([questions[i]["question"] for i in pending], vectors[pending])
+    contexts = dict(zip(pending, (rag_pipeline.format_docs(d) for d in docs)))
+    print(f"🔎 ค้นเอกสาร {len(pending)} คำถามเสร็จใน {time.perf_counter() - search_started:.1f} วินาที "
+          f"(ตอบจาก FAQ/cache ได้ทันที {len(questions) - len(pending)} คำถาม)")
+
+    if os.path.dirname(checkpoint_path):
+        os.makedirs(os.path.dirname(checkpoint_path), exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+    if os.path.exists(checkpoint_path) and os.path.getsize(checkpoint_path):
+        with open(checkpoint_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":  # บรรทัดสุดท้ายเขียนไม่ครบ ขึ้นบรรทัดใหม่ก่อนต่อท้าย
+                f.write(b"\n")
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        def save(record: dict):
+            checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+            checkpoint.flush()
+
+        for i, shortcut in enumerate(shortcuts):
+            if shortcut is not None:
+                save({**questions[i], **shortcut, "error": None, "elapsed_ms": 0.0})
+        tasks = [asyncio.create_task(answerer.answer(questions[i], contexts[i], semaphore)) for i in pending]
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            record = await task
+            save(record)
+            status = f"❌ {record['error']}" if record["error"] else f"{record['elapsed_ms'] / 1000:.1f}s"
+            print(f"[{done}/{len(tasks)}] {record['id']}: {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ตอบคำถามจากไฟล์ CSV/JSONL ทีละหลายคำถาม (ทำต่อจาก checkpoint ได้)")
+    parser.add_argument("input", help="ไฟล์คำถาม (.csv ที่มีคอลัมน์ question หรือ .jsonl ที่มี key question; id ไม่บังคับ)")
+    parser.add_argument("--output", help="ไฟล์คำตอบ (.csv หรือ .jsonl; ค่าเริ่มต้น: <input>_answers.<นามสกุลเดิม>)")
+    parser.add_argument("--checkpoint", help="ไฟล์ checkpoint (ค่าเริ่มต้น: <output>.checkpoint.jsonl)")
+    parser.add_argument("--question-column", default="question")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="จำนวนคำถามที่เรียก LLM พร้อมกัน")
+    parser.add_argument("--limit", type=int, help="ตอบเฉพาะ N คำถามแรก (สำหรับทดสอบ)")
+    parser.add_argument("--restart", action="store_true", help="ลบ checkpoint เดิมแล้วเริ่มใหม่ทั้งหมด")
+    parser.add_argument("--no-fast-path", action="store_true", help="ไม่ใช้ FAQ fast path และ answer cache (เรียก LLM ทุกคำถาม)")
+    parser.add_argument("--fake-llm", action="store_true", help="ใช้ Fake LLM แทน Gemini (ทดสอบโดยไม่ใช้ API key)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    root, ext = os.path.splitext(args.input)
+    output_path = args.output or f"{root}_answers{ext if ext in ('.csv', '.jsonl') else '.csv'}"
+    checkpoint_path = args.checkpoint or f"{output_path}.checkpoint.jsonl"
+
+    questions = read_questions(args.input, args.question_column)[:args.limit]
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    results = load_checkpoint(checkpoint_path)
+    # คำถามที่ตอบไม่สำเร็จ (error) จะถูกลองใหม่ทุกครั้งที่รันซ้ำ
+    pending = [item for item in questions if item["id"] not in results or results[item["id"]].get("error")]
+    print(f"📄 {len(questions)} คำถาม: เสร็จแล้ว {len(questions) - len(pending)}, ต้องตอบ {len(pending)}")
+
+    if pending:
+        if args.fake_llm:
+            from fake_llm import FakeChatModel
+
+            keys = ["fake-key"]
+            llm_factory = lambda key: FakeChatModel(latency_seconds=0.5)
+        else:
+            keys = rag_pipeline.load_api_keys()
+            if not keys:
+                raise SystemExit("ไม่พบ Google API Key ใดๆ ในไฟล์ .env! กรุณาตรวจสอบ")
+            llm_factory = rag_pipeline.make_gemini_llm
+        key_pool = ApiKeyPool(keys, rpm_limit=KEY_RPM_LIMIT, tpm_limit=KEY_TPM_LIMIT)
+        llm = PooledChatModel(key_pool, llm_factory, max_wait_seconds=KEY_WAIT_SECONDS)
+
+        print(f"กำลังโหลด Vector Store จาก '{VECTORSTORE_PATH}'...")
+        db = rag_pipeline.load_vector_store(VECTORSTORE_PATH)
+        answerer = BatchAnswerer(
+            db,
+            llm,
+            sparse_index=rag_pipeline.load_sparse_index(VECTORSTORE_PATH),
+            crop_table=rag_pipeline.load_crop_table(VECTORSTORE_PATH),
+            reranker=rag_pipeline.make_reranker(),
+            context_packer=rag_pipeline.make_context_packer(db),
+            faq_index=None if args.no_fast_path else rag_pipeline.load_faq_index(VECTORSTORE_PATH),
+            answer_cache=None if args.no_fast_path else SemanticAnswerCache(
+                ANSWER_CACHE_PATH, VECTORSTORE_PATH, threshold=ANSWER_CACHE_THRESHOLD,
+                ttl_seconds=ANSWER_CACHE_TTL_SECONDS, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ),
+        )
+        started = time.perf_counter()
+        try:
+            asyncio.run(run_batch(answerer, pending, checkpoint_path, args.concurrency))
+        except KeyboardInterrupt:
+            print(f"\n⏸️ หยุดแล้ว รันคำสั่งเดิมอีกครั้งเพื่อทำต่อจาก {checkpoint_path}")
+            raise SystemExit(1)
+        print(f"⏱️ ใช้เวลาทั้งหมด {time.perf_counter() - started:.1f} วินาที")
+        print("API keys:", key_pool.stats())
+        results = load_checkpoint(checkpoint_path)
+
+    write_output(output_path, questions, results)
+    final = [results[item["id"]] for item in questions if item["id"] in results]
+    sources = Counter(record["source"] for record in final if not record.get("error"))
+    errors = sum(1 for record in final if record.get("error"))
+    print(f"✅ บันทึกคำตอบ {len(final)} คำถามที่ {output_path} "
+          f"(LLM {sources['llm']}, FAQ {sources['faq']}, cache {sources['cache']}, error {errors})")
+    if errors:
+        print("⚠️ มีคำถามที่ตอบไม่สำเร็จ รันคำสั่งเดิมอีกครั้งเพื่อลองใหม่เฉพาะคำถามเหล่านั้น")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import re
+import json
+import time
+import argparse
+import importlib
+
+import numpy as np
+import faiss
+from langchain_core.documents import Document
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+
+import rag_pipeline
+from fake_llm import FakeChatModel
+from history_store import BoundedHistoryStore
+from sparse_index import reciprocal_rank_fusion
+from reranker import CrossEncoderReranker
+
+# --- Benchmark คุณภาพและความเร็วของ Retrieval จากคำถามใน Q&A.md ---
+# ใช้คำถามแต่ละข้อ (และคำถามที่เรียบเรียงใหม่) ค้นหาใน Vector Store จริง แล้ววัดว่า chunk Q&A ของข้อนั้นติดอันดับไหม
+# รายงาน recall@k, MRR และ latency (p50/p95/p99) แยกขั้น embed / search / mmr / sparse พร้อมเทียบหลายค่าตั้งต้น
+# ไม่ต้องใช้ network (ไม่เรียก LLM; โหมด --chain ใช้ Fake LLM)
+# ตัวอย่าง: python benchmark_retrieval.py --output benchmark_results.json
+
+# ค่าตั้งต้นที่นำมาเทียบกัน (แถวแรกคือค่าที่ app.py ใช้ก่อนมี Hybrid Retrieval)
+CONFIGS = [
+    {"name": "mmr k=8 fetch_k=25", "search_type": "mmr", "k": 8, "fetch_k": 25, "hybrid": False},
+    {"name": "mmr k=6 fetch_k=25", "search_type": "mmr", "k": 6, "fetch_k": 25, "hybrid": False},
+    {"name": "mmr k=8 fetch_k=50", "search_type": "mmr", "k": 8, "fetch_k": 50, "hybrid": False},
+    {"name": "similarity k=8", "search_type": "similarity", "k": 8, "fetch_k": 8, "hybrid": False},
+    {"name": "similarity k=6", "search_type": "similarity", "k": 6, "fetch_k": 6, "hybrid": False},
+    {"name": "hybrid mmr k=6", "search_type": "mmr", "k": rag_pipeline.HYBRID_FINAL_K, "fetch_k": 25, "hybrid": True},
+    {"name": "hybrid similarity k=6", "search_type": "similarity", "k": rag_pipeline.HYBRID_FINAL_K,
+     "fetch_k": rag_pipeline.HYBRID_CANDIDATES_K, "hybrid": True},
+]
+
+# ค่าตั้งต้นที่มี cross-encoder rerank (เปิดด้วย --rerank): ดึง candidate เท่า fetch_k แล้วเก็บ top k
+RERANK_CONFIGS = [
+    {"name": "similarity 25 + rerank k=4", "search_type": "similarity", "k": rag_pipeline.RERANK_TOP_N,
+     "fetch_k": rag_pipeline.RERANK_CANDIDATES_K, "candidates": rag_pipeline.RERANK_CANDIDATES_K,
+     "hybrid": False, "rerank": True},
+    {"name": "hybrid 25 + rerank k=4", "search_type": "mmr", "k": rag_pipeline.RERANK_TOP_N,
+     "fetch_k": rag_pipeline.RERANK_CANDIDATES_K, "candidates": rag_pipeline.RERANK_CANDIDATES_K,
+     "hybrid": True, "rerank": True},
+]
+
+# กฎเรียบเรียงคำถามใหม่แบบง่าย (คำพ้อง/คำลงท้าย) เพื่อจำลองการพิมพ์ถามที่ไม่ตรงกับในคู่มือ
+PARAPHRASE_RULES = [
+    ("ทะเบียนเกษตรกร", "ทบก."),
+    ("ขึ้นทะเบียน", "ลงทะเบียน"),
+    ("ได้หรือไม่", "ได้ไหม"),
+    ("ได้ไหม", "ได้หรือเปล่า"),
+    ("ต้องทำอย่างไร", "ต้องทำยังไงบ้าง"),
+    ("อย่างไร", "ยังไง"),
+    ("เท่าไร", "เท่าไหร่"),
+    ("ที่ไหน", "ตรงไหน"),
+]
+POLITE_PARTICLES = re.compile(r"\s*(ครับผม|ครับ|ค่ะ|คะ|จ้า|จ้ะ)\s*(?=[?？]?$)")
+
+
+def percentile(values: list[float], p: float) -> float:
+    """percentile แบบ nearest-rank (เช่นเดียวกับ load_test.py)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def load_qna_pairs() -> list[tuple[str, str]]:
+    """คืน [(คำถาม, เนื้อหา chunk Q&A ของคำถามนั้น)] โดยใช้ parser เดียวกับตอนสร้าง index"""
+    prepare = importlib.import_module("2MD_prepare_vectorstore")
+    with open(prepare.QNA_MARKDOWN_PATH, "r", encoding="utf-8") as f:
+        qna_docs = prepare.parse_qna_markdown(f.read())
+    return [
+        (doc.page_content.split("\nคำถาม: ", 1)[1].split("\nคำตอบ: ", 1)[0], doc.page_content)
+        for doc in qna_docs
+    ]
+
+
+def make_paraphrases(question: str) -> list[str]:
+    """สร้างคำถามที่เรียบเรียงใหม่จากกฎข้างบน (เฉพาะที่ต่างจากคำถามเดิม)"""
+    variants = []
+    reworded = question
+    for old, new in PARAPHRASE_RULES:
+        if old in reworded:
+            reworded = reworded.replace(old, new, 1)
+    variants.append(reworded)
+    stripped = POLITE_PARTICLES.sub("", question).rstrip("?？ ")
+    variants.append(f"สอบถามหน่อยครับ {stripped}")
+    variants.append(stripped.replace(" ", ""))
+    return list(dict.fromkeys(v for v in variants if v and v != question))
+
+
+def load_extra_paraphrases(path: str, pairs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """อ่านไฟล์ JSONL {"question": ..., "paraphrase": ...} (question ต้องตรงกับคำถามใน Q&A.md)"""
+    expected_by_question = dict(pairs)
+    extra = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item["question"] in expected_by_question:
+                extra.append((item["paraphrase"], expected_by_question[item["question"]]))
+            else:
+                print(f"⚠️ ไม่พบคำถามใน Q&A.md: {item['question']}")
+    return extra
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.samples.setdefault(stage, []).append(seconds * 1000)
+
+    def summary(self) -> dict:
+        return {
+            stage: {"p50": percentile(ms, 50), "p95": percentile(ms, 95), "p99": percentile(ms, 99)}
+            for stage, ms in self.samples.items()
+        }
+
+
+def search_with_timing(db, sparse_index, config: dict, query: str, query_vector: list[float],
+                       timer: StageTimer, reranker: CrossEncoderReranker | None = None) -> list[str]:
+    """
+    ค้นหาตาม config แล้วคืนเนื้อหาของ chunk ตามอันดับ
+    แยกเวลา FAISS search กับ MMR rerank (ทำตามขั้นตอนเดียวกับ max_marginal_relevance_search_by_vector ของ LangChain)
+    """
+    candidates_k = config.get("candidates") or (rag_pipeline.HYBRID_CANDIDATES_K if config["hybrid"] else config["k"])
+    fetch_k = max(config["fetch_k"], candidates_k)
+
+    started = time.perf_counter()
+    vector = np.array([query_vector], dtype=np.float32)
+    if db._normalize_L2:
+        faiss.normalize_L2(vector)
+    _, indices = db.index.search(vector, fetch_k if config["search_type"] == "mmr" else candidates_k)
+    positions = [int(i) for i in indices[0] if i != -1]
+    timer.add("search", time.perf_counter() - started)
+
+    if config["search_type"] == "mmr":
+        started = time.perf_counter()
+        candidate_vectors = [db.index.reconstruct(i) for i in positions]
+        selected = maximal_marginal_relevance(
+            np.array([query_vector], dtype=np.float32), candidate_vectors, k=candidates_k
+        )
+        positions = [positions[i] for i in selected]
+        timer.add("mmr", time.perf_counter() - started)
+
+    results = [db.docstore.search(db.index_to_docstore_id[i]).page_content for i in positions]
+    if config["hybrid"]:
+        started = time.perf_counter()
+        sparse = [db.docstore.search(doc_id).page_content for doc_id, _ in sparse_index.search(query, k=candidates_k)]
+        results = reciprocal_rank_fusion([results, sparse], k=rag_pipeline.RRF_K)
+        timer.add("sparse+fusion", time.perf_counter() - started)
+
+    if config.get("rerank"):
+        started = time.perf_counter()
+        ranked = reranker.rerank(query, [Document(page_content=text) for text in results], top_n=config["k"])
+        timer.add("rerank", time.perf_counter() - started)
+        return [doc.page_content for doc in ranked]
+    return results[:config["k"]]
+
+
+def evaluate(db, sparse_index, config: dict, queries: list[tuple[str, str, list[float]]],
+             reranker: CrossEncoderReranker | None = None) -> dict:
+    timer = StageTimer()
+    hits, reciprocal_ranks = 0, []
+    for query, expected, query_vector in queries:
+        results = search_with_timing(db, sparse_index, config, query, query_vector, timer, reranker)
+        rank = results.index(expected) + 1 if expected in results else None
+        hits += rank is not None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return {
+        "recall": hits / len(queries),
+        "mrr": sum(reciprocal_ranks) / len(reciprocal_ranks),
+        "latency_ms": timer.summary(),
+    }
+
+
+def embed_all(embeddings, questions: list[str], timer: StageTimer) -> list[list[float]]:
+    vectors = []
+    for question in questions:
+        started = time.perf_counter()
+        vectors.append(embeddings.embed_query(question))
+        timer.add("embed", time.perf_counter() - started)
+    return vectors
+
+
+def benchmark_chain(db, sparse_index, questions: list[str]) -> dict:
+    """วัดเวลาทั้ง chain (rewriter fast path + embed + retrieval + Fake LLM) โดยไม่ใช้ answer cache"""
+    history_store = BoundedHistoryStore(max_messages=rag_pipeline.MAX_HISTORY_MESSAGES)
+    chain = rag_pipeline.build_rag_chain(
+        rag_pipeline.make_retriever(db),
+        FakeChatModel(latency_seconds=0.0),
+        history_store.get,
+        crop_table=rag_pipeline.load_crop_table(),
+        sparse_index=sparse_index,
+    )
+    timer = StageTimer()
+    for i, question in enumerate(questions):
+        started = time.perf_counter()
+        chain.invoke({"question": question}, config={"configurable": {"session_id": f"bench-{i}"}})
+        timer.add("chain", time.perf_counter() - started)
+    return timer.summary()["chain"]
+
+
+def print_table(results: dict, set_names: list[str]):
+    header = f"{'config':<28}" + "".join(f"{name + ' R@k':>16}{name + ' MRR':>16}" for name in set_names)
+    print(header)
+    print("-" * len(header))
+    for config_name, by_set in results.items():
+        print(f"{config_name:<28}" + "".join(
+            f"{by_set[name]['recall']:>16.3f}{by_set[name]['mrr']:>16.3f}" for name in set_names
+        ))
+    print()
+    print(f"{'config':<28}{'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for config_name, by_set in results.items():
+        for stage, latency in by_set["all"]["latency_ms"].items():
+            print(f"{config_name:<28}{stage:<16}{latency['p50']:>10.2f}{latency['p95']:>10.2f}{latency['p99']:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark คุณภาพและความเร็วของ Retrieval ด้วยคำถามจาก Q&A.md")
+    parser.add_argument("--paraphrases", help="ไฟล์ JSONL ของคำถามที่เรียบเรียงใหม่เพิ่มเติม")
+    parser.add_argument("--no-paraphrase", action="store_true", help="ใช้เฉพาะคำถามต้นฉบับ")
+    parser.add_argument("--limit", type=int, help="จำกัดจำนวนคำถามต้นฉบับ (สำหรับทดสอบเร็วๆ)")
+    parser.add_argument("--chain", action="store_true", help="วัดเวลาทั้ง chain ด้วย Fake LLM เพิ่มเติม")
+    parser.add_argument("--rerank", action="store_true", help="เทียบค่าตั้งต้นที่มี cross-encoder rerank เพิ่มเติม")
+    parser.add_argument("--output", help="บันทึกผลเป็น JSON")
+    args = parser.parse_args()
+
+    pairs = load_qna_pairs()[:args.limit]
+    query_sets = {"orig": pairs}
+    if not args.no_paraphrase:
+        paraphrased = [(p, expected) for question, expected in pairs for p in make_paraphrases(question)]
+        if args.paraphrases:
+            paraphrased += load_extra_paraphrases(args.paraphrases, pairs)
+        query_sets["para"] = paraphrased
+    print(f"🚀 Benchmark: คำถามต้นฉบับ {len(pairs)} ข้อ, เรียบเรียงใหม่ {len(query_sets.get('para', []))} ข้อ")
+
+    db = rag_pipeline.load_vector_store()
+    sparse_index = rag_pipeline.load_sparse_index()
+    all_configs = CONFIGS + (RERANK_CONFIGS if args.rerank else [])
+    configs = [c for c in all_configs if not c["hybrid"] or sparse_index is not None]
+    # ปิด cache คะแนน เพื่อให้เวลา rerank ที่วัดได้เป็นต้นทุนจริงของการคำนวณทุกคู่
+    reranker = CrossEncoderReranker(
+        batch_size=rag_pipeline.RERANK_BATCH_SIZE, max_length=rag_pipeline.RERANK_MAX_LENGTH, cache_size=0
+    ) if args.rerank else None
+    if len(configs) < len(all_configs):
+        print("⚠️ ไม่พบ bm25_index.json ข้ามค่าตั้งต้นแบบ hybrid (รัน 2MD_prepare_vectorstore.py ใหม่ก่อน)")
+
+    # embed ครั้งเดียวต่อคำถาม แล้วใช้เวกเตอร์เดิมกับทุก config (วัดจาก model ตรงๆ ไม่ผ่าน query cache)
+    raw_embeddings = getattr(db.embeddings, "embeddings", db.embeddings)
+    embed_timer = StageTimer()
+    embedded_sets = {}
+    for name, queries in query_sets.items():
+        vectors = embed_all(raw_embeddings, [q for q, _ in queries], embed_timer)
+        embedded_sets[name] = [(q, expected, v) for (q, expected), v in zip(queries, vectors)]
+    embedded_sets["all"] = [item for name in query_sets for item in embedded_sets[name]]
+
+    results = {}
+    for config in configs:
+        results[config["name"]] = {name: evaluate(db, sparse_index, config, queries, reranker)
+                                   for name, queries in embedded_sets.items()}
+        results[config["name"]]["all"]["latency_ms"] = {
+            **embed_timer.summary(), **results[config["name"]]["all"]["latency_ms"]
+        }
+
+    print_table(results, list(embedded_sets))
+    report = {"configs": configs, "results": results}
+    if args.chain:
+        report["chain_latency_ms"] = benchmark_chain(db, sparse_index, [q for q, _ in pairs])
+        latency = report["chain_latency_ms"]
+        print(f"\nทั้ง chain (Fake LLM): p50={latency['p50']:.1f} ms  p95={latency['p95']:.1f} ms  p99={latency['p99']:.1f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"✅ บันทึกผลไว้ที่ {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import json
+import sqlite3
+import argparse
+import threading
+
+from langchain_core.documents import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+# --- Chunk Store (SQLite) แทน index.pkl ---
+# เก็บเนื้อหาและ metadata ของแต่ละ chunk ใน chunks.db ข้าง index.faiss
+# ตอนให้บริการเก็บไว้ในหน่วยความจำเฉพาะ map "ตำแหน่งใน FAISS -> id" แล้วอ่านเนื้อหาจากดิสก์เฉพาะ chunk ที่ค้นเจอ
+# จึงเริ่มระบบได้เร็วขึ้น ใช้ RAM น้อยลง และไม่ต้อง unpickle ไฟล์ (ไม่ต้องใช้ allow_dangerous_deserialization)
+# ย้ายจาก index.pkl เดิม: python chunk_store.py migrate
+
+CHUNK_STORE_FILE = "chunks.db"
+LEGACY_PICKLE_FILE = "index.pkl"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS index_map (
+    position INTEGER PRIMARY KEY,
+    doc_id TEXT NOT NULL
+);
+"""
+
+
+class SqliteDocstore(Docstore):
+    """Docstore แบบอ่านอย่างเดียวที่อ่าน chunk จาก SQLite เมื่อถูกค้นเจอ (ใช้แทน InMemoryDocstore ตอนให้บริการ)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # เปิด connection ใหม่เมื่ออยู่ใน process อื่น (api_server โหลด Vector Store ใน parent ก่อน fork และห้ามใช้ connection ข้าม fork)
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def search(self, search: str) -> Document | str:
+        with self._lock:
+            row = self._connection().execute("SELECT content, metadata FROM chunks WHERE id = ?", (search,)).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def search_many(self, ids: list[str]) -> dict[str, Document]:
+        """อ่านหลาย chunk ในคำสั่งเดียว"""
+        if not ids:
+            return {}
+        with self._lock:
+            rows = self._connection().execute(
+                f"SELECT id, content, metadata FROM chunks WHERE id IN ({','.join('?' * len(ids))})", ids
+            ).fetchall()
+        return {doc_id: Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+                for doc_id, content, metadata in rows}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def chunk_store_exists(vectorstore_path: str) -> bool:
+    return os.path.exists(os.path.join(vectorstore_path, CHUNK_STORE_FILE))
+
+
+def load_index_map(vectorstore_path: str) -> dict[int, str]:
+    conn = sqlite3.connect(f"file:{os.path.join(vectorstore_path, CHUNK_STORE_FILE)}?mode=ro", uri=True)
+    try:
+        return dict(conn.execute("SELECT position, doc_id FROM index_map ORDER BY position").fetchall())
+    finally:
+        conn.close()
+
+
+def load_docstore(vectorstore_path: str) -> tuple[SqliteDocstore, dict[int, str]]:
+    """คืน (docstore ที่อ่านจากดิสก์เมื่อใช้, map ตำแหน่งใน FAISS -> id) สำหรับสร้าง FAISS ตอนให้บริการ"""
+    return SqliteDocstore(os.path.join(vectorstore_path, CHUNK_STORE_FILE)), load_index_map(vectorstore_path)
+
+
+def load_all_documents(vectorstore_path: str) -> tuple[InMemoryDocstore, dict[int, str]]:
+    """อ่านทุก chunk เข้าหน่วยความจำ (ใช้ตอนอัปเดต index แบบ incremental ที่ต้องเพิ่ม/ลบ chunk)"""
+    conn = sqlite3.connect(f"file:{os.path.join(vectorstore_path, CHUNK_STORE_FILE)}?mode=ro", uri=True)
+    try:
+        docs = {
+            doc_id: Document(id=doc_id, page_content=content, metadata=json.loads(metadata))
+            for doc_id, content, metadata in conn.execute("SELECT id, content, metadata FROM chunks")
+        }
+    finally:
+        conn.close()
+    return InMemoryDocstore(docs), load_index_map(vectorstore_path)
+
+
+def load_vectorstore_for_update(vectorstore_path: str, embeddings):
+    """โหลด FAISS แบบแก้ไขได้ (index อยู่ในหน่วยความจำ + InMemoryDocstore) สำหรับ delete/add_embeddings แล้ว save_vectorstore"""
+    import faiss
+    from langchain_community.vectorstores import FAISS
+
+    index = faiss.read_index(os.path.join(vectorstore_path, "index.faiss"))
+    docstore, index_to_docstore_id = load_all_documents(vectorstore_path)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+
+def write_chunk_store(vectorstore_path: str, documents: dict[str, Document], index_to_docstore_id: dict[int, str]):
+    """เขียน chunks.db ใหม่ทั้งไฟล์ลงไฟล์ชั่วคราวก่อน แล้วสลับแทนที่ (process ที่เปิดไฟล์เดิมอยู่จะไม่เห็นข้อมูลครึ่งๆ กลางๆ)"""
+    path = os.path.join(vectorstore_path, CHUNK_STORE_FILE)
+    tmp_path = f"{path}.{os.getpid()}.tmp"  # แยกตาม process เผื่อหลาย worker ย้ายข้อมูลพร้อมกัน
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO chunks (id, content, metadata) VALUES (?, ?, ?)",
+            [(doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False))
+             for doc_id, doc in documents.items()],
+        )
+        conn.executemany("INSERT INTO index_map (position, doc_id) VALUES (?, ?)", index_to_docstore_id.items())
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp_path, path)
+
+
+def save_vectorstore(db, vectorstore_path: str):
+    """บันทึก FAISS (index.faiss + chunks.db) แทน save_local ที่เขียน index.pkl"""
+    import faiss
+
+    os.makedirs(vectorstore_path, exist_ok=True)
+    if not isinstance(db.docstore, AddableMixin) or not hasattr(db.docstore, "_dict"):
+        raise TypeError("save_vectorstore ต้องใช้กับ FAISS ที่มี InMemoryDocstore")
+    index_path = os.path.join(vectorstore_path, "index.faiss")
+    faiss.write_index(db.index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)  # สลับไฟล์ทีเดียว เพื่อไม่ให้ process ที่ mmap ไฟล์เดิมอยู่อ่านไฟล์ที่เขียนไม่เสร็จ
+    write_chunk_store(vectorstore_path, db.docstore._dict, db.index_to_docstore_id)
+    legacy_path = os.path.join(vectorstore_path, LEGACY_PICKLE_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
+
+
+def migrate(vectorstore_path: str, keep_pickle: bool = False):
+    """ย้ายข้อมูลจาก index.pkl (รูปแบบของ FAISS.save_local) มาเป็น chunks.db (unpickle ครั้งเดียวตอนย้าย)"""
+    import pickle
+
+    legacy_path = os.path.join(vectorstore_path, LEGACY_PICKLE_FILE)
+    if not os.path.exists(legacy_path):
+        print(f"❌ ไม่พบ {legacy_path}")
+        return
+    with open(legacy_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    documents = {doc_id: docstore.search(doc_id) for doc_id in index_to_docstore_id.values()}
+    write_chunk_store(vectorstore_path, documents, index_to_docstore_id)
+    print(f"✅ ย้าย {len(documents)} chunks จาก {LEGACY_PICKLE_FILE} ไปที่ {CHUNK_STORE_FILE} แล้ว")
+    if not keep_pickle:
+        os.remove(legacy_path)
+        print(f"🗑️ ลบ {LEGACY_PICKLE_FILE} แล้ว")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="จัดการ Chunk Store (SQLite) ของ Vector Store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="ย้ายข้อมูลจาก index.pkl มาเป็น chunks.db")
+    migrate_parser.add_argument("--path", default="vectorstore_smart_chunking_v2")
+    migrate_parser.add_argument("--keep-pickle", action="store_true", help="ไม่ลบ index.pkl หลังย้ายเสร็จ")
+    args = parser.parse_args()
+
+    migrate(args.path, keep_pickle=args.keep_pickle)
@@ -0,0 +1,142 @@
+import re
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+# --- Context Packer: ลดจำนวน token ของเอกสารอ้างอิงที่ส่งให้ Gemini ---
+# 1) ตัด chunk ที่ซ้ำ/ซ้อนกัน (chunk_overlap=150 ทำให้ chunk ติดกันมีข้อความซ้ำที่ขอบ)
+# 2) ตัด chunk ที่ความคล้ายกับคำถามต่ำกว่าเกณฑ์ (แต่เก็บอันดับต้นๆ ไว้อย่างน้อย min_docs ชิ้นเสมอ)
+# 3) บรรจุตามลำดับความเกี่ยวข้องจนเต็มงบ token (ประมาณ token แบบแยกอักษรไทย/อักษรอื่น)
+
+# อัตราส่วนตัวอักษรต่อ token โดยประมาณของ Gemini (ภาษาไทยใช้ token ถี่กว่าภาษาอังกฤษมาก)
+THAI_CHARS_PER_TOKEN = 2.5
+OTHER_CHARS_PER_TOKEN = 4.0
+THAI_CHAR_PATTERN = re.compile(r"[\u0e00-\u0e7f]")
+
+MIN_OVERLAP_CHARS = 40       # ความยาวขั้นต่ำของข้อความซ้ำที่ขอบ chunk ถึงจะตัดออก
+MAX_OVERLAP_CHARS = 400
+DUPLICATE_SHINGLE_SIZE = 12
+DUPLICATE_CONTAINMENT = 0.8  # ถ้า shingle ของ chunk นี้อยู่ใน chunk ที่เลือกไว้แล้วเกินสัดส่วนนี้ ถือว่าซ้ำ
+MIN_PARTIAL_TOKENS = 120     # งบที่เหลือต่ำกว่านี้จะไม่ตัดบางส่วนของ chunk ถัดไปมาใส่
+
+
+def estimate_tokens(text: str) -> int:
+    """ประมาณจำนวน token (อักษรไทยคิดแยกจากอักษรอื่น เพราะใช้ token ต่อตัวอักษรต่างกัน)"""
+    thai = len(THAI_CHAR_PATTERN.findall(text))
+    return int(thai / THAI_CHARS_PER_TOKEN + (len(text) - thai) / OTHER_CHARS_PER_TOKEN) + 1
+
+
+def _shingles(text: str, size: int = DUPLICATE_SHINGLE_SIZE) -> set[str]:
+    compact = re.sub(r"\s+", "", text)
+    return {compact[i:i + size] for i in range(max(1, len(compact) - size + 1))}
+
+
+def _overlap_length(previous: str, text: str) -> int:
+    """ความยาวของข้อความท้าย previous ที่ซ้ำกับข้อความต้น text (0 ถ้าซ้ำน้อยกว่า MIN_OVERLAP_CHARS)"""
+    for length in range(min(len(previous), len(text), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:length]):
+            return length
+    return 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """ตัดข้อความให้ไม่เกินงบ โดยพยายามตัดที่ท้ายบรรทัด (ภาษาไทยไม่มีจุดจบประโยค)"""
+    ratio = max_tokens / max(1, estimate_tokens(text))
+    cut = text[:int(len(text) * ratio)]
+    boundary = cut.rfind("\n")
+    if boundary > len(cut) // 2:
+        cut = cut[:boundary]
+    return cut.rstrip() + " …"
+
+
+class ContextPacker:
+    """
+    จัดเอกสารที่ค้นเจอให้อยู่ในงบ token
+    ความเกี่ยวข้องคำนวณจาก cosine ระหว่างเวกเตอร์คำถามกับเวกเตอร์ของ chunk ที่เก็บอยู่ใน FAISS แล้ว (ไม่ต้อง embed ซ้ำ)
+    เอกสารที่ไม่มีใน index (เช่น แถวจากตารางเกณฑ์พืช) จะถูกเก็บไว้เสมอ
+    """
+
+    def __init__(self, db, token_budget: int = 2000, relevance_cutoff: float = 0.78, min_docs: int = 2):
+        self.db = db
+        self.token_budget = token_budget
+        self.relevance_cutoff = relevance_cutoff
+        self.min_docs = min_docs
+        self._positions_by_id: dict[str, int] | None = None
+        self._lock = threading.Lock()
+        self._totals = {"requests": 0, "tokens_before": 0, "tokens_after": 0,
+                        "dropped_duplicate": 0, "dropped_low_relevance": 0, "dropped_budget": 0}
+
+    def _position_of(self, doc: Document) -> int | None:
+        """
+        ตำแหน่งของ chunk ใน FAISS index จาก doc.id (None ถ้าไม่ได้มาจาก index เช่น แถวจากตารางเกณฑ์พืช)
+        ไม่ค้นจากเนื้อหา เพราะต้องอ่านทุก chunk จาก chunks.db ขึ้นมาไว้ในหน่วยความจำ
+        """
+        if self._positions_by_id is None:
+            self._positions_by_id = {doc_id: position for position, doc_id in self.db.index_to_docstore_id.items()}
+        return self._positions_by_id.get(getattr(doc, "id", None))
+
+    def relevance(self, docs: list[Document], query_vector: list[float]) -> list[float | None]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = []
+        for doc in docs:
+            position = self._position_of(doc)
+            if position is None:
+                scores.append(None)
+                continue
+            vector = self.db.index.reconstruct(position)
+            scores.append(float(np.dot(query, vector / (np.linalg.norm(vector) or 1.0))))
+        return scores
+
+    def pack(self, docs: list[Document], query_vector: list[float]) -> list[Document]:
+        """คืนเอกสารที่ผ่านการตัดซ้ำ/ตัดคะแนนต่ำ และไม่เกินงบ token (เรียงตามลำดับเดิม)"""
+        return self.pack_with_stats(docs, query_vector)[0]
+
+    def pack_with_stats(self, docs: list[Document], query_vector: list[float]) -> tuple[list[Document], dict]:
+        """เหมือน pack แต่คืนตัวเลขของรอบนี้ด้วย (tokens_before, tokens_after, dropped_*) สำหรับบันทึกต่อรอบ"""
+        tokens_before = sum(estimate_tokens(doc.page_content) for doc in docs)
+        scores = self.relevance(docs, query_vector)
+        packed: list[Document] = []
+        seen_shingles: set[str] = set()
+        used_tokens = 0
+        dropped = {"dropped_duplicate": 0, "dropped_low_relevance": 0, "dropped_budget": 0}
+
+        for rank, (doc, score) in enumerate(zip(docs, scores)):
+            if score is not None and score < self.relevance_cutoff and rank >= self.min_docs:
+                dropped["dropped_low_relevance"] += 1
+                continue
+            text = doc.page_content
+            shingles = _shingles(text)
+            if seen_shingles and len(shingles & seen_shingles) / len(shingles) >= DUPLICATE_CONTAINMENT:
+                dropped["dropped_duplicate"] += 1
+                continue
+            for previous in packed:
+                overlap = _overlap_length(previous.page_content, text)
+                if overlap:
+                    text = text[overlap:].lstrip()
+            tokens = estimate_tokens(text)
+            remaining = self.token_budget - used_tokens
+            if tokens > remaining:
+                if remaining < MIN_PARTIAL_TOKENS:
+                    dropped["dropped_budget"] += 1
+                    continue
+                text = truncate_to_tokens(text, remaining)
+                tokens = estimate_tokens(text)
+            packed.append(Document(page_content=text, metadata=doc.metadata))
+            seen_shingles |= shingles
+            used_tokens += tokens
+
+        with self._lock:
+            self._totals["requests"] += 1
+            self._totals["tokens_before"] += tokens_before
+            self._totals["tokens_after"] += used_tokens
+            for key, count in dropped.items():
+                self._totals[key] += count
+        return packed, {"tokens_before": tokens_before, "tokens_after": used_tokens, **dropped}
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+        totals["tokens_saved"] = totals["tokens_before"] - totals["tokens_after"]
+        return totals
@@ -0,0 +1,265 @@
+import os
+import re
+import json
+
+# --- ตารางเกณฑ์พืชแบบตรงตัว (Exact Structured Lookup) ---
+# คอมไพล์ส่วน PLANTING_DENSITY และ MINIMUM_AREA ของ knowledge_base.md เป็นตาราง
+# "ชื่อพืช/กิจกรรม -> จำนวนต้นต่อไร่ -> เกณฑ์พื้นที่ขั้นต่ำ" ตอนสร้าง index (2MD_prepare_vectorstore.py)
+# แล้ว app.py ใช้ค้นหาแบบ dictionary ว่าคำถามพูดถึงพืชอะไร เพื่อวางข้อมูลที่ตรงเป๊ะไว้บนสุดของ context
+# ชื่อพืชต้องตรงกับขอบคำที่ตัดด้วย pythainlp (newmm) จึงไม่จับ "ยาง" ใน "ยางรถยนต์" หรือ "ส้ม" ใน "ส้มตำ"
+
+CROP_TABLE_FILE = "crop_table.json"
+TABLE_VERSION = 1
+
+# ส่วนของไฟล์ knowledge_base.md ที่ใช้สร้างตาราง
+SECTION_PATTERN = r"---\[SECTION:{name}\]---(.*?)(?=---\[SECTION:|\Z)"
+
+# เกณฑ์พื้นที่ขั้นต่ำของไม้ผล/ไม้ยืนต้น (ใช้กับทุกพืชในตาราง PLANTING_DENSITY)
+TREE_MINIMUM_AREA = "ต้องมีเนื้อที่เพาะปลูกตั้งแต่ 1 ไร่ขึ้นไป และมีจำนวนต้นตามเกณฑ์จำนวนต้นต่อไร่"
+
+# ชื่อเรียกอื่น/คำพูดทั่วไปของพืช -> ชื่อในตาราง (เพิ่มเติมจากชื่อที่อ่านได้จากวงเล็บในเอกสาร)
+# ไม่ใส่คำพยางค์เดียวที่กว้างเกินไป (เช่น "ยาง", "ผัก") เพราะเป็นส่วนหนึ่งของคำอื่นที่ไม่เกี่ยวกับพืชได้ง่าย
+CROP_SYNONYMS = {
+    "ลำใย": "ลำไย",
+    "ปาล์ม": "ปาล์มน้ำมัน",
+    "สวนยาง": "ยางพารา",
+    "มะพร้าว": "มะพร้าวแกง",
+    "มะพร้าวน้ำหอม": "มะพร้าวอ่อน",
+    "มะขามเปรี้ยว": "มะขาม",
+    "มะขามหวาน": "มะขาม",
+    "อโวคาโด": "อะโวคาโด",
+    "อาโวคาโด": "อะโวคาโด",
+    "แอปเปิล": "แอปเปิ้ล",
+    "อินทผาลัม": "อินทผลัม",
+    "เม็ดมะม่วงหิมพานต์": "มะม่วงหิมพานต์",
+    "กาหยู": "มะม่วงหิมพานต์",
+    "ไผ่ตง": "หน่อไม้ไผ่ตง",
+    "โรบัสต้า": "กาแฟ พันธุ์โรบัสต้า",
+    "อาราบิก้า": "กาแฟ พันธุ์อราบิก้า",
+    "อราบิก้า": "กาแฟ พันธุ์อราบิก้า",
+    "ยูคา": "ยูคาลิปตัส",
+    "ผักชี": "พืชผัก",
+    "ข้าวโพด": "พืชไร่",
+    "มันสำปะหลัง": "พืชไร่",
+    "อ้อย": "พืชไร่",
+    "ถั่วเหลือง": "พืชไร่",
+    "ถั่วลิสง": "พืชไร่",
+    "ทำนา": "ข้าว",
+    "เห็ด": "เพาะเห็ด",
+    "ถั่วงอก": "ทำผักงอก",
+    "ต้นอ่อน": "ทำผักงอก",
+    "ไข่น้ำ": "ผำ",
+    "นาเกลือ": "ทำนาเกลือสมุทร",
+    "โรงเรือน": "เพาะปลูกพืชในระบบโรงเรือนถาวร",
+    "เมล่อน": "เพาะปลูกพืชในระบบโรงเรือนถาวร",
+}
+
+# หัวข้อย่อยที่เป็น "เงื่อนไข" ของรายการแม่ ไม่ใช่ชื่อพืช/กิจกรรม
+CONDITION_LABEL_PREFIXES = ("นิยาม", "เกณฑ์", "วิธี", "ข้อสังเกต", "หมายเหตุ", "กรณี", "ปลูก", "แบบ", "พันธุ์")
+
+BULLET_PATTERN = re.compile(r"^(?P<indent>\s*)\*\s+\*\*(?P<label>[^*]+?):?\*\*:?\s*(?P<text>.*)$")
+NUMBER_PATTERN = re.compile(r"จำนวน\s*\*\*(?P<value>[\d\s\-–]+)\*\*\s*ต้นต่อไร่")
+PAREN_PATTERN = re.compile(r"\(([^)]*)\)")
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", text.replace("**", "").replace("*", "")).strip()
+
+
+def _split_label(label: str) -> tuple[str, list[str]]:
+    """แยกชื่อหลักและชื่อเรียกอื่นจาก label เช่น 'ส้ม (ทุกชนิด เช่น ส้มโอ, ส้มเกลี้ยง)' -> ('ส้ม', ['ส้มโอ', 'ส้มเกลี้ยง'])"""
+    aliases = []
+    for inner in PAREN_PATTERN.findall(label):
+        if "เช่น" in inner:
+            aliases.extend(a.strip() for a in inner.split("เช่น", 1)[1].split(","))
+    name = _clean(PAREN_PATTERN.sub("", label))
+    return name, [a for a in aliases if a]
+
+
+def _section(kb_text: str, name: str) -> str:
+    match = re.search(SECTION_PATTERN.format(name=name), kb_text, re.DOTALL)
+    return match.group(1) if match else ""
+
+
+def _parse_planting_density(text: str) -> list[dict]:
+    rows, parent = [], None
+    for line in text.splitlines():
+        bullet = BULLET_PATTERN.match(line)
+        if not bullet:
+            continue
+        name, aliases = _split_label(bullet.group("label"))
+        number = NUMBER_PATTERN.search(line)
+        if not bullet.group("indent"):
+            parent = (name, aliases)
+            if not number:
+                continue  # รายการแม่ที่แยกตามพันธุ์/วิธีปลูก (เช่น กาแฟ, มะละกอ) ข้อมูลอยู่ในบรรทัดย่อย
+        elif parent is not None:
+            variant = name
+            name = f"{parent[0]} {variant}"
+            aliases = aliases + [variant.replace("พันธุ์", "").strip()] if variant.startswith("พันธุ์") else aliases
+        if not number:
+            continue
+        rows.append({
+            "name": name,
+            "aliases": aliases + ([parent[0]] if bullet.group("indent") and parent else []),
+            "category": "ไม้ผล/ไม้ยืนต้น",
+            "trees_per_rai": _clean(number.group("value")).replace(" ", ""),
+            "minimum_area": TREE_MINIMUM_AREA,
+            "source": "planting_density",
+        })
+    return rows
+
+
+def _parse_minimum_area(text: str) -> list[dict]:
+    """อ่านเกณฑ์พื้นที่/จำนวนขั้นต่ำของแต่ละกิจกรรม (รวมบรรทัดย่อยที่เป็นเงื่อนไขเข้าไว้ในข้อความเกณฑ์)"""
+    rows, current = [], None
+    for line in text.splitlines():
+        if line.startswith("#"):
+            current = None
+            continue
+        bullet = BULLET_PATTERN.match(line)
+        if bullet:
+            label = _clean(bullet.group("label"))
+            is_condition = label.startswith(CONDITION_LABEL_PREFIXES)
+            if not bullet.group("indent") or not is_condition:
+                if label.startswith(("ไม้ผล", "หมายเหตุ")):
+                    current = None  # ไม้ผลใช้ข้อมูลจาก PLANTING_DENSITY แทน
+                    continue
+                names = [n.strip() for n in re.split(r"\s*/\s*|\s+หรือ\s+", PAREN_PATTERN.sub("", label)) if n.strip()]
+                current = {
+                    "name": names[0],
+                    "aliases": names[1:],
+                    "category": "เกณฑ์พื้นที่ขั้นต่ำ",
+                    "trees_per_rai": None,
+                    "minimum_area": _clean(bullet.group("text")),
+                    "source": "minimum_area",
+                }
+                rows.append(current)
+                continue
+        if current is not None and line.strip():
+            current["minimum_area"] = _clean(f"{current['minimum_area']} {line}")
+    # กลุ่มที่เป็นแค่หัวข้อรวม (เช่น 'เพาะเลี้ยงแมลงเศรษฐกิจ') และไม่มีเกณฑ์ของตัวเอง ไม่ต้องเก็บ
+    return [row for row in rows if row["minimum_area"]]
+
+
+def compile_crop_table(kb_text: str) -> dict:
+    """คอมไพล์ตารางเกณฑ์พืชจากเนื้อหา knowledge_base.md"""
+    rows = _parse_planting_density(_section(kb_text, "PLANTING_DENSITY"))
+    rows += _parse_minimum_area(_section(kb_text, "MINIMUM_AREA"))
+    names = {row["name"] for row in rows}
+    synonyms = {alias: target for alias, target in CROP_SYNONYMS.items() if target in names}
+    return {"version": TABLE_VERSION, "rows": rows, "synonyms": synonyms}
+
+
+def save_crop_table(table: dict, vectorstore_path: str) -> bool:
+    """บันทึกตารางไว้ข้าง index (เขียนเฉพาะเมื่อเนื้อหาเปลี่ยน เพื่อไม่ให้ fingerprint ของ answer cache เปลี่ยนโดยไม่จำเป็น)"""
+    path = os.path.join(vectorstore_path, CROP_TABLE_FILE)
+    content = json.dumps(table, ensure_ascii=False, indent=2)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == content:
+                return False
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return True
+
+
+def _make_word_tokenizer(keys: list[str]):
+    """
+    ตัวตัดคำ newmm ที่เพิ่มชื่อในตารางเข้าพจนานุกรม (ชื่อที่ไม่มีในพจนานุกรมจะไม่ถูกตัดกลางคำ)
+    คืน None ถ้าไม่ได้ติดตั้ง pythainlp (import ตอนโหลดตาราง เพื่อไม่ให้การ import โมดูลนี้ช้า)
+    """
+    try:
+        from pythainlp.corpus.common import thai_words
+        from pythainlp.tokenize import word_tokenize
+        from pythainlp.util import dict_trie
+    except ImportError:
+        print("⚠️ ไม่ได้ติดตั้ง pythainlp ตารางเกณฑ์พืชจะจับชื่อพืชแบบ substring (ไม่ตรวจขอบคำ)")
+        return None
+    trie = dict_trie(set(thai_words()) | set(keys))
+    return lambda text: word_tokenize(text, custom_dict=trie, engine="newmm", keep_whitespace=True)
+
+
+class CropTable:
+    """ตารางเกณฑ์พืชในหน่วยความจำ พร้อมดัชนีชื่อพืช/ชื่อเรียกอื่น สำหรับค้นหาจากข้อความคำถาม"""
+
+    def __init__(self, table: dict):
+        self.rows = table["rows"]
+        self._index: dict[str, list[int]] = {}
+        # ชื่อรายการแม่ที่แถวพันธุ์ย่อยใช้ร่วมกัน (เช่น "กาแฟ" ของ "กาแฟ พันธุ์โรบัสต้า" และ "กาแฟ พันธุ์อราบิก้า")
+        self._parent_keys: dict[str, set[int]] = {}
+        for i, row in enumerate(self.rows):
+            for key in [row["name"], *row["aliases"]]:
+                self._index.setdefault(key.replace(" ", ""), []).append(i)
+                if key != row["name"] and row["name"].startswith(f"{key} "):
+                    self._parent_keys.setdefault(key.replace(" ", ""), set()).add(i)
+        for alias, target in table.get("synonyms", {}).items():
+            if alias not in CROP_SYNONYMS:
+                continue  # ชื่อเรียกที่ถูกถอดออกแล้ว แต่ยังค้างอยู่ใน crop_table.json ที่สร้างด้วยเวอร์ชันก่อน
+            for i, row in enumerate(self.rows):
+                if row["name"] == target:
+                    self._index.setdefault(alias.replace(" ", ""), []).append(i)
+        # เรียงจากยาวไปสั้น เพื่อให้ชื่อที่ยาวกว่าชนะ (เช่น 'มะม่วงหิมพานต์' ก่อน 'มะม่วง')
+        self._keys = sorted(self._index, key=len, reverse=True)
+        self._tokenize = _make_word_tokenizer(self._keys)
+
+    @classmethod
+    def load(cls, vectorstore_path: str) -> "CropTable | None":
+        path = os.path.join(vectorstore_path, CROP_TABLE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+        return cls(table) if table.get("version") == TABLE_VERSION else None
+
+    def _word_boundaries(self, compact: str) -> set[int] | None:
+        """ตำแหน่งขอบคำทั้งหมดในข้อความ (None ถ้าไม่มีตัวตัดคำ)"""
+        if self._tokenize is None:
+            return None
+        boundaries, position = {0}, 0
+        for token in self._tokenize(compact):
+            position += len(token)
+            boundaries.add(position)
+        return boundaries
+
+    def match(self, text: str) -> list[dict]:
+        """คืนแถวของพืช/กิจกรรมที่ถูกกล่าวถึงในข้อความ (เรียงตามตำแหน่งที่พบ, ไม่ซ้ำ) นับเฉพาะชื่อที่เริ่มและจบตรงขอบคำ"""
+        compact = re.sub(r"[\s\u200b]+", "", text)
+        boundaries = self._word_boundaries(compact)
+        taken = [False] * len(compact)
+        found = []
+        for key in self._keys:
+            start = compact.find(key)
+            while start != -1:
+                end = start + len(key)
+                on_boundary = boundaries is None or (start in boundaries and end in boundaries)
+                if not on_boundary:
+                    start = compact.find(key, start + 1)
+                    continue
+                if not any(taken[start:end]):
+                    for pos in range(start, end):
+                        taken[pos] = True
+                    found.append((start, key))
+                start = compact.find(key, end)
+        matched: dict[int, set[str]] = {}
+        for _, key in sorted(found):
+            for i in self._index[key]:
+                matched.setdefault(i, set()).add(key)
+        # ถ้าระบุพันธุ์ไว้ (เช่น "กาแฟโรบัสต้า") ตัดแถวพันธุ์อื่นที่ตรงแค่ชื่อรายการแม่ออก
+        specific = {i for i, keys in matched.items() if any(i not in self._parent_keys.get(k, ()) for k in keys)}
+        return [
+            self.rows[i] for i, keys in matched.items()
+            if i in specific or not any(self._parent_keys[k] & specific for k in keys)
+        ]
+
+
+def format_rows(rows: list[dict]) -> str:
+    """จัดรูปแบบแถวที่ค้นเจอเป็นข้อความสำหรับวางบนสุดของ context"""
+    lines = ["ข้อมูลเกณฑ์ที่ตรงกับพืช/กิจกรรมในคำถาม (จากตารางเกณฑ์ในคู่มือ):"]
+    for row in rows:
+        parts = [f"- {row['name']}"]
+        if row["trees_per_rai"]:
+            parts.append(f"จำนวนต้นตามเกณฑ์ {row['trees_per_rai']} ต้นต่อไร่")
+        parts.append(f"เกณฑ์ขั้นต่ำ: {row['minimum_area']}")
+        lines.append(" | ".join(parts))
+    return "\n".join(lines)
@@ -0,0 +1,272 @@
+import os
+import re
+import json
+import time
+import argparse
+import importlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# --- Embedding Backend ที่เลือกได้ (ใช้ร่วมกันระหว่าง app.py และ 2MD_prepare_vectorstore.py) ---
+# - "torch": sentence-transformers ตามเดิม (fp32)
+# - "onnx":  โมเดลเดียวกันที่ export เป็น ONNX และ quantize เป็น int8 รันด้วย ONNX Runtime (เร็วกว่าและใช้ RAM น้อยกว่าบน CPU)
+# สร้างโมเดล ONNX: python embedding_backend.py export
+# ตรวจความเท่าเทียมของผลค้นหา: python embedding_backend.py parity --k 8
+
+EMBEDDING_MODEL = "intfloat/multilingual-e5-large"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "models/multilingual-e5-large-onnx")
+ONNX_FP32_FILE = "model.onnx"
+ONNX_INT8_FILE = "model_int8.onnx"
+ONNX_CONFIG_FILE = "backend_config.json"
+
+
+def get_device() -> str:
+    """ใช้ GPU ถ้ามี, ถ้าไม่มีจะใช้ CPU อัตโนมัติ"""
+    return 'cuda' if 'CUDA_VISIBLE_DEVICES' in os.environ else 'cpu'
+
+
+def model_tag(backend: str | None = None) -> str:
+    """ชื่อที่ใช้ระบุว่า embedding สร้างจากโมเดล/backend ไหน (ใช้เป็นส่วนหนึ่งของ key ของ cache และ manifest)"""
+    backend = backend or EMBEDDING_BACKEND
+    return EMBEDDING_MODEL if backend == "torch" else f"{EMBEDDING_MODEL}+onnx-int8"
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Embedding ผ่าน ONNX Runtime (โมเดล int8) ให้ผลเหมือน sentence-transformers:
+    แทนที่ขึ้นบรรทัดใหม่ด้วยช่องว่าง, pooling และ normalize ตามการตั้งค่าของโมเดลต้นฉบับ
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, batch_size: int = 16, num_threads: int | None = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        config_path = os.path.join(model_dir, ONNX_CONFIG_FILE)
+        if not os.path.exists(config_path):
+            raise FileNotFoundError(f"ไม่พบโมเดล ONNX ที่ '{model_dir}'! กรุณารัน python embedding_backend.py export ก่อน")
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, ONNX_INT8_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """embed รายการข้อความ (เป็น batch ตาม batch_size) คืนค่าเป็น numpy array"""
+        outputs = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = [text.replace("\n", " ") for text in texts[i:i + self.batch_size]]
+            tokens = self.tokenizer(batch, padding=True, truncation=True,
+                                    max_length=self.config["max_seq_length"], return_tensors="np")
+            feeds = {name: tokens[name].astype(np.int64) for name in ("input_ids", "attention_mask", "token_type_ids")
+                     if name in self.input_names and name in tokens}
+            hidden = self.session.run(None, feeds)[0]
+            outputs.append(self._pool(hidden, tokens["attention_mask"]))
+        return np.vstack(outputs) if outputs else np.zeros((0, 0), dtype=np.float32)
+
+    def _pool(self, hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.config["pooling"] == "cls":
+            pooled = hidden[:, 0]
+        else:
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.config["normalize"]:
+            pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.astype(np.float32)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode([text])[0].tolist()
+
+
+ZERO_WIDTH_PATTERN = re.compile("[\u200b\u200c\u200d\u2060\ufeff]")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """ตัดอักขระความกว้างศูนย์ (พบบ่อยในข้อความภาษาไทยที่คัดลอกมา) และรวมช่องว่างที่ติดกันให้เหลือช่องเดียว"""
+    return WHITESPACE_PATTERN.sub(" ", ZERO_WIDTH_PATTERN.sub("", text)).strip()
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    ครอบ Embeddings เดิมด้วย LRU cache ของ "ข้อความคำถาม -> เวกเตอร์" (จำกัดจำนวน)
+    ใช้ร่วมกันทั้ง retriever และ answer cache คำถามยอดนิยมจึงไม่ต้อง encode ซ้ำ
+    (embed_documents ไม่ถูก cache เพราะใช้เฉพาะตอนสร้าง index)
+    """
+
+    def __init__(self, embeddings: Embeddings, max_size: int = 2048):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[str, list[float]] = OrderedDict()
+
+    def embed_query(self, text: str) -> list[float]:
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+        vector = self.embeddings.embed_query(key)
+        with self._lock:
+            self._cache[key] = list(vector)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return list(vector)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+def load_embeddings(backend: str | None = None) -> Embeddings:
+    """สร้าง Embeddings ตาม backend ที่เลือก (ค่าเริ่มต้นอ่านจาก EMBEDDING_BACKEND)"""
+    backend = backend or EMBEDDING_BACKEND
+    if backend == "onnx":
+        return OnnxEmbeddings(ONNX_MODEL_DIR)
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL, model_kwargs={'device': get_device()})
+    raise ValueError(f"ไม่รู้จัก embedding backend '{backend}' (ใช้ได้: torch, onnx)")
+
+
+def export_onnx(model_dir: str = ONNX_MODEL_DIR):
+    """export โมเดล e5 เป็น ONNX (fp32) แล้ว quantize น้ำหนักเป็น int8 แบบ dynamic"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(model_dir, exist_ok=True)
+    print(f"กำลังโหลดโมเดลต้นฉบับ: {EMBEDDING_MODEL}")
+    st_model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model[0].tokenizer
+    pooling = next(m for m in st_model if isinstance(m, Pooling))
+
+    fp32_path = os.path.join(model_dir, ONNX_FP32_FILE)
+    dummy = tokenizer(["ทดสอบการขึ้นทะเบียนเกษตรกร"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    print(f"กำลัง export เป็น ONNX ที่ '{fp32_path}'...")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(dummy[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+
+    int8_path = os.path.join(model_dir, ONNX_INT8_FILE)
+    print(f"กำลัง quantize เป็น int8 ที่ '{int8_path}'...")
+    # โมเดล fp32 ใหญ่กว่า 2GB จึงถูกบันทึกแบบ external data
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8, use_external_data_format=True)
+
+    tokenizer.save_pretrained(model_dir)
+    with open(os.path.join(model_dir, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "source_model": EMBEDDING_MODEL,
+            "max_seq_length": st_model.max_seq_length,
+            "pooling": "cls" if pooling.pooling_mode_cls_token else "mean",
+            "normalize": any(isinstance(m, Normalize) for m in st_model),
+        }, f, ensure_ascii=False, indent=2)
+    print("✅ export เสร็จสิ้น! ตั้งค่า EMBEDDING_BACKEND=onnx เพื่อใช้งาน")
+
+
+def parity_check(k: int = 8, vectorstore_path: str = "vectorstore_smart_chunking_v2"):
+    """
+    เทียบผลค้นหาระหว่าง fp32 (torch) กับ int8 (onnx) บนคำถามทั้งหมดใน Q&A.md
+    - query-only: encode คำถามด้วยทั้งสอง backend แล้วค้นใน index เดิม (สร้างด้วย fp32)
+    - end-to-end: embed ทุก chunk ใหม่ด้วย int8 เป็น index ชั่วคราว แล้วเทียบ top-k (คำถาม int8 บน index int8)
+      กับ top-k ของ fp32 บน index เดิม ซึ่งตรงกับการใช้งานจริงเมื่อตั้ง EMBEDDING_BACKEND=onnx และสร้าง index ใหม่
+    รายงาน overlap@k (สัดส่วนเอกสาร top-k ที่ตรงกัน), cosine ระหว่างเวกเตอร์ และเวลา encode
+    """
+    import faiss
+    from chunk_store import load_all_documents
+
+    prepare = importlib.import_module("2MD_prepare_vectorstore")
+    with open(prepare.QNA_MARKDOWN_PATH, "r", encoding="utf-8") as f:
+        qna_docs = prepare.parse_qna_markdown(f.read())
+    questions = [doc.page_content.split("\nคำถาม: ", 1)[1].split("\nคำตอบ: ", 1)[0] for doc in qna_docs]
+    print(f"กำลังเทียบผลค้นหาด้วยคำถาม {len(questions)} ข้อ (k={k})...")
+
+    index = faiss.read_index(os.path.join(vectorstore_path, "index.faiss"))
+    results = {}
+    for backend in ("torch", "onnx"):
+        embeddings = load_embeddings(backend)
+        started = time.perf_counter()
+        vectors = np.array([embeddings.embed_query(q) for q in questions], dtype=np.float32)
+        elapsed = time.perf_counter() - started
+        _, ids = index.search(vectors, k)
+        results[backend] = (vectors, ids, elapsed)
+
+    fp32_vectors, fp32_ids, fp32_time = results["torch"]
+    int8_vectors, int8_ids, int8_time = results["onnx"]
+    cosines = np.sum(fp32_vectors * int8_vectors, axis=1) / (
+        np.linalg.norm(fp32_vectors, axis=1) * np.linalg.norm(int8_vectors, axis=1))
+
+    # index ชั่วคราวจากเอกสารที่ embed ด้วย int8 (เรียงตามตำแหน่งเดียวกับ index เดิม และใช้ metric เดียวกัน)
+    docstore, index_to_docstore_id = load_all_documents(vectorstore_path)
+    texts = [docstore.search(index_to_docstore_id[i]).page_content for i in range(index.ntotal)]
+    print(f"กำลัง embed {len(texts)} chunk ด้วย int8 เพื่อสร้าง index สำหรับเทียบ...")
+    started = time.perf_counter()
+    doc_vectors = np.array(embeddings.embed_documents(texts), dtype=np.float32)
+    doc_time = time.perf_counter() - started
+    int8_index = faiss.clone_index(index)
+    int8_index.reset()
+    int8_index.add(doc_vectors)
+    _, rebuilt_ids = int8_index.search(int8_vectors, k)
+
+    print("[query-only] คำถาม int8 บน index fp32:")
+    _print_overlap(fp32_ids, int8_ids, k)
+    print("[end-to-end] คำถาม int8 บน index int8:")
+    _print_overlap(fp32_ids, rebuilt_ids, k)
+    print(f"cosine(fp32, int8): เฉลี่ย {np.mean(cosines):.4f}, ต่ำสุด {np.min(cosines):.4f}")
+    print(f"เวลา encode ต่อคำถาม: torch {fp32_time / len(questions) * 1000:.1f} ms, "
+          f"onnx {int8_time / len(questions) * 1000:.1f} ms")
+    print(f"เวลา embed chunk ด้วย int8: {doc_time / max(len(texts), 1) * 1000:.1f} ms ต่อ chunk")
+
+
+def _print_overlap(expected_ids: np.ndarray, actual_ids: np.ndarray, k: int):
+    overlaps = [len(set(a) & set(b)) / k for a, b in zip(expected_ids.tolist(), actual_ids.tolist())]
+    top1 = np.mean(expected_ids[:, 0] == actual_ids[:, 0])
+    print(f"  overlap@{k}: เฉลี่ย {np.mean(overlaps):.3f}, ต่ำสุด {np.min(overlaps):.3f}, top-1 ตรงกัน: {top1:.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="จัดการ Embedding Backend (export ONNX / ตรวจ parity)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("export", help="export โมเดลเป็น ONNX และ quantize เป็น int8")
+    parity_parser = subparsers.add_parser("parity", help="เทียบผลค้นหา fp32 กับ int8 (ทั้งคำถามและ index) บนคำถามใน Q&A.md")
+    parity_parser.add_argument("--k", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx()
+    else:
+        parity_check(k=args.k)
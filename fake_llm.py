@@ -0,0 +1,70 @@
+import time
+import asyncio
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# --- Fake Chat Model สำหรับทดสอบแบบไม่ใช้ network (จำลอง latency และ error 429) ---
+
+
+class FakeRateLimitError(Exception):
+    """จำลอง error 429 ของ Gemini"""
+    status_code = 429
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model ปลอมที่ตอบข้อความคงที่
+    - latency_seconds: เวลาที่หน่วงก่อนตอบ (จำลองเวลารอ network)
+    - rate_limit_failures: จำนวนครั้งแรกที่จะโยน error 429
+    - chunk_size: ขนาดของแต่ละ chunk ตอน stream
+    """
+
+    response: str = "นี่คือคำตอบทดสอบจาก Fake LLM สำหรับการขึ้นทะเบียนเกษตรกร"
+    latency_seconds: float = 0.0
+    rate_limit_failures: int = 0
+    chunk_size: int = 8
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _start_call(self):
+        self.calls += 1
+        if self.calls <= self.rate_limit_failures:
+            raise FakeRateLimitError("429 Resource has been exhausted (e.g. check quota). retry in 1s")
+
+    def _usage(self, messages) -> dict:
+        input_tokens = sum(len(str(m.content)) for m in messages) // 3
+        output_tokens = len(self.response) // 3
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens}
+
+    def _pieces(self):
+        return [self.response[i:i + self.chunk_size] for i in range(0, len(self.response), self.chunk_size)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self._start_call()
+        time.sleep(self.latency_seconds)
+        message = AIMessage(content=self.response, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self._start_call()
+        await asyncio.sleep(self.latency_seconds)
+        message = AIMessage(content=self.response, usage_metadata=self._usage(messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._start_call()
+        time.sleep(self.latency_seconds)
+        for piece in self._pieces():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self._start_call()
+        await asyncio.sleep(self.latency_seconds)
+        for piece in self._pieces():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+import numpy as np
+
+from embedding_backend import model_tag
+
+# --- FAQ Fast Path: ตอบคำถามที่เกือบตรงกับคำถามใน Q&A.md ด้วยคำตอบที่คัดไว้แล้ว (ไม่เรียก LLM เลย) ---
+# ตอนสร้าง index (2MD_prepare_vectorstore.py) จะ embed เฉพาะข้อความคำถามของ Q&A แยกจาก Vector Store หลัก
+# แล้วบันทึกเป็น faq_index.npz ข้าง index.faiss; ตอนตอบจะเทียบ cosine กับเวกเตอร์คำถามของผู้ใช้ (ไม่กี่ร้อยแถว ใช้ numpy ก็พอ)
+
+FAQ_INDEX_FILE = "faq_index.npz"
+
+
+def split_qna(page_content: str) -> tuple[str, str]:
+    """แยกคำถามและคำตอบจากเนื้อหา chunk ที่ parse_qna_markdown สร้าง"""
+    question = page_content.split("\nคำถาม: ", 1)[1].split("\nคำตอบ: ", 1)[0]
+    answer = page_content.split("\nคำตอบ: ", 1)[1]
+    return question.strip(), answer.strip()
+
+
+def _question_hash(question: str) -> str:
+    return hashlib.sha256(question.encode("utf-8")).hexdigest()
+
+
+def build_faq_index(qna_docs, embeddings, vectorstore_path: str) -> tuple[int, int]:
+    """
+    สร้าง faq_index.npz จาก Q&A chunk (embed เฉพาะคำถามที่ยังไม่มีในไฟล์เดิม)
+    คืน (จำนวนคำถามทั้งหมด, จำนวนที่ต้อง embed ใหม่)
+    """
+    entries = [(*split_qna(doc.page_content), doc.metadata.get("category", "")) for doc in qna_docs]
+    path = os.path.join(vectorstore_path, FAQ_INDEX_FILE)
+    previous = {}
+    if os.path.exists(path):
+        data = np.load(path, allow_pickle=False)
+        if str(data["model"]) == model_tag():
+            previous = {_question_hash(q): v for q, v in zip(data["questions"].tolist(), data["vectors"])}
+
+    missing = [q for q, _, _ in entries if _question_hash(q) not in previous]
+    if missing:
+        for question, vector in zip(missing, embeddings.embed_documents(missing)):
+            previous[_question_hash(question)] = np.asarray(vector, dtype=np.float32)
+
+    vectors = np.vstack([previous[_question_hash(q)] for q, _, _ in entries]).astype(np.float32) \
+        if entries else np.zeros((0, 0), dtype=np.float32)
+    np.savez(
+        path,
+        questions=np.array([q for q, _, _ in entries]),
+        answers=np.array([a for _, a, _ in entries]),
+        categories=np.array([c for _, _, c in entries]),
+        vectors=vectors,
+        model=np.array(model_tag()),
+    )
+    return len(entries), len(missing)
+
+
+class FaqIndex:
+    """ค้นคำถามใน Q&A.md ที่ใกล้เคียงคำถามผู้ใช้มากที่สุด และบันทึกทุกครั้งที่ตอบผ่าน fast path"""
+
+    def __init__(self, questions: list[str], answers: list[str], categories: list[str], vectors: np.ndarray,
+                 threshold: float = 0.95, hit_log_path: str | None = None):
+        self.questions = questions
+        self.answers = answers
+        self.categories = categories
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.matrix = vectors / np.where(norms == 0, 1.0, norms)
+        self.threshold = threshold
+        self.hit_log_path = hit_log_path
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self._hit_logger: logging.Logger | None = None
+        self._hit_logger_pid: int | None = None
+
+    @classmethod
+    def load(cls, vectorstore_path: str, threshold: float = 0.95, hit_log_path: str | None = None) -> "FaqIndex | None":
+        """คืน None ถ้ายังไม่ได้สร้าง หรือสร้างด้วยโมเดล embedding อื่น (เวกเตอร์เทียบกันไม่ได้)"""
+        path = os.path.join(vectorstore_path, FAQ_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        data = np.load(path, allow_pickle=False)
+        if str(data["model"]) != model_tag():
+            print("⚠️ faq_index.npz สร้างด้วยโมเดล embedding อื่น จึงปิด FAQ fast path (รัน 2MD_prepare_vectorstore.py ใหม่)")
+            return None
+        return cls(data["questions"].tolist(), data["answers"].tolist(), data["categories"].tolist(),
+                   data["vectors"].astype(np.float32), threshold=threshold, hit_log_path=hit_log_path)
+
+    def match(self, query_vector: list[float]) -> tuple[int, float] | None:
+        """คืน (ลำดับของคำถามที่ตรงที่สุด, คะแนน) ถ้าคะแนนถึงเกณฑ์ มิฉะนั้นคืน None"""
+        if not len(self.questions):
+            return None
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scores = self.matrix @ query
+        best = int(np.argmax(scores))
+        with self._lock:
+            self.lookups += 1
+            if scores[best] < self.threshold:
+                return None
+            self.hits += 1
+        return best, float(scores[best])
+
+    def format_answer(self, index: int) -> str:
+        """คำตอบที่คัดไว้ (จัดรูปแบบเล็กน้อย: ระบุคำถามที่ใช้อ้างอิง เพื่อให้ผู้ใช้ตรวจได้ว่าตรงกับที่ถาม)"""
+        return f"{self.answers[index]}\n\n_(ตอบจากคำถามที่พบบ่อย: \"{self.questions[index]}\")_"
+
+    def context(self, index: int) -> str:
+        category = f"หมวด: {self.categories[index]}\n" if self.categories[index] else ""
+        return (f"เอกสารอ้างอิงชิ้นที่ 1 (ที่มา: Q&A - FAQ fast path):\n"
+                f"{category}คำถาม: {self.questions[index]}\nคำตอบ: {self.answers[index]}")
+
+    def _get_hit_logger(self) -> logging.Logger:
+        """
+        logger ที่ส่งบรรทัดผ่านคิวให้ thread ของ QueueListener เขียนลงไฟล์ (log_hit ถูกเรียกใน event loop จึงไม่เขียนไฟล์เอง)
+        สร้างครั้งแรกที่มีการ hit ของแต่ละ process (thread ของ listener ไม่ติดไปกับ process ลูกหลัง fork)
+        """
+        with self._lock:
+            if self._hit_logger is None or self._hit_logger_pid != os.getpid():
+                if os.path.dirname(self.hit_log_path):
+                    os.makedirs(os.path.dirname(self.hit_log_path), exist_ok=True)
+                file_handler = logging.FileHandler(self.hit_log_path, encoding="utf-8", delay=True)
+                file_handler.setFormatter(logging.Formatter("%(message)s"))
+                hit_queue: queue.SimpleQueue = queue.SimpleQueue()
+                listener = QueueListener(hit_queue, file_handler)
+                listener.start()
+                atexit.register(listener.stop)
+                logger = logging.getLogger(f"{__name__}.hits.{id(self)}")
+                logger.setLevel(logging.INFO)
+                logger.propagate = False
+                logger.handlers = [QueueHandler(hit_queue)]
+                self._hit_logger, self._hit_logger_pid = logger, os.getpid()
+            return self._hit_logger
+
+    def log_hit(self, user_question: str, index: int, score: float):
+        if not self.hit_log_path:
+            return
+        record = {"ts": time.time(), "question": user_question, "matched": self.questions[index], "score": round(score, 4)}
+        self._get_hit_logger().info(json.dumps(record, ensure_ascii=False))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self.questions), "lookups": self.lookups, "hits": self.hits,
+                    "threshold": self.threshold}
@@ -0,0 +1,156 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.messages import AIMessage, BaseMessage
+
+from context_packer import estimate_tokens, truncate_to_tokens
+
+# --- History Compactor: คุม history ที่ส่งให้ Rewriter และ Answer Prompt ด้วยงบ token แทนการนับจำนวนข้อความ ---
+# เก็บข้อความล่าสุดไว้ตามเดิมให้มากที่สุดภายในงบ ส่วนข้อความเก่ากว่านั้นพับรวมเป็น "สรุปบทสนทนาก่อนหน้า" หนึ่งข้อความ
+# สรุปสร้างด้วย LLM ใน background thread (ไม่อยู่บนเส้นทางของคำถามรอบนั้น) และ cache ไว้ต่อ session
+# ระหว่างที่สรุปยังไม่เสร็จ จะใช้สรุปเดิม + ตัดตอนต้นของข้อความที่เพิ่งถูกพับแทน
+
+SUMMARY_PREFIX = "สรุปบทสนทนาก่อนหน้า:"
+ROLE_LABELS = {"human": "ผู้ใช้", "ai": "ผู้ช่วย"}
+MIN_SNIPPET_TOKENS = 20
+MAX_SUMMARY_INPUT_TOKENS = 600  # ตัดข้อความแต่ละข้อความที่ส่งไปสรุป (คำตอบยาวๆ ไม่จำเป็นต้องส่งทั้งหมด)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    return estimate_tokens(message.content if isinstance(message.content, str) else str(message.content))
+
+
+def _message_key(message: BaseMessage) -> str:
+    return hashlib.sha1(f"{message.type}\n{message.content}".encode("utf-8")).hexdigest()[:16]
+
+
+def _format_messages(messages: list[BaseMessage], max_tokens: int) -> str:
+    lines = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if estimate_tokens(content) > max_tokens:
+            content = truncate_to_tokens(content, max_tokens)
+        lines.append(f"{ROLE_LABELS.get(message.type, message.type)}: {content}")
+    return "\n".join(lines)
+
+
+class HistoryCompactor:
+    """
+    ย่อ history ของแต่ละ session ให้ไม่เกิน token_budget
+    - ถ้า history ทั้งหมดอยู่ในงบ จะส่งต่อตามเดิม
+    - มิฉะนั้นเก็บข้อความล่าสุด (อย่างน้อย min_recent_messages ข้อความ) ภายใน token_budget - summary_token_budget
+      แล้วแทนข้อความที่เก่ากว่าด้วยสรุปที่ยาวไม่เกิน summary_token_budget
+    summary_chain รับ {"previous_summary", "conversation"} และคืนข้อความสรุป (เช่น SUMMARY_PROMPT | llm | StrOutputParser())
+    """
+
+    def __init__(self, summary_chain=None, token_budget: int = 800, summary_token_budget: int = 250,
+                 min_recent_messages: int = 2, max_sessions: int = 1000):
+        self.summary_chain = summary_chain
+        self.token_budget = token_budget
+        self.summary_token_budget = summary_token_budget
+        self.min_recent_messages = min_recent_messages
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._summaries: OrderedDict[str, dict] = OrderedDict()  # session_id -> {"keys": set, "summary": str}
+        self._pending: set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        self._totals = {"turns": 0, "compacted_turns": 0, "tokens_before": 0, "tokens_after": 0,
+                        "summary_cache_hits": 0, "summaries_generated": 0, "summary_errors": 0}
+
+    def _record(self, tokens_before: int, tokens_after: int):
+        with self._lock:
+            self._totals["turns"] += 1
+            self._totals["compacted_turns"] += tokens_after < tokens_before
+            self._totals["tokens_before"] += tokens_before
+            self._totals["tokens_after"] += tokens_after
+
+    def compact(self, session_id: str | None, messages: list[BaseMessage]) -> list[BaseMessage]:
+        return self.compact_with_stats(session_id, messages)[0]
+
+    def compact_with_stats(self, session_id: str | None,
+                           messages: list[BaseMessage]) -> tuple[list[BaseMessage], dict]:
+        """เหมือน compact แต่คืน {"tokens_before", "tokens_after"} ของรอบนี้ด้วย สำหรับบันทึกต่อรอบ"""
+        tokens_before = sum(message_tokens(m) for m in messages)
+        if tokens_before <= self.token_budget:
+            self._record(tokens_before, tokens_before)
+            return messages, {"tokens_before": tokens_before, "tokens_after": tokens_before}
+
+        recent_budget = self.token_budget - self.summary_token_budget
+        recent: list[BaseMessage] = []
+        used = 0
+        for message in reversed(messages):
+            tokens = message_tokens(message)
+            if used + tokens > recent_budget:
+                if len(recent) >= self.min_recent_messages:
+                    break
+                # ข้อความล่าสุดยาวเกินงบ (เช่น คำตอบที่มี bullet ยาวๆ) ตัดให้สั้นลงแทนการทิ้ง
+                remaining = max(MIN_SNIPPET_TOKENS, recent_budget - used)
+                message = message.model_copy(update={"content": truncate_to_tokens(message.content, remaining)})
+                tokens = message_tokens(message)
+            recent.insert(0, message)
+            used += tokens
+
+        older = messages[:len(messages) - len(recent)]
+        summary = self._summary_for(session_id, older) if older else ""
+        compacted = ([AIMessage(content=f"{SUMMARY_PREFIX} {summary}")] if summary else []) + recent
+        tokens_after = sum(message_tokens(m) for m in compacted)
+        self._record(tokens_before, tokens_after)
+        return compacted, {"tokens_before": tokens_before, "tokens_after": tokens_after}
+
+    def _summary_for(self, session_id: str | None, older: list[BaseMessage]) -> str:
+        """สรุปของข้อความที่ถูกพับ: ใช้จาก cache ถ้าครอบคลุมแล้ว มิฉะนั้นสั่งสรุปใหม่เบื้องหลังและคืนสรุปชั่วคราว"""
+        keys = [_message_key(m) for m in older]
+        with self._lock:
+            entry = self._summaries.get(session_id) if session_id else None
+            previous = entry["summary"] if entry else ""
+            if entry is not None:
+                self._summaries.move_to_end(session_id)
+            unsummarized = [m for m, key in zip(older, keys) if entry is None or key not in entry["keys"]]
+            if not unsummarized:
+                self._totals["summary_cache_hits"] += 1
+                return previous
+            schedule = self.summary_chain is not None and session_id is not None and session_id not in self._pending
+            if schedule:
+                self._pending.add(session_id)
+        if schedule:
+            self._executor.submit(self._update_summary, session_id, previous, unsummarized, set(keys))
+
+        # สรุปชั่วคราว: สรุปเดิม + ตอนต้นของแต่ละข้อความที่ยังไม่ได้สรุป (แบ่งงบที่เหลือเท่าๆ กัน)
+        remaining = self.summary_token_budget - (estimate_tokens(previous) if previous else 0)
+        per_message = max(MIN_SNIPPET_TOKENS, remaining // len(unsummarized))
+        summary = f"{previous}\n{_format_messages(unsummarized, per_message)}".strip()
+        if estimate_tokens(summary) > self.summary_token_budget:
+            summary = truncate_to_tokens(summary, self.summary_token_budget)
+        return summary
+
+    def _update_summary(self, session_id: str, previous: str, messages: list[BaseMessage], keys: set[str]):
+        try:
+            summary = self.summary_chain.invoke({
+                "previous_summary": previous or "(ไม่มี)",
+                "conversation": _format_messages(messages, MAX_SUMMARY_INPUT_TOKENS),
+            }).strip()
+            if estimate_tokens(summary) > self.summary_token_budget:
+                summary = truncate_to_tokens(summary, self.summary_token_budget)
+            with self._lock:
+                self._summaries[session_id] = {"keys": keys, "summary": summary}
+                self._summaries.move_to_end(session_id)
+                while len(self._summaries) > self.max_sessions:
+                    self._summaries.popitem(last=False)
+                self._totals["summaries_generated"] += 1
+        except Exception as e:
+            print(f"⚠️ สรุป history ไม่สำเร็จ (session {session_id}): {e}")
+            with self._lock:
+                self._totals["summary_errors"] += 1
+        finally:
+            with self._lock:
+                self._pending.discard(session_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+            totals["cached_summaries"] = len(self._summaries)
+        totals["tokens_saved"] = totals["tokens_before"] - totals["tokens_after"]
+        totals["avg_saved_per_turn"] = round(totals["tokens_saved"] / (totals["turns"] or 1), 1)
+        return totals
@@ -0,0 +1,383 @@
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import threading
+from collections import OrderedDict
+
+from langchain_core.chat_history import BaseChatMessageHistory, InMemoryChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+# --- ที่เก็บประวัติการแชตแบบจำกัดขนาด (แยกตาม session ของผู้ใช้แต่ละคน) ---
+# BoundedHistoryStore: เก็บในหน่วยความจำของ process (หายเมื่อ restart และไม่แชร์ระหว่าง worker)
+# SqlHistoryStore: เก็บในฐานข้อมูล SQL (SQLite ในเครื่อง หรือฐานข้อมูลอื่นที่ SQLAlchemy รองรับ) ใช้ร่วมกันได้หลาย worker/replica
+# ทั้งสองแบบมี get(session_id) และ stats() เหมือนกัน จึงใช้แทนกันได้ใน get_session_history
+# sqlalchemy import เมื่อสร้าง SqlHistoryStore เท่านั้น (แบบ memory ไม่ต้องจ่ายเวลา import)
+
+
+def _message_size(message) -> int:
+    """ประมาณขนาดหน่วยความจำของข้อความ (ไบต์ของเนื้อหาแบบ UTF-8)"""
+    content = message.content
+    if isinstance(content, str):
+        return len(content.encode("utf-8"))
+    return len(str(content).encode("utf-8"))
+
+
+class BoundedHistoryStore:
+    """
+    เก็บ InMemoryChatMessageHistory ของแต่ละ session โดยมีข้อจำกัด 3 อย่าง:
+    - จำนวน session สูงสุด (เกินแล้วตัด session ที่ไม่ได้ใช้นานที่สุดทิ้ง - LRU)
+    - ระยะเวลา idle สูงสุด (session ที่ไม่มีการใช้งานเกินกำหนดจะถูกลบ)
+    - ขนาดหน่วยความจำรวมของข้อความทั้งหมด
+    และยังคงตัด history ของแต่ละ session ให้เหลือ max_messages ข้อความล่าสุด (Sliding Window)
+    """
+
+    def __init__(self, max_messages: int, max_sessions: int = 500,
+                 idle_timeout_seconds: float = 2 * 3600, max_memory_bytes: int = 50 * 1024 * 1024):
+        self.max_messages = max_messages
+        self.max_sessions = max_sessions
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._sessions: OrderedDict[str, InMemoryChatMessageHistory] = OrderedDict()
+        self._last_access: dict[str, float] = {}
+
+    def _memory_bytes(self) -> int:
+        return sum(_message_size(m) for history in self._sessions.values() for m in history.messages)
+
+    def _evict(self, session_id: str):
+        del self._sessions[session_id]
+        del self._last_access[session_id]
+        self.evicted += 1
+
+    def _enforce_limits(self, current_session_id: str, now: float):
+        idle = [sid for sid, last in self._last_access.items()
+                if sid != current_session_id and now - last > self.idle_timeout_seconds]
+        for sid in idle:
+            self._evict(sid)
+
+        # session ที่อยู่หน้าสุดของ OrderedDict คือ session ที่ไม่ได้ใช้นานที่สุด
+        while len(self._sessions) > self.max_sessions:
+            oldest = next(iter(self._sessions))
+            if oldest == current_session_id:
+                break
+            self._evict(oldest)
+
+        memory = self._memory_bytes()
+        while memory > self.max_memory_bytes and len(self._sessions) > 1:
+            oldest = next(iter(self._sessions))
+            if oldest == current_session_id:
+                break
+            memory -= sum(_message_size(m) for m in self._sessions[oldest].messages)
+            self._evict(oldest)
+
+    def get(self, session_id: str) -> InMemoryChatMessageHistory:
+        """ดึง history ของ session (สร้างใหม่ถ้ายังไม่มี) และตัดให้เหลือ max_messages ข้อความล่าสุด"""
+        now = time.time()
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = InMemoryChatMessageHistory()
+            self._sessions.move_to_end(session_id)
+            self._last_access[session_id] = now
+
+            session_history = self._sessions[session_id]
+            if len(session_history.messages) > self.max_messages:
+                session_history.messages = session_history.messages[-self.max_messages:]
+
+            self._enforce_limits(session_id, now)
+            return session_history
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": self._memory_bytes(),
+                "evicted": self.evicted,
+            }
+
+
+_CHAT_MESSAGES = None
+
+
+def chat_messages_table():
+    """ตาราง chat_messages (สร้าง Table ของ SQLAlchemy ครั้งแรกที่เรียก)"""
+    global _CHAT_MESSAGES
+    if _CHAT_MESSAGES is None:
+        import sqlalchemy as sa
+
+        _CHAT_MESSAGES = sa.Table(
+            "chat_messages",
+            sa.MetaData(),
+            sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+            sa.Column("message_id", sa.String(32), nullable=False, unique=True),
+            sa.Column("session_id", sa.String(255), nullable=False),
+            sa.Column("created_at", sa.Float, nullable=False),
+            sa.Column("message", sa.Text, nullable=False),
+            sa.Index("idx_chat_messages_session", "session_id", "created_at"),
+        )
+    return _CHAT_MESSAGES
+
+
+class SqlSessionHistory(BaseChatMessageHistory):
+    """
+    history ของหนึ่ง session: อ่านจากฐานข้อมูลเมื่อถูกใช้ครั้งแรกเท่านั้น (เฉพาะ max_messages ข้อความล่าสุด)
+    ข้อความใหม่ถูกส่งเข้าคิวของ SqlHistoryStore แล้วคืนทันที (ไม่รอการเขียนฐานข้อมูล)
+    """
+
+    def __init__(self, store: "SqlHistoryStore", session_id: str):
+        self._store = store
+        self.session_id = session_id
+        self._messages: list[BaseMessage] | None = None
+
+    @property
+    def messages(self) -> list[BaseMessage]:
+        if self._messages is None:
+            self._messages = self._store.load(self.session_id)
+        return self._messages
+
+    def add_messages(self, messages) -> None:
+        messages = list(messages)
+        self._messages = (self.messages + messages)[-self._store.max_messages:]
+        self._store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        self._messages = []
+        self._store.clear(self.session_id)
+
+
+class SqlHistoryStore:
+    """
+    เก็บ history ของทุก session ในฐานข้อมูล SQL ผ่าน SQLAlchemy (เช่น sqlite:///cache/history.db หรือ postgresql://...)
+    - เขียนแบบ write-behind: thread เบื้องหลังรวบรวมข้อความจากคิวแล้วเขียนเป็น batch ทุก flush_interval_seconds
+      (หรือทันทีที่ครบ batch_size) คำถามแต่ละรอบจึงไม่ต้องรอฐานข้อมูล
+    - อ่านแบบ lazy: get() ไม่แตะฐานข้อมูล จะอ่านเฉพาะ max_messages ข้อความล่าสุดเมื่อ chain ขอ history จริง
+      และรวมข้อความที่ยังรอเขียนของ process นี้เข้าไปด้วย
+    worker อื่นจะเห็นข้อความใหม่หลังถูก flush แล้ว (ภายในประมาณ flush_interval_seconds)
+    ถ้าฐานข้อมูลล่ม จะลองเขียนซ้ำทีละ batch_size และเก็บข้อความค้างไว้ไม่เกิน batch_size * max_retry_batches
+    (เกินกว่านั้นจะทิ้งข้อความที่เก่าที่สุด เพื่อไม่ให้หน่วยความจำโตไม่จำกัด)
+    """
+
+    def __init__(self, url: str, max_messages: int, flush_interval_seconds: float = 0.5, batch_size: int = 200,
+                 retention_days: int = 30, max_retry_batches: int = 10, active_window_seconds: float = 2 * 3600):
+        import sqlalchemy as sa
+
+        self.url = url
+        self.max_messages = max_messages
+        self.flush_interval_seconds = flush_interval_seconds
+        self.batch_size = batch_size
+        self.max_retry_entries = batch_size * max_retry_batches
+        self.active_window_seconds = active_window_seconds
+        self.engine = self._create_engine(url)
+        self._table = chat_messages_table()
+        self._table.metadata.create_all(self.engine)
+        with self.engine.begin() as conn:
+            conn.execute(sa.delete(self._table).where(self._table.c.created_at < time.time() - retention_days * 86400))
+
+        self._lock = threading.Lock()
+        self._queue: queue.Queue = queue.Queue()
+        self._unflushed: dict[str, list[tuple[str, float, BaseMessage]]] = {}
+        self._retry: list[tuple] = []
+        self._last_access: dict[str, float] = {}  # session ที่ process นี้ใช้งาน (สำหรับ stats เท่านั้น)
+        self._totals = {"loads": 0, "flushed_messages": 0, "flush_batches": 0, "write_errors": 0,
+                        "dropped_messages": 0, "total_flush_ms": 0.0, "max_flush_ms": 0.0}
+        self._writer = threading.Thread(target=self._run_writer, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _create_engine(url: str):
+        import sqlalchemy as sa
+        from sqlalchemy import event
+        from sqlalchemy.engine import make_url
+
+        if not url.startswith("sqlite"):
+            return sa.create_engine(url, pool_pre_ping=True)
+        database = make_url(url).database
+        if database and database != ":memory:" and os.path.dirname(database):
+            os.makedirs(os.path.dirname(database), exist_ok=True)
+        engine = sa.create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+
+        @event.listens_for(engine, "connect")
+        def _configure_sqlite(dbapi_connection, _):
+            # WAL: หลาย process อ่านได้ระหว่างที่อีก process กำลังเขียน
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+            dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+
+        return engine
+
+    # --- ใช้โดย SqlSessionHistory ---
+
+    def get(self, session_id: str) -> SqlSessionHistory:
+        now = time.time()
+        with self._lock:
+            self._last_access[session_id] = now
+            if len(self._last_access) > 10000:
+                self._prune_last_access(now)
+        return SqlSessionHistory(self, session_id)
+
+    def _prune_last_access(self, now: float):
+        for session_id in [sid for sid, last in self._last_access.items() if now - last > self.active_window_seconds]:
+            del self._last_access[session_id]
+
+    def load(self, session_id: str) -> list[BaseMessage]:
+        """max_messages ข้อความล่าสุดของ session (จากฐานข้อมูล + ข้อความที่ยังรอเขียนใน process นี้)"""
+        import sqlalchemy as sa
+
+        table = self._table
+        query = (
+            sa.select(table.c.message_id, table.c.message)
+            .where(table.c.session_id == session_id)
+            .order_by(table.c.created_at.desc(), table.c.id.desc())
+            .limit(self.max_messages)
+        )
+        with self.engine.connect() as conn:
+            rows = list(reversed(conn.execute(query).all()))
+        stored = {message_id for message_id, _ in rows}
+        messages = messages_from_dict([json.loads(message) for _, message in rows])
+        with self._lock:
+            self._totals["loads"] += 1
+            # ข้อความที่ถูก flush ไปแล้วระหว่างที่อ่านจะมีทั้งในฐานข้อมูลและในรายการรอเขียน จึงกรองด้วย message_id
+            messages += [message for message_id, _, message in self._unflushed.get(session_id, [])
+                         if message_id not in stored]
+        return messages[-self.max_messages:]
+
+    def append(self, session_id: str, messages: list[BaseMessage]):
+        now = time.time()
+        entries = [(uuid.uuid4().hex, now, message) for message in messages]
+        with self._lock:
+            self._unflushed.setdefault(session_id, []).extend(entries)
+        for entry in entries:
+            self._queue.put(("insert", session_id, entry))
+
+    def clear(self, session_id: str):
+        with self._lock:
+            self._unflushed.pop(session_id, None)
+        self._queue.put(("clear", session_id, None))
+
+    # --- thread เขียนเบื้องหลัง ---
+
+    def _run_writer(self):
+        stopping = False
+        while not stopping:
+            try:
+                # ถ้ามี batch ที่เขียนไม่สำเร็จค้างอยู่ จะรอข้อความใหม่ไม่เกิน 1 วินาทีแล้วลองเขียนซ้ำ
+                item = self._queue.get(timeout=1.0 if self._retry else None)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                stopping, batch = True, []
+            else:
+                batch = [item] if item else []
+            deadline = time.monotonic() + self.flush_interval_seconds
+            while not stopping and batch and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            self._flush_pending(self._retry + batch)
+
+    def _flush_pending(self, pending: list[tuple]):
+        """เขียนทีละ batch_size ตามลำดับ ถ้า batch ใดล้มเหลว เก็บ batch นั้นและที่เหลือไว้ลองใหม่รอบถัดไป"""
+        self._retry = []
+        for start in range(0, len(pending), self.batch_size):
+            if not self._flush(pending[start:start + self.batch_size]):
+                self._retry = self._cap_retry(pending[start:])
+                return
+
+    def _cap_retry(self, retry: list[tuple]) -> list[tuple]:
+        """ทิ้งข้อความ insert ที่เก่าที่สุดเมื่อค้างเกิน max_retry_entries (คำสั่ง clear เก็บไว้เสมอเพื่อไม่ให้ข้อความเก่ากลับมา)"""
+        excess = len(retry) - self.max_retry_entries
+        if excess <= 0:
+            return retry
+        kept, dropped = [], set()
+        for op, session_id, entry in retry:
+            if excess > 0 and op == "insert":
+                dropped.add(entry[0])
+                excess -= 1
+            else:
+                kept.append((op, session_id, entry))
+        print(f"⚠️ ข้อความ history ค้างเขียนเกิน {self.max_retry_entries} รายการ ทิ้งข้อความเก่าที่สุด {len(dropped)} รายการ")
+        with self._lock:
+            for session_id in {session_id for op, session_id, entry in retry if op == "insert" and entry[0] in dropped}:
+                remaining = [e for e in self._unflushed.get(session_id, []) if e[0] not in dropped]
+                if remaining:
+                    self._unflushed[session_id] = remaining
+                else:
+                    self._unflushed.pop(session_id, None)
+            self._totals["dropped_messages"] += len(dropped)
+        return kept
+
+    def _flush(self, batch: list[tuple]) -> bool:
+        """เขียน batch เดียวใน transaction เดียว (คืน False ถ้าไม่สำเร็จ)"""
+        import sqlalchemy as sa
+
+        if not batch:
+            return True
+        started = time.perf_counter()
+        try:
+            with self.engine.begin() as conn:
+                inserts = []
+                for op, session_id, entry in batch:
+                    if op == "insert":
+                        message_id, created_at, message = entry
+                        inserts.append({
+                            "message_id": message_id, "session_id": session_id, "created_at": created_at,
+                            "message": json.dumps(message_to_dict(message), ensure_ascii=False),
+                        })
+                        continue
+                    if inserts:
+                        conn.execute(sa.insert(self._table), inserts)
+                        inserts = []
+                    conn.execute(sa.delete(self._table).where(self._table.c.session_id == session_id))
+                if inserts:
+                    conn.execute(sa.insert(self._table), inserts)
+        except Exception as e:
+            # ลองใหม่รอบถัดไป (ข้อความยังอยู่ในรายการรอเขียน จึงยังอ่านได้จาก process นี้)
+            print(f"⚠️ บันทึก history ไม่สำเร็จ จะลองใหม่: {e}")
+            with self._lock:
+                self._totals["write_errors"] += 1
+            return False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        flushed = {entry[0] for op, _, entry in batch if op == "insert"}
+        with self._lock:
+            for session_id in {session_id for _, session_id, _ in batch}:
+                remaining = [e for e in self._unflushed.get(session_id, []) if e[0] not in flushed]
+                if remaining:
+                    self._unflushed[session_id] = remaining
+                else:
+                    self._unflushed.pop(session_id, None)
+            self._totals["flushed_messages"] += len(flushed)
+            self._totals["flush_batches"] += 1
+            self._totals["total_flush_ms"] += elapsed_ms
+            self._totals["max_flush_ms"] = max(self._totals["max_flush_ms"], elapsed_ms)
+        return True
+
+    def close(self, timeout: float = 10.0):
+        """เขียนข้อความที่ค้างอยู่ให้หมดแล้วหยุด thread เบื้องหลัง (เรียกซ้ำได้)"""
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+            # จำนวนที่เทียบได้กับ BoundedHistoryStore (เฉพาะของ process นี้)
+            self._prune_last_access(time.time())
+            totals["sessions"] = len(self._last_access)
+            totals["buffered_sessions"] = len(self._unflushed)
+            totals["pending_messages"] = sum(len(entries) for entries in self._unflushed.values())
+            totals["memory_bytes"] = sum(_message_size(message) for entries in self._unflushed.values()
+                                         for _, _, message in entries)
+            totals["retry_backlog"] = len(self._retry)
+        batches = totals["flush_batches"] or 1
+        totals["avg_flush_ms"] = round(totals.pop("total_flush_ms") / batches, 1)
+        totals["max_flush_ms"] = round(totals["max_flush_ms"], 1)
+        totals["backend"] = self.engine.dialect.name
+        return totals
@@ -0,0 +1,304 @@
+import re
+import time
+import asyncio
+import threading
+from collections import deque
+
+from langchain_core.runnables import Runnable
+
+# --- API Key Pool: กระจายการเรียก Gemini ไปทุก key, ติดตามโควต้า และสลับ key อัตโนมัติเมื่อโดน 429 ---
+
+RATE_LIMIT_PATTERN = re.compile(r"(429|resource.?exhausted|quota|rate.?limit|too many requests)", re.IGNORECASE)
+RETRY_DELAY_PATTERN = re.compile(r"retry(?:_delay| in| after)\D{0,20}(\d+(?:\.\d+)?)\s*s", re.IGNORECASE)
+WINDOW_SECONDS = 60.0
+
+
+class KeyPoolExhaustedError(RuntimeError):
+    """ไม่มี API key ใดว่างภายในเวลาที่รอได้ หรือทุก key โดนจำกัดการใช้งาน"""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """ตรวจว่า exception เกิดจากการโดนจำกัดโควต้า (HTTP 429 / ResourceExhausted) หรือไม่"""
+    if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    return bool(RATE_LIMIT_PATTERN.search(f"{type(error).__name__} {error}"))
+
+
+def parse_retry_delay(error: Exception) -> float | None:
+    """อ่านเวลาที่ server แนะนำให้รอ (เช่น 'retry in 37s') จากข้อความ error ถ้ามี"""
+    match = RETRY_DELAY_PATTERN.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+def mask_key(key: str) -> str:
+    return f"...{key[-4:]}" if len(key) > 4 else "****"
+
+
+class _KeyState:
+    def __init__(self, key: str):
+        self.key = key
+        self.requests = deque()  # เวลาที่ส่ง request ภายในหน้าต่าง 60 วินาที
+        self.tokens = deque()    # (เวลา, จำนวน token) ภายในหน้าต่าง 60 วินาที
+        self.cooldown_until = 0.0
+        self.consecutive_rate_limits = 0
+        self.last_used = 0.0
+        self.total_requests = 0
+        self.total_tokens = 0
+        self.total_rate_limited = 0
+
+    def prune(self, now: float):
+        while self.requests and now - self.requests[0] > WINDOW_SECONDS:
+            self.requests.popleft()
+        while self.tokens and now - self.tokens[0][0] > WINDOW_SECONDS:
+            self.tokens.popleft()
+
+    def tokens_in_window(self) -> int:
+        return sum(n for _, n in self.tokens)
+
+
+class ApiKeyPool:
+    """
+    ตัวจัดสรร API key:
+    - เลือก key ที่ใช้งานน้อยที่สุดในหน้าต่าง 60 วินาที (ไม่เกินงบ requests/นาที และ tokens/นาที ต่อ key)
+    - key ที่โดน 429 จะถูกพัก (cooldown) แบบ exponential backoff หรือตามเวลาที่ server แนะนำ
+    """
+
+    def __init__(self, keys: list[str], rpm_limit: int = 10, tpm_limit: int = 250_000,
+                 base_cooldown_seconds: float = 5.0, max_cooldown_seconds: float = 300.0,
+                 clock=time.monotonic):
+        if not keys:
+            raise ValueError("ต้องมี API key อย่างน้อย 1 key")
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.base_cooldown_seconds = base_cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._states = {key: _KeyState(key) for key in dict.fromkeys(keys)}
+
+    def __len__(self):
+        return len(self._states)
+
+    def _available_at(self, state: _KeyState, now: float) -> float:
+        """เวลาที่เร็วที่สุดที่ key นี้จะใช้งานได้อีกครั้ง"""
+        ready = state.cooldown_until
+        if len(state.requests) >= self.rpm_limit:
+            ready = max(ready, state.requests[0] + WINDOW_SECONDS)
+        if state.tokens and state.tokens_in_window() >= self.tpm_limit:
+            ready = max(ready, state.tokens[0][0] + WINDOW_SECONDS)
+        return ready
+
+    def try_acquire(self, exclude: set[str] = frozenset()) -> tuple[str | None, float]:
+        """
+        จอง key ที่ว่างที่สุดสำหรับ 1 request
+        คืน (key, 0) ถ้าได้ key หรือ (None, เวลาที่ต้องรอ) ถ้าทุก key ไม่ว่าง
+        """
+        with self._lock:
+            now = self._clock()
+            best, best_rank, wait = None, None, float("inf")
+            for state in self._states.values():
+                if state.key in exclude:
+                    continue
+                state.prune(now)
+                ready = self._available_at(state, now)
+                if ready > now:
+                    wait = min(wait, ready - now)
+                    continue
+                rank = (len(state.requests), state.tokens_in_window(), state.last_used)
+                if best_rank is None or rank < best_rank:
+                    best, best_rank = state, rank
+            if best is None:
+                return None, wait
+            best.requests.append(now)
+            best.last_used = now
+            best.total_requests += 1
+            return best.key, 0.0
+
+    def report_success(self, key: str, tokens: int = 0):
+        with self._lock:
+            state = self._states[key]
+            state.consecutive_rate_limits = 0
+            if tokens:
+                state.tokens.append((self._clock(), tokens))
+                state.total_tokens += tokens
+
+    def report_rate_limited(self, key: str, retry_after: float | None = None):
+        """พัก key ที่โดน 429 (backoff เพิ่มเป็นเท่าตัวทุกครั้งที่โดนติดกัน)"""
+        with self._lock:
+            state = self._states[key]
+            state.consecutive_rate_limits += 1
+            state.total_rate_limited += 1
+            backoff = self.base_cooldown_seconds * (2 ** (state.consecutive_rate_limits - 1))
+            cooldown = min(max(backoff, retry_after or 0.0), self.max_cooldown_seconds)
+            state.cooldown_until = self._clock() + cooldown
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            now = self._clock()
+            result = []
+            for state in self._states.values():
+                state.prune(now)
+                result.append({
+                    "key": mask_key(state.key),
+                    "requests_last_minute": len(state.requests),
+                    "tokens_last_minute": state.tokens_in_window(),
+                    "cooldown_seconds": round(max(0.0, state.cooldown_until - now), 1),
+                    "total_requests": state.total_requests,
+                    "total_tokens": state.total_tokens,
+                    "total_rate_limited": state.total_rate_limited,
+                })
+            return result
+
+
+def _count_tokens(message) -> int:
+    """นับ token จาก usage_metadata ของคำตอบ (ถ้าไม่มีจะประมาณจากความยาวข้อความ)"""
+    usage = getattr(message, "usage_metadata", None)
+    if usage and usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    content = getattr(message, "content", "")
+    return max(1, len(str(content)) // 3)
+
+
+class PooledChatModel(Runnable):
+    """
+    Chat model ที่กระจายแต่ละการเรียกไปยัง key ต่างๆ ใน ApiKeyPool
+    ถ้า key ใดโดน 429 จะพัก key นั้นแล้วลองใหม่กับ key อื่นทันที
+    llm_factory: ฟังก์ชันที่รับ api key แล้วคืน chat model (เช่น ChatGoogleGenerativeAI หรือ fake LLM สำหรับทดสอบ)
+    """
+
+    def __init__(self, pool: ApiKeyPool, llm_factory, max_attempts: int | None = None,
+                 max_wait_seconds: float = 30.0):
+        self.pool = pool
+        self.llm_factory = llm_factory
+        self.max_attempts = max_attempts or len(pool) + 1
+        self.max_wait_seconds = max_wait_seconds
+        self._llms = {}
+        self._llms_lock = threading.Lock()
+
+    def _llm_for(self, key: str):
+        """สร้าง client ครั้งเดียวต่อ key แล้วใช้ซ้ำ (connection ของแต่ละ key จึงถูกใช้ซ้ำได้)"""
+        with self._llms_lock:
+            if key not in self._llms:
+                self._llms[key] = self.llm_factory(key)
+            return self._llms[key]
+
+    def _acquire(self, tried: set[str]) -> str:
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            # ลอง key ที่ยังไม่เคยใช้ในรอบนี้ก่อน ถ้าไม่มีจึงยอมใช้ key เดิมซ้ำ
+            key, wait = self.pool.try_acquire(exclude=tried)
+            if key is None and tried:
+                key, wait = self.pool.try_acquire()
+            if key is not None:
+                return key
+            if time.monotonic() + wait > deadline:
+                raise KeyPoolExhaustedError(f"ทุก API key ถูกจำกัดการใช้งาน ต้องรออีก {wait:.0f} วินาที")
+            time.sleep(wait)
+
+    async def _aacquire(self, tried: set[str]) -> str:
+        deadline = time.monotonic() + self.max_wait_seconds
+        while True:
+            key, wait = self.pool.try_acquire(exclude=tried)
+            if key is None and tried:
+                key, wait = self.pool.try_acquire()
+            if key is not None:
+                return key
+            if time.monotonic() + wait > deadline:
+                raise KeyPoolExhaustedError(f"ทุก API key ถูกจำกัดการใช้งาน ต้องรออีก {wait:.0f} วินาที")
+            await asyncio.sleep(wait)
+
+    def _handle_error(self, key: str, error: Exception):
+        if not is_rate_limit_error(error):
+            raise error
+        self.pool.report_rate_limited(key, parse_retry_delay(error))
+
+    def invoke(self, input, config=None, **kwargs):
+        tried, last_error = set(), None
+        for _ in range(self.max_attempts):
+            key = self._acquire(tried)
+            tried.add(key)
+            try:
+                result = self._llm_for(key).invoke(input, config, **kwargs)
+            except Exception as e:
+                self._handle_error(key, e)
+                last_error = e
+                continue
+            self.pool.report_success(key, _count_tokens(result))
+            return result
+        raise KeyPoolExhaustedError(f"เรียก LLM ไม่สำเร็จหลังลอง {self.max_attempts} ครั้ง: {last_error}")
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        tried, last_error = set(), None
+        for _ in range(self.max_attempts):
+            key = await self._aacquire(tried)
+            tried.add(key)
+            try:
+                result = await self._llm_for(key).ainvoke(input, config, **kwargs)
+            except Exception as e:
+                self._handle_error(key, e)
+                last_error = e
+                continue
+            self.pool.report_success(key, _count_tokens(result))
+            return result
+        raise KeyPoolExhaustedError(f"เรียก LLM ไม่สำเร็จหลังลอง {self.max_attempts} ครั้ง: {last_error}")
+
+    def stream(self, input, config=None, **kwargs):
+        """stream คำตอบ ถ้าโดน 429 ก่อนได้ token แรกจะสลับ key ให้ (หลังจากเริ่มส่ง token แล้วจะไม่ลองใหม่)"""
+        tried, last_error = set(), None
+        for _ in range(self.max_attempts):
+            key = self._acquire(tried)
+            tried.add(key)
+            final = None
+            try:
+                for chunk in self._llm_for(key).stream(input, config, **kwargs):
+                    final = chunk if final is None else final + chunk
+                    yield chunk
+            except Exception as e:
+                if final is not None:
+                    raise
+                self._handle_error(key, e)
+                last_error = e
+                continue
+            self.pool.report_success(key, _count_tokens(final) if final is not None else 0)
+            return
+        raise KeyPoolExhaustedError(f"เรียก LLM ไม่สำเร็จหลังลอง {self.max_attempts} ครั้ง: {last_error}")
+
+    async def astream(self, input, config=None, **kwargs):
+        tried, last_error = set(), None
+        for _ in range(self.max_attempts):
+            key = await self._aacquire(tried)
+            tried.add(key)
+            final = None
+            try:
+                async for chunk in self._llm_for(key).astream(input, config, **kwargs):
+                    final = chunk if final is None else final + chunk
+                    yield chunk
+            except Exception as e:
+                if final is not None:
+                    raise
+                self._handle_error(key, e)
+                last_error = e
+                continue
+            self.pool.report_success(key, _count_tokens(final) if final is not None else 0)
+            return
+        raise KeyPoolExhaustedError(f"เรียก LLM ไม่สำเร็จหลังลอง {self.max_attempts} ครั้ง: {last_error}")
+
+
+if __name__ == "__main__":
+    # ทดสอบการสลับ key กับ fake LLM ที่ตอบ 429 (ไม่ต้องใช้ network)
+    from fake_llm import FakeChatModel
+
+    pool = ApiKeyPool(["key-A", "key-B", "key-C"], rpm_limit=5)
+    fakes = {
+        "key-A": FakeChatModel(rate_limit_failures=100),  # key นี้โดน 429 ตลอด
+        "key-B": FakeChatModel(),
+        "key-C": FakeChatModel(),
+    }
+    llm = PooledChatModel(pool, lambda key: fakes[key])
+    for i in range(6):
+        print(f"ครั้งที่ {i + 1}: {llm.invoke('สวัสดี').content[:30]}")
+    for row in pool.stats():
+        print(row)
+    assert fakes["key-A"].calls == 1, "key ที่โดน 429 ต้องถูกพักหลังโดนครั้งแรก"
+    assert fakes["key-B"].calls + fakes["key-C"].calls == 6
+    print("✅ สลับ key เมื่อโดน 429 ได้ถูกต้อง")
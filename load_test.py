@@ -0,0 +1,125 @@
+import time
+import asyncio
+import argparse
+import statistics
+
+from langchain_core.documents import Document
+
+import rag_pipeline
+from fake_llm import FakeChatModel
+from history_store import BoundedHistoryStore
+from key_pool import ApiKeyPool, PooledChatModel
+
+# --- Load Test: เปรียบเทียบ throughput ของ chain แบบ sync (invoke ทีละคำขอ) กับแบบ async (ainvoke พร้อมกันหลาย session) ---
+# ใช้ Fake LLM ที่หน่วงเวลาได้ และ Vector Store จำลอง จึงรันได้โดยไม่ต้องใช้ network หรือ API key
+# ตัวอย่าง: python load_test.py --users 20 --questions 3 --llm-latency 1.5
+
+QUESTIONS = [
+    "ปลูกทุเรียนต้องมีกี่ต้นถึงจะขึ้นทะเบียนได้",
+    "แล้วต้องใช้เอกสารอะไรบ้าง",
+    "มันต้องไปยื่นที่ไหน",
+]
+
+
+class StubEmbeddings:
+    """Embedding จำลอง (คืนเวกเตอร์คงที่ และหน่วงเวลาเหมือนการ encode บน CPU)"""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+
+    def embed_query(self, text: str) -> list[float]:
+        time.sleep(self.latency_seconds)
+        return [1.0, 0.0, 0.0]
+
+
+class StubVectorStore:
+    """Vector Store จำลองที่คืนเอกสารชุดเดิมทุกครั้ง"""
+
+    def __init__(self, embed_latency: float, search_latency: float):
+        self.embeddings = StubEmbeddings(embed_latency)
+        self.search_latency = search_latency
+        self.docs = [
+            Document(page_content=f"เนื้อหาอ้างอิงทดสอบชิ้นที่ {i + 1}", metadata={"source": "load_test"})
+            for i in range(8)
+        ]
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=8, fetch_k=25, **kwargs):
+        time.sleep(self.search_latency)
+        return self.docs[:k]
+
+    def similarity_search_by_vector(self, embedding, k=8, **kwargs):
+        time.sleep(self.search_latency)
+        return self.docs[:k]
+
+
+class StubRetriever:
+    def __init__(self, vectorstore):
+        self.vectorstore = vectorstore
+        self.search_type = rag_pipeline.RETRIEVER_SEARCH_TYPE
+        self.search_kwargs = dict(rag_pipeline.RETRIEVER_SEARCH_KWARGS)
+
+
+def build_chain(args):
+    history_store = BoundedHistoryStore(max_messages=rag_pipeline.MAX_HISTORY_MESSAGES)
+    keys = [f"fake-key-{i}" for i in range(args.keys)]
+    pool = ApiKeyPool(keys, rpm_limit=100_000, tpm_limit=10**9)
+    llm = PooledChatModel(pool, lambda key: FakeChatModel(latency_seconds=args.llm_latency))
+    retriever = StubRetriever(StubVectorStore(args.embed_latency, args.search_latency))
+    # ปิด heuristic เพื่อให้คำถามต่อเนื่องต้องผ่าน Rewriter ทุกครั้ง (จำลองกรณีที่ช้าที่สุด)
+    return rag_pipeline.build_rag_chain(retriever, llm, history_store.get, skip_rewriter_heuristic=False)
+
+
+def summarize(name: str, latencies: list[float], elapsed: float):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{name:<8} requests={len(latencies):<4} เวลารวม={elapsed:6.2f}s  "
+          f"throughput={len(latencies) / elapsed:6.2f} req/s  "
+          f"p50={statistics.median(latencies):5.2f}s  p95={p95:5.2f}s")
+
+
+def run_sync(chain, args) -> tuple[list[float], float]:
+    """แบบเดิม: เรียก invoke ทีละคำขอใน process เดียว"""
+    latencies = []
+    started = time.perf_counter()
+    for user in range(args.users):
+        for question in QUESTIONS[:args.questions]:
+            t0 = time.perf_counter()
+            chain.invoke({"question": question}, config={"configurable": {"session_id": f"sync-{user}"}})
+            latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - started
+
+
+async def run_async(chain, args) -> tuple[list[float], float]:
+    """แบบใหม่: ทุก session ส่งคำถามพร้อมกันบน event loop เดียว (แต่ละ session ยังถามทีละข้อตามลำดับ)"""
+    latencies = []
+
+    async def user_session(user: int):
+        for question in QUESTIONS[:args.questions]:
+            t0 = time.perf_counter()
+            await chain.ainvoke({"question": question}, config={"configurable": {"session_id": f"async-{user}"}})
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(user) for user in range(args.users)))
+    return latencies, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test ของ RAG chain ด้วย Fake LLM")
+    parser.add_argument("--users", type=int, default=10, help="จำนวน session ที่ใช้งานพร้อมกัน")
+    parser.add_argument("--questions", type=int, default=3, help="จำนวนคำถามต่อ session")
+    parser.add_argument("--keys", type=int, default=3, help="จำนวน API key จำลองใน key pool")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="เวลาตอบของ Fake LLM (วินาที)")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="เวลา encode คำถาม (วินาที)")
+    parser.add_argument("--search-latency", type=float, default=0.01, help="เวลาค้นหาใน FAISS (วินาที)")
+    parser.add_argument("--skip-sync", action="store_true", help="ไม่ต้องรันแบบ sync (ช้ามากเมื่อ users เยอะ)")
+    args = parser.parse_args()
+
+    print(f"🚀 Load test: {args.users} sessions x {args.questions} คำถาม, LLM latency {args.llm_latency}s")
+    if not args.skip_sync:
+        summarize("sync", *run_sync(build_chain(args), args))
+    summarize("async", *asyncio.run(run_async(build_chain(args), args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# --- รายงานหน่วยความจำต่อ worker ของ api_server.py (Linux) ---
+# เทียบ 2 แบบ: baseline = แต่ละ worker โหลดโมเดลและอ่าน index.faiss เอง
+#              shared   = โหลดโมเดลครั้งเดียวใน parent ก่อน fork + อ่าน index.faiss แบบ mmap (แชร์ผ่าน page cache)
+# RSS นับหน้าที่แชร์ซ้ำในทุก process ส่วน PSS หารหน้าที่แชร์ตามจำนวน process ผลรวม PSS จึงเป็น RAM ที่ใช้จริง
+# ตัวอย่าง: python memory_report.py --workers 4
+#          python memory_report.py --workers 4 --index vectorstore_smart_chunking_v2/index.faiss  (วัดเฉพาะ index ไม่ต้องโหลดโมเดล)
+
+MODES = {
+    "baseline": {"env": {"FAISS_MMAP": "0"}, "args": ["--no-preload"]},
+    "shared": {"env": {"FAISS_MMAP": "1"}, "args": ["--preload"]},
+}
+READY_MESSAGE = "API server พร้อมให้บริการ"
+
+
+def process_memory(pid: int | str = "self") -> dict:
+    """อ่าน RSS/PSS/หน่วยความจำที่แชร์ (MB) จาก /proc/<pid>/smaps_rollup (ถ้าไม่มีใช้ VmRSS จาก status แทน)"""
+    fields = {"Rss": "rss_mb", "Pss": "pss_mb", "Shared_Clean": "shared_mb", "Shared_Dirty": "shared_mb"}
+    result = {"pid": os.getpid() if pid == "self" else int(pid), "rss_mb": 0.0, "pss_mb": None, "shared_mb": 0.0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            result["pss_mb"] = 0.0
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in fields:
+                    result[fields[key]] += int(value.split()[0]) / 1024
+    except FileNotFoundError:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    result["rss_mb"] = int(line.split()[1]) / 1024
+    return {key: round(value, 1) if isinstance(value, float) else value for key, value in result.items()}
+
+
+def child_pids(parent_pid: int) -> list[int]:
+    """หา process ลูกโดยตรงของ parent_pid จาก /proc/<pid>/stat (ช่องที่ 4 คือ ppid)"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # ชื่อ process อยู่ในวงเล็บและอาจมีช่องว่าง จึงแยกจากวงเล็บปิดตัวสุดท้าย
+        if int(stat.rsplit(")", 1)[1].split()[1]) == parent_pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def measure(mode: str, workers: int, port: int, timeout: float) -> list[dict]:
+    """เริ่ม api_server.py ตามโหมดที่เลือก รอจนทุก worker พร้อม แล้ววัดหน่วยความจำของ parent และทุก worker"""
+    env = {**os.environ, **MODES[mode]["env"], "PYTHONUNBUFFERED": "1"}
+    command = [sys.executable, "api_server.py", "--port", str(port), "--workers", str(workers), *MODES[mode]["args"]]
+    print(f"\n🚀 [{mode}] {' '.join(command[1:])}")
+    server = subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        ready, deadline = 0, time.time() + timeout
+        while ready < workers and time.time() < deadline:
+            line = server.stdout.readline()
+            if not line:
+                raise RuntimeError(f"api_server.py หยุดทำงานก่อนพร้อม (exit code {server.poll()})")
+            ready += READY_MESSAGE in line
+        if ready < workers:
+            raise TimeoutError(f"worker พร้อมเพียง {ready}/{workers} ภายใน {timeout} วินาที")
+        time.sleep(2)  # รอให้หน่วยความจำนิ่งหลังโหลดเสร็จ
+        rows = [{"role": "parent", **process_memory(server.pid)}]
+        rows += [{"role": f"worker {i + 1}", **process_memory(pid)} for i, pid in enumerate(child_pids(server.pid))]
+        return rows
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def measure_index(mode: str, workers: int, index_path: str) -> list[dict]:
+    """
+    วัดเฉพาะ index.faiss (ไม่เริ่ม api_server และไม่โหลดโมเดล): fork worker ที่ค้นหาเต็ม index แล้วค้างไว้ให้วัด
+    baseline = แต่ละ worker อ่านทั้งไฟล์เอง, shared = parent อ่านแบบ mmap (rag_pipeline.read_faiss_index) ก่อน fork
+    """
+    import faiss
+    import numpy as np
+    import rag_pipeline
+
+    shared_index = rag_pipeline.read_faiss_index(index_path) if mode == "shared" else None
+    print(f"\n🚀 [{mode}] index {index_path} ({os.path.getsize(index_path) / 2**20:.1f} MB), {workers} workers")
+    pids, ready_fds = [], []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            index = shared_index if shared_index is not None else faiss.read_index(index_path)
+            index.search(np.zeros((1, index.d), dtype=np.float32), 1)  # IndexFlat อ่านทุกเวกเตอร์ จึงแตะทุกหน้า
+            os.write(write_fd, b"1")
+            time.sleep(3600)
+            os._exit(0)
+        os.close(write_fd)
+        pids.append(pid)
+        ready_fds.append(read_fd)
+    try:
+        for fd in ready_fds:
+            os.read(fd, 1)
+            os.close(fd)
+        rows = [{"role": "parent", **process_memory(os.getpid())}]
+        rows += [{"role": f"worker {i + 1}", **process_memory(pid)} for i, pid in enumerate(pids)]
+        return rows
+    finally:
+        for pid in pids:
+            os.kill(pid, 15)
+            os.waitpid(pid, 0)
+
+
+def print_rows(mode: str, rows: list[dict]):
+    print(f"{'[' + mode + ']':<12}{'pid':>8}{'RSS MB':>12}{'PSS MB':>12}{'shared MB':>12}")
+    for row in rows:
+        pss = f"{row['pss_mb']:.1f}" if row["pss_mb"] is not None else "-"
+        print(f"{row['role']:<12}{row['pid']:>8}{row['rss_mb']:>12.1f}{pss:>12}{row['shared_mb']:>12.1f}")
+    total_rss = sum(row["rss_mb"] for row in rows)
+    total_pss = sum(row["pss_mb"] or 0 for row in rows)
+    print(f"{'รวม':<12}{'':>8}{total_rss:>12.1f}{total_pss:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="เทียบหน่วยความจำต่อ worker ของ api_server.py ก่อน/หลังแชร์ index และโมเดล")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--mode", choices=[*MODES, "both"], default="both")
+    parser.add_argument("--timeout", type=float, default=600, help="เวลารอให้ทุก worker พร้อม (วินาที)")
+    parser.add_argument("--index", help="วัดเฉพาะไฟล์ index.faiss นี้ (ไม่เริ่ม api_server)")
+    args = parser.parse_args()
+
+    for mode in (MODES if args.mode == "both" else [args.mode]):
+        if args.index:
+            print_rows(mode, measure_index(mode, args.workers, args.index))
+        else:
+            print_rows(mode, measure(mode, args.workers, args.port, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
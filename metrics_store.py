@@ -0,0 +1,192 @@
+import os
+import time
+import queue
+import atexit
+import sqlite3
+import threading
+
+# --- ที่เก็บเวลาการทำงานของแต่ละรอบคำถาม (SQLite ในเครื่อง) ---
+# บันทึกโดย tracing.TurnTracer เมื่อแต่ละรอบจบ (เขียนลง SQLite ใน thread เบื้องหลัง) แล้วสรุปเป็น percentile ต่อขั้นตอน
+# (แสดงในแถบสถิติของ app.py และที่ GET /metrics ของ api_server.py)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    session_id TEXT,
+    total_ms REAL,
+    first_token_ms REAL,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    context_chars INTEGER,
+    context_docs INTEGER,
+    error TEXT,
+    context_tokens_before INTEGER,
+    context_tokens_after INTEGER,
+    context_dropped_duplicate INTEGER,
+    context_dropped_low_relevance INTEGER,
+    context_dropped_budget INTEGER,
+    history_tokens_before INTEGER,
+    history_tokens_after INTEGER
+);
+CREATE TABLE IF NOT EXISTS stages (
+    turn_id INTEGER NOT NULL REFERENCES turns(id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    ms REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_turns_ts ON turns(ts);
+CREATE INDEX IF NOT EXISTS idx_stages_turn ON stages(turn_id);
+"""
+
+TURN_COLUMNS = (
+    "ts", "session_id", "total_ms", "first_token_ms", "input_tokens", "output_tokens", "context_chars",
+    "context_docs", "error", "context_tokens_before", "context_tokens_after", "context_dropped_duplicate",
+    "context_dropped_low_relevance", "context_dropped_budget", "history_tokens_before", "history_tokens_after",
+)
+# คอลัมน์ที่เพิ่มทีหลัง (ไฟล์ metrics.db เดิมจะถูก ALTER TABLE เพิ่มให้ตอนเปิด)
+ADDED_COLUMNS = {
+    "context_tokens_before": "INTEGER",
+    "context_tokens_after": "INTEGER",
+    "context_dropped_duplicate": "INTEGER",
+    "context_dropped_low_relevance": "INTEGER",
+    "context_dropped_budget": "INTEGER",
+    "history_tokens_before": "INTEGER",
+    "history_tokens_after": "INTEGER",
+}
+
+
+def percentile(values: list[float], p: float) -> float:
+    """percentile แบบ nearest-rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def _distribution(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 1),
+        "p95": round(percentile(values, 95), 1),
+        "p99": round(percentile(values, 99), 1),
+    }
+
+
+class MetricsStore:
+    """
+    เก็บข้อมูลของแต่ละรอบ (เวลาแต่ละขั้นตอน, จำนวน token, ขนาด context) ลง SQLite
+    ใช้ connection เดียวร่วมกันทุก thread (ป้องกันด้วย lock) และลบข้อมูลที่เก่ากว่า retention_days ทิ้ง
+    record() แค่ใส่คิว (ถูกเรียกจาก callback ใน event loop) thread เบื้องหลังเขียนเป็น batch ทุก flush_interval_seconds
+    """
+
+    def __init__(self, path: str, retention_days: int = 30, flush_interval_seconds: float = 1.0,
+                 max_pending: int = 10000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(turns)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE turns ADD COLUMN {column} {column_type}")
+        self._conn.execute("DELETE FROM turns WHERE ts < ?", (time.time() - retention_days * 86400,))
+        self._conn.commit()
+
+        self.flush_interval_seconds = flush_interval_seconds
+        # จำกัดขนาดคิวไว้ ถ้าดิสก์ช้า/เต็มจนเขียนไม่ทัน จะทิ้ง metrics แทนการกินหน่วยความจำเพิ่มเรื่อยๆ
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._run_writer, name="metrics-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def record(self, turn: dict):
+        """บันทึกหนึ่งรอบ: turn มี key ตามคอลัมน์ของตาราง turns และ stages = {ชื่อขั้นตอน: ms} (เขียนจริงใน thread เบื้องหลัง)"""
+        try:
+            self._queue.put_nowait(turn)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run_writer(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                stopping, batch = True, []
+            else:
+                batch = [item]
+            deadline = time.monotonic() + self.flush_interval_seconds
+            while not stopping:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"⚠️ บันทึก metrics ไม่สำเร็จ ({len(batch)} รอบ): {e}")
+
+    def _write(self, turns: list[dict]):
+        with self._lock:
+            for turn in turns:
+                cursor = self._conn.execute(
+                    f"INSERT INTO turns ({', '.join(TURN_COLUMNS)}) VALUES ({', '.join('?' * len(TURN_COLUMNS))})",
+                    [turn.get("ts", time.time()), *(turn.get(column) for column in TURN_COLUMNS[1:])],
+                )
+                self._conn.executemany(
+                    "INSERT INTO stages (turn_id, stage, ms) VALUES (?, ?, ?)",
+                    [(cursor.lastrowid, stage, ms) for stage, ms in turn.get("stages", {}).items()],
+                )
+            self._conn.commit()
+
+    def close(self, timeout: float = 10.0):
+        """เขียน metrics ที่ค้างอยู่ให้หมดแล้วหยุด thread เบื้องหลัง (เรียกซ้ำได้)"""
+        if self._writer.is_alive():
+            try:
+                self._queue.put(None, timeout=timeout)
+            except queue.Full:
+                return
+            self._writer.join(timeout)
+
+    def summary(self, window_seconds: float = 24 * 3600) -> dict:
+        """สรุป p50/p95/p99 ของแต่ละขั้นตอนและของทั้งรอบ ภายในช่วงเวลาล่าสุด"""
+        since = time.time() - window_seconds
+        with self._lock:
+            turns = self._conn.execute(
+                "SELECT total_ms, first_token_ms, input_tokens, output_tokens, context_chars, error, "
+                "context_tokens_before - context_tokens_after, history_tokens_before - history_tokens_after "
+                "FROM turns WHERE ts >= ?", (since,)
+            ).fetchall()
+            stage_rows = self._conn.execute(
+                "SELECT s.stage, s.ms FROM stages s JOIN turns t ON t.id = s.turn_id WHERE t.ts >= ?", (since,)
+            ).fetchall()
+        stages: dict[str, list[float]] = {}
+        for stage, ms in stage_rows:
+            stages.setdefault(stage, []).append(ms)
+
+        def column(index: int) -> list[float]:
+            return [row[index] for row in turns if row[index] is not None]
+
+        return {
+            "window_hours": round(window_seconds / 3600, 1),
+            "turns": len(turns),
+            "errors": sum(1 for row in turns if row[5]),
+            "dropped_records": self.dropped,
+            "total_ms": _distribution(column(0)),
+            "first_token_ms": _distribution(column(1)),
+            "stages_ms": {stage: _distribution(values) for stage, values in sorted(stages.items())},
+            "input_tokens": _distribution(column(2)),
+            "output_tokens": _distribution(column(3)),
+            "context_chars": _distribution(column(4)),
+            "context_tokens_saved": _distribution(column(6)),
+            "history_tokens_saved": _distribution(column(7)),
+        }
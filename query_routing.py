@@ -0,0 +1,75 @@
+import re
+import threading
+from collections import Counter
+
+# --- ตรวจว่าคำถามสมบูรณ์ในตัวเองหรือไม่ (ใช้ตัดสินใจว่าจะข้ามการเรียก Rewriter LLM ได้หรือไม่) ---
+
+# คำ/วลีที่บ่งบอกว่าคำถามอ้างอิงถึงบทสนทนาก่อนหน้า (สรรพนาม, คำชี้, คำลงท้ายของคำถามต่อเนื่อง)
+FOLLOW_UP_MARKERS = (
+    "อันนี้", "อันนั้น", "ตัวนี้", "ตัวนั้น", "แบบนี้", "แบบนั้น", "อย่างนี้", "อย่างนั้น",
+    "กรณีนี้", "กรณีนั้น", "ข้อนี้", "ข้อนั้น", "เรื่องนี้", "เรื่องนั้น", "พืชนี้", "พืชนั้น",
+    "ดังกล่าว", "ข้างต้น", "เมื่อกี้", "เมื่อกี๊", "ที่ว่า", "ที่บอก", "เหมือนกัน",
+    "ด้วยไหม", "ด้วยมั้ย", "ล่ะ", "หละ", "เขา", "เค้า", "มัน",
+)
+# คำขึ้นต้นที่มักเป็นคำถามต่อเนื่อง เช่น "แล้วมะม่วงล่ะ", "ส่วนทุเรียน..."
+FOLLOW_UP_PREFIXES = ("แล้ว", "และ", "ส่วน", "งั้น", "ถ้างั้น", "อีก", "ต่อ")
+# คำที่มีคำสรรพนามซ่อนอยู่แต่ไม่ใช่สรรพนาม (ตัดออกก่อนตรวจ)
+NON_PRONOUN_WORDS = (
+    "มันสำปะหลัง", "มันเทศ", "มันฝรั่ง", "มันแกว", "มันขี้หนู", "มันเลือด", "มันม่วง", "มันมือเสือ", "มันปู",
+    "ภูเขา", "เขาสัตว์",
+)
+# ชื่อโครงการ/เอกสาร/หน่วยงานที่ทำให้คำถามมีประธานชัดเจน (คำถามที่ไม่มีทั้งคำเหล่านี้และชื่อพืช เช่น
+# "ต้องปลูกกี่ต้นต่อไร่" มักละประธานไว้ และต้องอาศัยบทสนทนาก่อนหน้า)
+ENTITY_NOUNS = (
+    "ทะเบียนเกษตรกร", "ขึ้นทะเบียน", "ปรับปรุงทะเบียน", "ปรับปรุงข้อมูล", "ทบก", "แบบคำร้อง", "แบบฟอร์ม",
+    "สมุดทะเบียน", "เล่มเขียว", "บัตรประชาชน", "บัตรประจำตัวประชาชน", "หลักฐานการใช้ประโยชน์ที่ดิน", "เอกสารสิทธิ์",
+    "โฉนด", "ครัวเรือน", "คู่สมรส", "มอบอำนาจ", "ประชาคม", "สำนักงานเกษตร", "เจ้าหน้าที่", "อาสาสมัครเกษตร",
+    "อกม", "farmbook", "e-form", "efarmer",
+)
+ENGLISH_PRONOUN_PATTERN = re.compile(r"\b(it|its|this|that|these|those|they|them)\b", re.IGNORECASE)
+ELLIPSIS_PATTERN = re.compile(r"(\.\.\.|…|ฯลฯ)")
+MIN_STANDALONE_LENGTH = 8
+
+
+def mentions_known_entity(question: str, entity_matcher=None) -> bool:
+    """คำถามระบุสิ่งที่ถามถึงชัดเจนหรือไม่ (คำใน ENTITY_NOUNS หรือ entity_matcher(question) เป็นจริง เช่น พบชื่อพืชในตาราง)"""
+    lowered = question.lower()
+    if any(noun in lowered for noun in ENTITY_NOUNS):
+        return True
+    return entity_matcher is not None and bool(entity_matcher(question))
+
+
+def is_self_contained_question(question: str, entity_matcher=None) -> bool:
+    """
+    ตรวจแบบเร็ว (ไม่เรียก LLM) ว่าคำถามติดตามผลสามารถเข้าใจได้โดยไม่ต้องอาศัยบทสนทนาก่อนหน้าหรือไม่
+    คืน False ถ้าพบสรรพนาม/คำชี้, การละคำ (...), คำขึ้นต้นแบบคำถามต่อเนื่อง, คำถามสั้นเกินไป
+    หรือไม่ได้ระบุสิ่งที่ถามถึง (ดู mentions_known_entity)
+    """
+    text = question.strip()
+    if len(text) < MIN_STANDALONE_LENGTH:
+        return False
+    if ELLIPSIS_PATTERN.search(text) or ENGLISH_PRONOUN_PATTERN.search(text):
+        return False
+    if text.startswith(FOLLOW_UP_PREFIXES):
+        return False
+    for word in NON_PRONOUN_WORDS:
+        text = text.replace(word, " ")
+    if any(marker in text for marker in FOLLOW_UP_MARKERS):
+        return False
+    return mentions_known_entity(question, entity_matcher)
+
+
+class PathCounter:
+    """ตัวนับจำนวนครั้งที่แต่ละเส้นทางการทำงานถูกใช้ (thread-safe, ใช้ร่วมกันทุก session)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, path: str):
+        with self._lock:
+            self._counts[path] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
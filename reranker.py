@@ -0,0 +1,100 @@
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+
+from embedding_backend import normalize_query
+
+# --- Cross-Encoder Reranker (รันบน CPU) ---
+# ให้คะแนนคู่ (คำถาม, chunk) ทีละ batch แล้วเก็บเฉพาะอันดับต้นๆ เพื่อส่ง chunk ที่น้อยลงแต่ตรงกว่าให้ Gemini
+# คะแนนของแต่ละคู่ถูก cache ด้วย key (hash ของคำถาม, id ของ chunk) คำถามยอดนิยมจึงไม่ต้องคำนวณซ้ำ
+
+RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # multilingual (รองรับภาษาไทย) ขนาดเล็ก
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_id(doc: Document) -> str:
+    """id ของ chunk จากเนื้อหา (ตรงกันไม่ว่า index จะสร้างด้วย id แบบไหน)"""
+    return hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()[:16]
+
+
+class CrossEncoderReranker:
+    """
+    จัดอันดับเอกสารใหม่ด้วย cross-encoder
+    จำกัดต้นทุนด้วย max_candidates (จำนวนคู่สูงสุดต่อคำถาม) และ max_length (ความยาว token ต่อคู่)
+    """
+
+    def __init__(self, model_name: str = RERANK_MODEL, top_n: int = 4, max_candidates: int = 25,
+                 batch_size: int = 16, max_length: int = 384, cache_size: int = 20000):
+        self.model_name = model_name
+        self.top_n = top_n
+        self.max_candidates = max_candidates
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self._model = None
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[tuple[str, str], float] = OrderedDict()
+        self._totals = {"requests": 0, "pairs_scored": 0, "pairs_cached": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    def _load_model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            print(f"กำลังโหลด Reranker '{self.model_name}' (CPU)...")
+            self._model = CrossEncoder(self.model_name, device="cpu", max_length=self.max_length)
+        return self._model
+
+    def score(self, query: str, docs: list[Document]) -> list[float]:
+        """คะแนนของแต่ละเอกสาร (ใช้คะแนนจาก cache ถ้ามี และคำนวณเฉพาะคู่ที่ยังไม่เคยเห็นในครั้งเดียว)"""
+        q_hash = query_hash(query)
+        keys = [(q_hash, chunk_id(doc)) for doc in docs]
+        with self._lock:
+            scores = [self._cache.get(key) for key in keys]
+            for key, score in zip(keys, scores):
+                if score is not None:
+                    self._cache.move_to_end(key)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            predicted = self._load_model().predict(
+                [(query, docs[i].page_content) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._cache[keys[i]] = float(score)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        with self._lock:
+            self._totals["pairs_scored"] += len(missing)
+            self._totals["pairs_cached"] += len(docs) - len(missing)
+        return scores
+
+    def rerank(self, query: str, docs: list[Document], top_n: int | None = None) -> list[Document]:
+        """คืนเอกสารที่ได้คะแนนสูงสุด top_n ชิ้น (พิจารณาเฉพาะ max_candidates ชิ้นแรก)"""
+        started = time.perf_counter()
+        candidates = docs[:self.max_candidates]
+        scores = self.score(query, candidates) if candidates else []
+        ranked = sorted(zip(candidates, scores), key=lambda pair: pair[1], reverse=True)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._totals["requests"] += 1
+            self._totals["total_ms"] += elapsed_ms
+            self._totals["max_ms"] = max(self._totals["max_ms"], elapsed_ms)
+        return [doc for doc, _ in ranked[:top_n or self.top_n]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+            totals["cache_entries"] = len(self._cache)
+        requests = totals["requests"] or 1
+        totals["avg_ms"] = round(totals.pop("total_ms") / requests, 1)
+        totals["max_ms"] = round(totals["max_ms"], 1)
+        return totals
@@ -0,0 +1,140 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+
+# --- Sparse Index (BM25) สำหรับ Hybrid Retrieval ---
+# สร้างคู่กับ FAISS index ตอนรัน 2MD_prepare_vectorstore.py แล้วบันทึกเป็น bm25_index.json ข้าง index.faiss
+# ใช้จับคำที่ต้องตรงตัว (ชื่อพืช, เลขแบบฟอร์ม, ตัวย่อ เช่น "ทบก.") ที่ dense embedding มักพลาด
+# ตัดคำภาษาไทยด้วย pythainlp (newmm) ถ้าไม่ได้ติดตั้งจะใช้ character bigram ของช่วงอักษรไทยแทน
+
+SPARSE_INDEX_FILE = "bm25_index.json"
+INDEX_VERSION = 1
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+THAI_RUN_PATTERN = re.compile(r"[\u0e00-\u0e7f]+")
+TOKEN_PATTERN = re.compile(r"[\u0e00-\u0e7f]+|[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+
+try:
+    from pythainlp.tokenize import word_tokenize as _thai_word_tokenize
+    DEFAULT_TOKENIZER = "newmm"
+except ImportError:
+    _thai_word_tokenize = None
+    DEFAULT_TOKENIZER = "bigram"
+
+
+def _thai_bigrams(run: str) -> list[str]:
+    return [run] if len(run) < 3 else [run[i:i + 2] for i in range(len(run) - 1)]
+
+
+def tokenize(text: str, tokenizer: str = DEFAULT_TOKENIZER) -> list[str]:
+    """
+    ตัดข้อความเป็น token สำหรับ BM25 (ตัวพิมพ์เล็ก, ตัดเครื่องหมาย/ช่องว่างทิ้ง)
+    ตัวย่อไทยอย่าง "ทบก." จะเหลือ "ทบก" ทั้งตอนสร้าง index และตอนค้นหา จึงจับคู่กันได้
+    """
+    text = text.lower().replace("\u200b", "")
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        piece = match.group(0)
+        if not THAI_RUN_PATTERN.fullmatch(piece):
+            tokens.append(piece)
+        elif tokenizer == "newmm":
+            tokens.extend(t for t in _thai_word_tokenize(piece, engine="newmm", keep_whitespace=False) if t.strip())
+        else:
+            tokens.extend(_thai_bigrams(piece))
+    return tokens
+
+
+class BM25Index:
+    """Inverted index แบบ BM25 เก็บ posting list ของแต่ละคำ (doc ที่มีคำนั้น และจำนวนครั้งที่พบ)"""
+
+    def __init__(self, doc_ids: list[str], doc_lengths: list[int], postings: dict[str, list[list[int]]],
+                 tokenizer: str = DEFAULT_TOKENIZER, k1: float = BM25_K1, b: float = BM25_B):
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.tokenizer = tokenizer
+        self.k1 = k1
+        self.b = b
+        self.avg_doc_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+        n_docs = len(doc_ids)
+        self.idf = {
+            term: math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in postings.items()
+        }
+
+    @classmethod
+    def build(cls, doc_ids: list[str], texts: list[str], tokenizer: str = DEFAULT_TOKENIZER) -> "BM25Index":
+        postings: dict[str, list[list[int]]] = {}
+        doc_lengths = []
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text, tokenizer))
+            doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append([i, tf])
+        return cls(doc_ids, doc_lengths, postings, tokenizer=tokenizer)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "tokenizer": self.tokenizer,
+            "k1": self.k1,
+            "b": self.b,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+
+    def save(self, vectorstore_path: str) -> bool:
+        """บันทึกไว้ข้าง index.faiss (เขียนเฉพาะเมื่อเนื้อหาเปลี่ยน เช่นเดียวกับตารางเกณฑ์พืช)"""
+        path = os.path.join(vectorstore_path, SPARSE_INDEX_FILE)
+        content = json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                if f.read() == content:
+                    return False
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return True
+
+    @classmethod
+    def load(cls, vectorstore_path: str) -> "BM25Index | None":
+        """คืน None ถ้ายังไม่ได้สร้าง หรือสร้างด้วย tokenizer ที่เครื่องนี้ไม่มี (ผลตัดคำจะไม่ตรงกัน)"""
+        path = os.path.join(vectorstore_path, SPARSE_INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != INDEX_VERSION:
+            return None
+        if data["tokenizer"] == "newmm" and _thai_word_tokenize is None:
+            print("⚠️ bm25_index.json สร้างด้วย pythainlp แต่เครื่องนี้ไม่ได้ติดตั้ง จึงปิด Hybrid Retrieval")
+            return None
+        return cls(data["doc_ids"], data["doc_lengths"], data["postings"],
+                   tokenizer=data["tokenizer"], k1=data["k1"], b=data["b"])
+
+    def search(self, query: str, k: int = 10) -> list[tuple[str, float]]:
+        """คืน [(doc_id, score)] ที่ได้คะแนน BM25 สูงสุด k อันดับ"""
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query, self.tokenizer)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for doc_index, tf in posting:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_index] / self.avg_doc_length)
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.doc_ids[doc_index], score) for doc_index, score in top]
+
+
+def reciprocal_rank_fusion(rankings: list[list[str]], k: int = 60) -> list[str]:
+    """รวมหลายอันดับเข้าด้วยกันด้วย RRF: score = sum(1 / (k + rank)) แล้วเรียงจากมากไปน้อย"""
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,146 @@
+import time
+import threading
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# --- Tracing เวลาของแต่ละขั้นตอนใน RAG chain (หนึ่ง TurnTracer ต่อหนึ่งคำถาม) ---
+# ขั้นตอนที่ติดตามตั้งชื่อไว้ด้วย .with_config(run_name=...) ใน rag_pipeline.build_rag_chain
+# เมื่อ chain จบ (หรือ error) จะบันทึกเวลา, จำนวน token และขนาด context ลง MetricsStore
+
+TRACED_STAGES = ("compact_history", "rewriter", "speculative_retrieve", "embed_query", "retrieve", "rerank", "pack_context", "format_docs", "answer_prompt", "answer_llm")
+
+
+def _unwrap_output(outputs):
+    """LangChain ส่ง output ที่ไม่ใช่ dict มาในรูป {"output": ...}"""
+    if isinstance(outputs, dict) and set(outputs) == {"output"}:
+        return outputs["output"]
+    return outputs
+
+
+class TurnTracer(BaseCallbackHandler):
+    """
+    Callback handler ที่จับเวลาขั้นตอนที่ตั้งชื่อไว้ (TRACED_STAGES) ของคำถามหนึ่งรอบ
+    นับ token ของ LLM แยกตามขั้นตอนที่เรียก (rewriter / answer_llm) และวัดเวลาถึง token แรกของคำตอบ
+    """
+
+    run_inline = True  # เรียกใน event loop โดยตรง (ไม่ส่งไป thread pool) เพื่อให้เวลาที่วัดได้ตรง
+
+    def __init__(self, metrics_store=None, session_id: str | None = None):
+        self.metrics_store = metrics_store
+        self.session_id = session_id
+        self.stages: dict[str, float] = {}
+        self.tokens: dict[str, dict[str, int]] = {}
+        self.context_chars = 0
+        self.context_docs = 0
+        self.context_packing: dict = {}
+        self.history_compaction: dict = {}
+        self.first_token_ms: float | None = None
+        self.total_ms: float | None = None
+        self.error: str | None = None
+        self._lock = threading.Lock()
+        self._runs: dict[UUID, tuple[UUID | None, str | None]] = {}
+        self._stage_starts: dict[UUID, float] = {}
+        self._root_run_id: UUID | None = None
+        self._started = time.perf_counter()
+
+    # --- helpers ---
+
+    def _elapsed_ms(self, since: float) -> float:
+        return (time.perf_counter() - since) * 1000
+
+    def _stage_of(self, run_id: UUID | None) -> str | None:
+        """หาขั้นตอนที่ตั้งชื่อไว้ที่ใกล้ที่สุดจาก run ปัจจุบันขึ้นไปหา parent"""
+        while run_id is not None:
+            parent_run_id, name = self._runs.get(run_id, (None, None))
+            if name in TRACED_STAGES:
+                return name
+            run_id = parent_run_id
+        return None
+
+    def _start(self, run_id: UUID, parent_run_id: UUID | None, name: str | None):
+        with self._lock:
+            self._runs[run_id] = (parent_run_id, name)
+            if parent_run_id is None and self._root_run_id is None:
+                self._root_run_id = run_id
+                self._started = time.perf_counter()
+            if name in TRACED_STAGES:
+                self._stage_starts[run_id] = time.perf_counter()
+
+    def _finish(self):
+        self.total_ms = self._elapsed_ms(self._started)
+        if self.metrics_store is not None:
+            # record() แค่ใส่คิว การเขียน SQLite อยู่ใน thread ของ MetricsStore (callback นี้รันใน event loop)
+            self.metrics_store.record(self.as_record())
+
+    # --- chain callbacks ---
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, kwargs.get("name") or (serialized or {}).get("name"))
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            name = self._runs.get(run_id, (None, None))[1]
+            started = self._stage_starts.pop(run_id, None)
+            if started is not None:
+                self.stages[name] = self.stages.get(name, 0.0) + self._elapsed_ms(started)
+            output = _unwrap_output(outputs)
+            if name in ("retrieve", "pack_context") and isinstance(output, list):
+                self.context_docs = len(output)
+            elif name == "format_docs" and isinstance(output, str):
+                self.context_chars = len(output)
+            is_root = run_id == self._root_run_id
+        if is_root:
+            self._finish()
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        if run_id == self._root_run_id:
+            self.error = f"{type(error).__name__}: {error}"
+            self._finish()
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == "context_packing":
+            self.context_packing = dict(data)
+        elif name == "history_compaction":
+            self.history_compaction = dict(data)
+
+    # --- LLM callbacks ---
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "chat_model")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "llm")
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if self.first_token_ms is None and token and self._stage_of(run_id) == "answer_llm":
+            self.first_token_ms = self._elapsed_ms(self._started)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        stage = self._stage_of(run_id) or "other_llm"
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                with self._lock:
+                    counts = self.tokens.setdefault(stage, {"input": 0, "output": 0})
+                    counts["input"] += int(usage.get("input_tokens", 0))
+                    counts["output"] += int(usage.get("output_tokens", 0))
+
+    # --- ผลลัพธ์ ---
+
+    def as_record(self) -> dict:
+        """ข้อมูลของรอบนี้ในรูปที่ MetricsStore.record รับ"""
+        return {
+            "ts": time.time(),
+            "session_id": self.session_id,
+            "total_ms": self.total_ms,
+            "first_token_ms": self.first_token_ms,
+            "input_tokens": sum(c["input"] for c in self.tokens.values()),
+            "output_tokens": sum(c["output"] for c in self.tokens.values()),
+            "context_chars": self.context_chars,
+            "context_docs": self.context_docs,
+            "error": self.error,
+            **{f"context_{key}": value for key, value in self.context_packing.items()},
+            **{f"history_{key}": value for key, value in self.history_compaction.items()},
+            "stages": {stage: round(ms, 1) for stage, ms in self.stages.items()},
+        }
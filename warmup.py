@@ -0,0 +1,80 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# --- โหลดทรัพยากรหนักๆ ใน background thread ตอนเริ่ม process ---
+# หน้าเว็บแสดงได้ทันที ส่วนการ import LangChain, โหลดโมเดล e5, เปิด Vector Store และอุ่นเครื่อง encoder ทำอยู่เบื้องหลัง
+# บันทึกเวลาของแต่ละขั้นตอน (phase) ไว้ดูว่าช่วงไหนทำให้เริ่มระบบช้า
+
+
+class StartupWarmup:
+    """
+    รัน target(warmup) ใน daemon thread หนึ่งครั้ง
+    target ครอบแต่ละขั้นตอนด้วย `with warmup.phase("ชื่อ"):` และคืนทรัพยากรที่โหลดเสร็จ (ได้จาก wait())
+    """
+
+    def __init__(self, target, name: str = "startup-warmup"):
+        self._target = target
+        self._name = name
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._started: float | None = None
+        self.phases: dict[str, float] = {}
+        self.current_phase: str | None = None
+        self.total_ms: float | None = None
+        self.result = None
+        self.error: str | None = None
+
+    def start(self) -> "StartupWarmup":
+        self._started = time.perf_counter()
+        threading.Thread(target=self._run, name=self._name, daemon=True).start()
+        return self
+
+    def _run(self):
+        try:
+            self.result = self._target(self)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            print(f"❌ เตรียมระบบไม่สำเร็จ: {self.error}")
+        finally:
+            self.total_ms = (time.perf_counter() - self._started) * 1000
+            with self._lock:
+                self.current_phase = None
+            self._done.set()
+        if self.error is None:
+            breakdown = ", ".join(f"{name} {ms / 1000:.1f}s" for name, ms in self.phases.items())
+            print(f"✅ เตรียมระบบเสร็จใน {self.total_ms / 1000:.1f} วินาที ({breakdown})")
+
+    @contextmanager
+    def phase(self, name: str):
+        with self._lock:
+            self.current_phase = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = (time.perf_counter() - started) * 1000
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float | None = None):
+        """รอจนโหลดเสร็จแล้วคืนผลของ target (โยน RuntimeError ถ้าโหลดไม่สำเร็จ, TimeoutError ถ้าเกินเวลา)"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"ระบบยังเตรียมไม่เสร็จ (ขั้นตอน: {self.current_phase})")
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self.result
+
+    def stats(self) -> dict:
+        with self._lock:
+            phases = {name: round(ms, 1) for name, ms in self.phases.items()}
+            current_phase = self.current_phase
+        if not self.done:
+            status = "loading"
+        else:
+            status = "failed" if self.error is not None else "ready"
+        return {"status": status, "current_phase": current_phase, "phases_ms": phases,
+                "total_ms": round(self.total_ms, 1) if self.total_ms is not None else None, "error": self.error}